@@ -0,0 +1,115 @@
+"""
+Small in-process caches.
+
+Entries are not shared between processes, so keys must carry whatever
+versions the cached value depends on (e.g. Chart.updated) instead of relying
+on explicit invalidation from other processes such as management commands.
+"""
+
+import threading, time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+class LRUCache(object):
+    """
+    Thread safe mapping holding at most `size` entries; the least recently
+    used entry is evicted first. Entries older than `ttl` seconds (if given,
+    per cache or per entry) are treated as missing.
+    """
+    def __init__(self, size=1000, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                self.misses += 1
+                return default
+            # Re-insert to mark the entry as most recently used.
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        expires = ttl and time.time() + ttl or None
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.size:
+                del self.entries[iter(self.entries).next()]
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self.entries)
+
+class ObjectPool(object):
+    """
+    Reusable objects that must not be used by two threads at the same time
+    (e.g. mapnik maps), pooled per key. At most `size` keys are kept (least
+    recently used first out) with up to `per_key` idle objects each.
+    """
+    def __init__(self, size=16, per_key=4):
+        self.pools = LRUCache(size)
+        self.per_key = per_key
+        self.lock = threading.Lock()
+
+    def checkout(self, key, create):
+        """Take an idle object for `key` out of the pool, or create() one."""
+        self.lock.acquire()
+        try:
+            idle = self.pools.get(key)
+            obj = None
+            if idle:
+                obj = idle.pop()
+        finally:
+            self.lock.release()
+        if obj is None:
+            obj = create()
+        return obj
+
+    def checkin(self, key, obj):
+        """Return an object taken with checkout() once it is no longer used."""
+        self.lock.acquire()
+        try:
+            idle = self.pools.get(key)
+            if idle is None:
+                idle = []
+                self.pools.set(key, idle)
+            if len(idle) < self.per_key:
+                idle.append(obj)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.pools.clear()
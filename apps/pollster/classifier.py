@@ -0,0 +1,190 @@
+"""
+Vectorized health status classification of weekly results.
+
+The rules are the same as HEALTH_STATUS_SQL in models.py but are evaluated
+with NumPy boolean masks over whole columns, so a full season of weekly rows
+(including archived _vx_ tables) can be reclassified in one pass and
+alternative case definitions can be computed without writing SQL for every
+database dialect.
+
+Columns are float arrays where NaN stands for SQL NULL; the helpers of
+Columns reproduce SQL three-valued logic, i.e. a condition on a NULL value
+never matches and "not X" only matches when X is known to be false.
+"""
+
+from django.db import connection, transaction
+import time, warnings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    warnings.warn("No working version for library 'numpy' found. Continuing without vectorized health status classification")
+
+HEALTH_STATUS_COLUMNS = (
+    'Q1_0', 'Q1_1', 'Q1_2', 'Q1_3', 'Q1_4', 'Q1_5', 'Q1_6', 'Q1_7', 'Q1_8',
+    'Q1_9', 'Q1_11', 'Q1_14', 'Q1_15', 'Q1_16', 'Q1_17', 'Q1_18',
+    'Q5', 'Q6b', 'Q6d', 'Q11',
+)
+
+DEFAULT_STATUS = 'NON-SPECIFIC-SYMPTOMS'
+
+class Columns(object):
+    def __init__(self, data, length):
+        self.data = data
+        self.length = length
+
+    def get(self, name):
+        # Columns missing from the table (e.g. older survey versions) are NULL.
+        if name not in self.data:
+            return numpy.repeat(numpy.nan, self.length)
+        return self.data[name]
+
+    def true(self, name):
+        return self.get(name) == 1
+
+    def false(self, name):
+        return self.get(name) == 0
+
+    def eq(self, name, value):
+        return self.get(name) == value
+
+    def isin(self, name, values):
+        column = self.get(name)
+        return reduce(numpy.logical_or, [column == value for value in values])
+
+    def null(self, name):
+        return numpy.isnan(self.get(name))
+
+    def count(self, *names):
+        return sum([self.true(name).astype(numpy.int8) for name in names])
+
+def _sudden_onset(c):
+    return c.eq('Q5', 0) | c.eq('Q6b', 0)
+
+def _respiratory(c):
+    return c.true('Q1_5') | c.true('Q1_6') | c.true('Q1_7')
+
+def _ili(c):
+    systemic = c.true('Q1_1') | c.true('Q1_2') | c.isin('Q6d', (3, 4, 5)) | c.true('Q1_11') | c.true('Q1_8') | c.true('Q1_9')
+    return _sudden_onset(c) & systemic & _respiratory(c)
+
+def _ili_fever(c):
+    return _sudden_onset(c) & c.true('Q1_1') & _respiratory(c)
+
+def _allergy(c):
+    return (c.false('Q1_1') & c.false('Q1_2')
+            & (c.eq('Q6d', 0) | c.null('Q6d'))
+            & (c.true('Q1_3') | c.true('Q1_4') | c.true('Q1_14'))
+            & c.eq('Q11', 2))
+
+def _common_cold(c):
+    # note: common cold after all allergy-related branches
+    return c.count('Q1_3', 'Q1_4', 'Q1_6', 'Q1_5') >= 2
+
+def _gastrointestinal(c):
+    return c.count('Q1_17', 'Q1_15', 'Q1_16', 'Q1_18') >= 2
+
+def _case_definition(ili):
+    # Ordered (status, rule) pairs: the first matching rule wins, rows not
+    # matching any rule get DEFAULT_STATUS.
+    return (
+        ('NO-SYMPTOMS', lambda c: c.true('Q1_0')),
+        ('ILI', ili),
+        ('ALLERGY-or-HAY-FEVER-and-GASTROINTESTINAL', lambda c: _allergy(c) & _gastrointestinal(c)),
+        ('ALLERGY-or-HAY-FEVER', _allergy),
+        ('COMMON-COLD-and-GASTROINTESTINAL', lambda c: _common_cold(c) & _gastrointestinal(c)),
+        ('COMMON-COLD', _common_cold),
+        ('GASTROINTESTINAL', _gastrointestinal),
+    )
+
+CASE_DEFINITIONS = {
+    # Same as HEALTH_STATUS_SQL.
+    'default': _case_definition(_ili),
+    # ILI requires fever, cf. epidb_health_status_fever in scripts/cohorts.
+    'fever': _case_definition(_ili_fever),
+}
+
+def classify(data, length, rules=CASE_DEFINITIONS['default'], default=DEFAULT_STATUS):
+    """
+    Classify `length` rows given as a dictionary of column arrays; returns an
+    array with the status of every row.
+    """
+    if numpy is None:
+        raise RuntimeError("the vectorized classifier requires numpy")
+    columns = Columns(data, length)
+    names = [status for status, rule in rules] + [default]
+    codes = numpy.empty(length, dtype=numpy.int8)
+    codes.fill(len(rules))
+    # Apply the rules last to first so that the first matching one wins.
+    for code in range(len(rules) - 1, -1, -1):
+        codes[rules[code][1](columns)] = code
+    return numpy.array(names, dtype=object)[codes]
+
+def _to_float(value):
+    if value is None:
+        return numpy.nan
+    return float(value)
+
+def load_columns(table, chunk_size=10000):
+    """
+    Read the id and the classification columns of `table`; returns
+    (ids, data) where data maps column names to float arrays.
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    existing = [row[0] for row in connection.introspection.get_table_description(cursor, table)]
+    names = [name for name in HEALTH_STATUS_COLUMNS if name in existing]
+    cursor.execute("SELECT %s FROM %s ORDER BY id" % (', '.join([qn(n) for n in ['id'] + names]), qn(table)))
+    values = [[] for n in range(len(names) + 1)]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            for i, value in enumerate(row):
+                values[i].append(value)
+    ids = numpy.array(values[0], dtype=numpy.int64)
+    data = dict([(name, numpy.array([_to_float(v) for v in values[i + 1]])) for i, name in enumerate(names)])
+    return ids, data
+
+def store_health_status(target, ids, statuses):
+    """Replace the contents of the `target` status table."""
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s" % (qn(target),))
+    cursor.executemany("INSERT INTO %s (pollster_results_weekly_id, status) VALUES (%%s, %%s)" % (qn(target),),
+                       [(int(i), str(s)) for i, s in zip(ids, statuses)])
+    transaction.commit_unless_managed()
+
+def classify_table(table, target, rules=CASE_DEFINITIONS['default']):
+    """
+    Reclassify every row of the weekly results `table` into the status table
+    `target`; returns the number of rows classified.
+    """
+    ids, data = load_columns(table)
+    statuses = classify(data, len(ids), rules)
+    store_health_status(target, ids, statuses)
+    return len(ids)
+
+def random_columns(length, seed=None):
+    """Generate plausible weekly answers, including NULLs, for tests and benchmarks."""
+    rnd = numpy.random.RandomState(seed)
+    data = {}
+    for name in HEALTH_STATUS_COLUMNS:
+        if name.startswith('Q1_'):
+            values = (rnd.random_sample(length) < 0.3).astype(float)
+            nulls = rnd.random_sample(length) < 0.02
+        else:
+            values = rnd.randint(0, 6, length).astype(float)
+            nulls = rnd.random_sample(length) < 0.2
+        values[nulls] = numpy.nan
+        data[name] = values
+    return data
+
+def benchmark(length=1000000, rules=CASE_DEFINITIONS['default']):
+    """Classify `length` random rows; returns the throughput in rows/second."""
+    data = random_columns(length, seed=0)
+    start = time.time()
+    classify(data, length, rules)
+    return length / max(time.time() - start, 1e-9)
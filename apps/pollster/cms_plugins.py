@@ -5,6 +5,8 @@ from apps.survey.views import _get_person_health_status
 from .models import SurveyPlugin
 from .models import SurveyChartPlugin
 from .models import TranslationSurvey
+from .models import load_survey_tree
+from .models import update_health_status, update_last_survey
 from .utils import get_user_profile
 from .fields import PostalCodeField
 from .middleware import ForceResponse
@@ -71,7 +73,7 @@ class CMSSurveyPlugin(CMSPluginBase):
                 if locale_code == "en-US":
                     locale_code = "en-GB"
             translation = _get_object_or_none(TranslationSurvey, survey=survey, language=language, status="PUBLISHED")
-            survey.set_translation_survey(translation)
+            load_survey_tree(survey, translation)
             last_participation_data = survey.get_last_participation_data(user_id, global_id)
 
             # If this is a POST try to save the data and possibly display the result or redirect.
@@ -83,7 +85,10 @@ class CMSSurveyPlugin(CMSPluginBase):
                 data['timestamp'] = datetime.datetime.now()
                 form = survey.as_form()(data)
                 if form.is_valid():
-                    form.save()
+                    result = form.save()
+                    if survey.shortname == 'weekly':
+                        update_health_status([result.id])
+                        update_last_survey(user_id)
                     # If we have an explicit redirect URL we redirect there, else we redirect
                     # on this very same page setting success to 1 to avoid multiple POSTs.
                     next_url = instance.redirect_path or request.path
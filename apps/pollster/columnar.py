@@ -0,0 +1,319 @@
+"""
+Column-wise export of results tables for analysis pipelines.
+
+An export is a directory holding one NumPy .npy file per column array plus a
+metadata.json describing the survey, its questions and options and how every
+column is encoded:
+
+    int       <column>.npy int64 values
+    float     <column>.npy float64 values (NaN for NULL)
+    bool      <column>.npy bit-packed values (numpy.packbits)
+    date      <column>.npy int32 days since 1970-01-01
+    datetime  <column>.npy int64 microseconds since 1970-01-01 (naive)
+    string    <column>.npy int32 codes into the column "dictionary", -1 for NULL
+
+Columns that can be NULL also get a bit-packed <column>.mask.npy (set bits
+are NULL). Unlike a .npz archive every array can be memory-mapped, so loading
+a season is an mmap of the columns that are actually used rather than a parse
+of the whole CSV.
+"""
+
+from . import json
+import datetime, os, warnings
+
+try:
+    import numpy
+    from numpy.lib import format as npy_format
+except ImportError:
+    numpy = None
+    warnings.warn("No working version for library 'numpy' found. Continuing without columnar results export")
+
+FORMAT_VERSION = 1
+METADATA_FILE = 'metadata.json'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+COLUMN_ENCODINGS = {
+    'AutoField': 'int',
+    'IntegerField': 'int',
+    'PositiveIntegerField': 'int',
+    'SmallIntegerField': 'int',
+    'PositiveSmallIntegerField': 'int',
+    'BigIntegerField': 'int',
+    'FloatField': 'float',
+    'DecimalField': 'float',
+    'BooleanField': 'bool',
+    'NullBooleanField': 'bool',
+    'DateField': 'date',
+    'DateTimeField': 'datetime',
+}
+
+def _column_encodings(survey, columns):
+    fields = dict([(field.column, field) for field in survey.as_model()._meta.fields])
+    encodings = []
+    for column in columns:
+        if column in fields:
+            encodings.append(COLUMN_ENCODINGS.get(fields[column].get_internal_type(), 'string'))
+        else:
+            # Columns only found in archived tables: the type is unknown.
+            encodings.append('string')
+    return encodings
+
+def _question_metadata(survey):
+    questions = {}
+    for question in survey.get_question_list():
+        options = [{'value': o.value, 'text': o.text, 'is_open': o.is_open, 'is_virtual': o.is_virtual}
+                   for o in question.get_option_list()]
+        info = {
+            'data_name': question.data_name,
+            'title': question.title,
+            'type': question.type,
+            'data_type': question.data_type.title,
+            'options': options,
+        }
+        for data_name in question.data_names:
+            questions[data_name] = info
+    return questions
+
+def _days(value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return (value - EPOCH.date()).days
+
+def _microseconds(value):
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _string(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+# dtype of the values of each encoding while they are collected; booleans
+# are bit-packed when the file is written.
+ENCODING_DTYPES = {
+    'int': 'int64',
+    'float': 'float64',
+    'bool': 'bool',
+    'date': 'int32',
+    'datetime': 'int64',
+    'string': 'int32',
+}
+
+# Rows encoded at a time; a multiple of 8 so that chunks pack into whole bytes.
+CHUNK_ROWS = 65536
+
+def _write_npy(filename, dtype, length, chunks):
+    """Write a one dimensional .npy file of `length` values given in chunks."""
+    dtype = numpy.dtype(dtype)
+    f = open(filename, 'wb')
+    try:
+        npy_format.write_array_header_1_0(f, {
+            'descr': npy_format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (length,),
+        })
+        for chunk in chunks:
+            numpy.asarray(chunk, dtype=dtype).tofile(f)
+    finally:
+        f.close()
+
+def _read_chunks(filename, dtype):
+    f = open(filename, 'rb')
+    try:
+        while True:
+            chunk = numpy.fromfile(f, dtype=dtype, count=CHUNK_ROWS)
+            if not len(chunk):
+                break
+            yield chunk
+    finally:
+        f.close()
+
+class ColumnWriter(object):
+    """
+    Encodes the values of one column chunk by chunk into a temporary raw
+    file, so that memory use does not depend on the number of rows; finish()
+    turns it into the final .npy files. Strings get codes in order of
+    appearance, which are renumbered to the sorted dictionary at the end.
+    """
+    def __init__(self, path, column, encoding):
+        self.filename = os.path.join(path, column + '.npy')
+        self.mask_filename = os.path.join(path, column + '.mask.npy')
+        self.encoding = encoding
+        self.dtype = ENCODING_DTYPES[encoding]
+        self.length = 0
+        self.nullable = False
+        self.codes = {}
+        self.data = open(self.filename + '.part', 'wb')
+        self.nulls = open(self.mask_filename + '.part', 'wb')
+
+    def encode(self, values):
+        encoding = self.encoding
+        if encoding == 'int':
+            return [int(v) if v is not None else 0 for v in values]
+        elif encoding == 'float':
+            return [float(v) if v is not None else numpy.nan for v in values]
+        elif encoding == 'bool':
+            return [bool(v) for v in values]
+        elif encoding == 'date':
+            return [_days(v) if v is not None else 0 for v in values]
+        elif encoding == 'datetime':
+            return [_microseconds(v) if v is not None else 0 for v in values]
+        codes = []
+        for v in values:
+            if v is None:
+                codes.append(-1)
+                continue
+            v = _string(v)
+            if v not in self.codes:
+                self.codes[v] = len(self.codes)
+            codes.append(self.codes[v])
+        return codes
+
+    def append(self, values):
+        nulls = numpy.array([v is None for v in values], dtype=bool)
+        numpy.array(self.encode(values), dtype=self.dtype).tofile(self.data)
+        nulls.tofile(self.nulls)
+        self.nullable = self.nullable or bool(nulls.any())
+        self.length += len(values)
+
+    def finish(self):
+        """Write the .npy file(s); returns (nullable, dictionary or None)."""
+        self.data.close()
+        self.nulls.close()
+        chunks = _read_chunks(self.filename + '.part', self.dtype)
+        dictionary = None
+        if self.encoding == 'bool':
+            _write_npy(self.filename, 'uint8', (self.length + 7) // 8, (numpy.packbits(c) for c in chunks))
+        elif self.encoding == 'string':
+            dictionary = sorted(self.codes)
+            # remap[code] is the position in the dictionary; remap[-1] keeps NULL at -1.
+            remap = numpy.empty(len(dictionary) + 1, dtype=numpy.int32)
+            remap[-1] = -1
+            for i, value in enumerate(dictionary):
+                remap[self.codes[value]] = i
+            _write_npy(self.filename, self.dtype, self.length, (remap[c] for c in chunks))
+        else:
+            _write_npy(self.filename, self.dtype, self.length, chunks)
+        if self.nullable:
+            _write_npy(self.mask_filename, 'uint8', (self.length + 7) // 8,
+                       (numpy.packbits(c) for c in _read_chunks(self.mask_filename + '.part', 'bool')))
+        self.close()
+        return self.nullable, dictionary
+
+    def close(self):
+        """Remove the temporary files."""
+        for f in (self.data, self.nulls):
+            f.close()
+            try:
+                os.unlink(f.name)
+            except OSError:
+                pass
+
+def _append_rows(writers, rows):
+    if rows:
+        for writer, values in zip(writers, zip(*rows)):
+            writer.append(values)
+
+def write_columnar(survey, path, **kwargs):
+    """
+    Export the results of `survey` to the directory `path`; keyword
+    arguments are passed on to Survey.iter_results() (table, since_id, ...).
+    Rows are encoded CHUNK_ROWS at a time. Returns the number of exported
+    rows.
+    """
+    if numpy is None:
+        raise RuntimeError("the columnar export requires numpy")
+    columns, headers = survey.get_results_columns(kwargs.get('table'))
+    encodings = _column_encodings(survey, columns)
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    writers = []
+    try:
+        for column, encoding in zip(columns, encodings):
+            writers.append(ColumnWriter(path, column, encoding))
+        rows = []
+        for row in survey.iter_results(**kwargs):
+            rows.append(row)
+            if len(rows) == CHUNK_ROWS:
+                _append_rows(writers, rows)
+                rows = []
+        _append_rows(writers, rows)
+        length = writers and writers[0].length or 0
+
+        questions = _question_metadata(survey)
+        metadata = {
+            'format': FORMAT_VERSION,
+            'survey': {'id': survey.id, 'shortname': survey.shortname, 'title': survey.title, 'version': survey.version},
+            'table': kwargs.get('table') or survey.as_model()._meta.db_table,
+            'exported': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'rows': length,
+            'columns': [],
+        }
+        for i, column in enumerate(columns):
+            nullable, dictionary = writers[i].finish()
+            info = {'name': column, 'header': headers[i], 'encoding': encodings[i], 'nullable': nullable}
+            if dictionary is not None:
+                info['dictionary'] = dictionary
+            if column in questions:
+                info['question'] = questions[column]
+            metadata['columns'].append(info)
+    finally:
+        for writer in writers:
+            writer.close()
+    f = open(os.path.join(path, METADATA_FILE), 'w')
+    f.write(json.dumps(metadata))
+    f.close()
+    return length
+
+class ColumnarResults(object):
+    """
+    A columnar export opened for reading; arrays are memory-mapped (unless
+    `mmap` is False) and only read when they are used.
+    """
+    def __init__(self, path, mmap=True):
+        if numpy is None:
+            raise RuntimeError("the columnar export requires numpy")
+        self.path = path
+        self.mmap_mode = mmap and 'r' or None
+        self.metadata = json.loads(open(os.path.join(path, METADATA_FILE)).read())
+        if self.metadata['format'] != FORMAT_VERSION:
+            raise ValueError('unsupported columnar export format %s' % (self.metadata['format'],))
+        self.rows = self.metadata['rows']
+        self.info = dict([(c['name'], c) for c in self.metadata['columns']])
+
+    @property
+    def columns(self):
+        return [c['name'] for c in self.metadata['columns']]
+
+    def _load(self, name):
+        return numpy.load(os.path.join(self.path, name + '.npy'), mmap_mode=self.mmap_mode)
+
+    def values(self, name):
+        """The stored array of column `name`; booleans are unpacked."""
+        array = self._load(name)
+        if self.info[name]['encoding'] == 'bool':
+            return numpy.unpackbits(array)[:self.rows].astype(bool)
+        return array
+
+    def mask(self, name):
+        """Boolean array that is True where column `name` is NULL."""
+        if not self.info[name]['nullable']:
+            return numpy.zeros(self.rows, dtype=bool)
+        return numpy.unpackbits(self._load(name + '.mask'))[:self.rows].astype(bool)
+
+    def dictionary(self, name):
+        return self.info[name].get('dictionary')
+
+    def column(self, name):
+        """
+        Column `name` as a masked array; strings are decoded into an object
+        array, dates and datetimes are returned in their integer encoding.
+        """
+        values = self.values(name)
+        if self.info[name]['encoding'] == 'string':
+            dictionary = numpy.array(self.dictionary(name) + [None], dtype=object)
+            values = dictionary[values]
+        return numpy.ma.MaskedArray(values, mask=self.mask(name))
+
+def load_columnar(path, mmap=True):
+    return ColumnarResults(path, mmap)
@@ -1,19 +1,38 @@
 from apps import pollster
 
-from apps.survey.views import _get_health_history
+from apps.survey.models import SurveyUser, get_active_global_ids
+from apps.survey.views import _decode_person_health_status
+
+def lazy(func):
+    """
+    Wrap `func` so that it is called once, when a template first uses the
+    value (templates call callables), and not at all otherwise.
+    """
+    result = []
+    def wrapper():
+        if not result:
+            result.append(func())
+        return result[0]
+    return wrapper
 
 def last_survey(request):
-    try:
-        survey = pollster.models.Survey.get_by_shortname('weekly')
-    except:
+    if not hasattr(request, 'user') or not request.user.is_authenticated():
         return {}
 
-    history = list(_get_health_history(request, survey))
-    if not history:
-        return {}
+    def get_last_survey():
+        record = pollster.models.get_last_survey(request.user.id)
+        if record is None:
+            return None
+        last = dict(record)
+        last['diag'] = _decode_person_health_status(last['status'])
+        try:
+            last['survey_user'] = SurveyUser.objects.get(global_id=last['global_id'])
+        except SurveyUser.DoesNotExist:
+            last['survey_user'] = None
+        return last
 
     return {
-        'last_survey': history[0],
+        'last_survey': lazy(get_last_survey),
     }
 
 
@@ -25,8 +44,8 @@ def surveyuser_count(request):
             'surveyuser_gid': None,
         }
 
-    surveyuser_qs = request.user.surveyuser_set.filter(deleted=False)
+    global_ids = lazy(lambda: get_active_global_ids(request.user.id))
     return {
-        'surveyuser_count': surveyuser_qs.count(),
-        'surveyuser_gid': surveyuser_qs.get().global_id if surveyuser_qs.count() == 1 else None,
+        'surveyuser_count': lazy(lambda: len(global_ids())),
+        'surveyuser_gid': lazy(lambda: global_ids()[0] if len(global_ids()) == 1 else None),
     }
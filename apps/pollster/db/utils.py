@@ -1,3 +1,5 @@
+import hashlib
+
 def get_db_type(connection):
     db = None
     if connection.settings_dict['ENGINE'] == "django.db.backends.sqlite3":
@@ -10,6 +12,36 @@ def get_db_type(connection):
         db = "mysql"
     return db
 
+def get_relation_type(connection, name):
+    """Return 'table', 'view' or None depending on what `name` is."""
+    db = get_db_type(connection)
+    cursor = connection.cursor()
+    if db == 'sqlite':
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = %s AND type IN ('table', 'view')", [name])
+        row = cursor.fetchone()
+        return row and str(row[0])
+    elif db == 'postgresql':
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND pg_table_is_visible(oid)", [name])
+        row = cursor.fetchone()
+        return row and {'r': 'table', 'v': 'view'}.get(row[0])
+    raise NotImplementedError(db)
+
+def server_side_cursor(connection, name):
+    """
+    Return a cursor that keeps the result set on the database server so that
+    rows can be fetched in chunks without loading the full result in memory;
+    on PostgreSQL this is a named (psycopg2) cursor, the other backends get a
+    regular cursor. The caller has to close it.
+    """
+    cursor = connection.cursor()
+    if get_db_type(connection) == 'postgresql':
+        # connection.connection is only set once a cursor has been requested;
+        # named cursors only live within a transaction, which psycopg2 opens
+        # on the first execute() unless the connection is in autocommit mode.
+        cursor.close()
+        cursor = connection.connection.cursor(name=name)
+    return cursor
+
 def convert_query_paramstyle(connection, sql, params):
     db = get_db_type(connection)
     if db == 'postgresql':
@@ -17,3 +49,65 @@ def convert_query_paramstyle(connection, sql, params):
     translations = dict([(p, ':'+p) for p in params.keys()])
     converted = sql % translations
     return converted
+
+def bulk_insert(connection, table, columns, rows):
+    """Insert `rows` (sequences of values for `columns`) with one executemany()."""
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(table), ', '.join([qn(c) for c in columns]), ', '.join(['%s'] * len(columns)))
+    connection.cursor().executemany(sql, rows)
+
+def bulk_update(connection, table, columns, rows, key='id'):
+    """
+    Update `columns` of many rows with one executemany(); every row holds
+    the new values for `columns` followed by the value of `key`.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (qn(table), ', '.join(['%s = %%s' % (qn(c),) for c in columns]), qn(key))
+    connection.cursor().executemany(sql, rows)
+
+def get_table_change_counters(connection, table):
+    """
+    Return the (inserted, updated, deleted, live) row counters PostgreSQL
+    keeps for a table, which change on every write; None on other databases,
+    for views or when the counters are not collected (track_counts off).
+    """
+    if get_db_type(connection) != 'postgresql':
+        return None
+    cursor = connection.cursor()
+    cursor.execute("SELECT current_setting('track_counts')")
+    if cursor.fetchone()[0] != 'on':
+        return None
+    cursor.execute("""SELECT n_tup_ins, n_tup_upd, n_tup_del, n_live_tup
+                        FROM pg_stat_user_tables
+                       WHERE relid = %s::regclass""", [table])
+    row = cursor.fetchone()
+    return row and tuple(row)
+
+def get_table_digest(connection, table, order_by=None, chunk_size=1000):
+    """
+    Return the md5 hex digest of all the rows of a table, ordered by
+    `order_by` (by default all columns); rows are streamed through a server
+    side cursor, so memory use does not depend on the size of the table.
+    """
+    qn = connection.ops.quote_name
+    if order_by is None:
+        columns = connection.introspection.get_table_description(connection.cursor(), table)
+        order_by = ', '.join([str(i + 1) for i in range(len(columns))])
+    digest = hashlib.md5()
+    cursor = server_side_cursor(connection, 'table_digest')
+    try:
+        cursor.execute("SELECT * FROM %s ORDER BY %s" % (qn(table), order_by))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                digest.update(repr(tuple(row)))
+                digest.update('\n')
+    finally:
+        cursor.close()
+    return digest.hexdigest()
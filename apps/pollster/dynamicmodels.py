@@ -3,6 +3,8 @@ from django import forms
 from django.db import models, connection
 from django.db.models.loading import cache
 from django.core.management import color
+from .db.utils import get_db_type
+import hashlib
 
 def create(name, fields=None, app_label='', module='', options=None, admin_opts=None):
     """
@@ -62,6 +64,67 @@ def install(model):
     for statement in statements:
         cursor.execute(statement)
 
+def index_name(table, columns):
+    # PostgreSQL truncates identifiers at 63 characters: keep the name
+    # unique by replacing the tail with a hash of the full name.
+    name = '%s_%s' % (table, '_'.join([c.lstrip('-') for c in columns]))
+    if len(name) > 63:
+        name = name[:54] + '_' + hashlib.md5(name).hexdigest()[:8]
+    return name
+
+def index_exists(name):
+    cursor = connection.cursor()
+    db = get_db_type(connection)
+    if db == 'sqlite':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = %s", [name])
+    elif db == 'postgresql':
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s", [name])
+    else:
+        raise NotImplementedError(db)
+    return cursor.fetchone() is not None
+
+def table_columns(table):
+    cursor = connection.cursor()
+    return [row[0] for row in connection.introspection.get_table_description(cursor, table)]
+
+def create_index(table, columns):
+    # A leading '-' on a column name makes it a descending index column.
+    qn = connection.ops.quote_name
+    definition = ', '.join([c.startswith('-') and qn(c[1:])+' DESC' or qn(c) for c in columns])
+    cursor = connection.cursor()
+    cursor.execute('CREATE INDEX %s ON %s (%s)' % (qn(index_name(table, columns)), qn(table), definition))
+
+def install_indexes(table, indexes):
+    # install() only creates the bare table: add the secondary indexes on
+    # the columns the table actually has. Returns the created index names.
+    created = []
+    existing = table_columns(table)
+    for columns in indexes:
+        if [c for c in columns if c.lstrip('-') not in existing]:
+            continue
+        name = index_name(table, columns)
+        if not index_exists(name):
+            create_index(table, columns)
+            created.append(name)
+    return created
+
+def rename_table(table, new_table, indexes=()):
+    # Index names are global to the database, so indexes derived from the old
+    # table name have to follow the table or they clash with the ones of the
+    # table that replaces it.
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (qn(table), qn(new_table)))
+    for columns in indexes:
+        name = index_name(table, columns)
+        if not index_exists(name):
+            continue
+        if get_db_type(connection) == 'postgresql':
+            cursor.execute('ALTER INDEX %s RENAME TO %s' % (qn(name), qn(index_name(new_table, columns))))
+        else:
+            cursor.execute('DROP INDEX %s' % (qn(name),))
+            create_index(new_table, columns)
+
 def to_form(model, fields=None):
     class Meta:
         pass
@@ -3,6 +3,7 @@ from django.core import exceptions, validators
 from django.forms import CharField, ValidationError
 from django.utils.translation import ugettext_lazy as _
 from .db.utils import get_db_type, convert_query_paramstyle
+from .zipcodes import get_zip_code_index
 import datetime, time, re, logging
 from django.conf import settings
 
@@ -120,6 +121,9 @@ class PostalCodeField(CharField):
         if not mode or mode == 'NONE':
             return True
         if mode == 'EXACT':
+            found = get_zip_code_index('pollster_zip_codes').contains(value, settings.COUNTRY)
+            if found is not None:
+                return found
             params = { 'country': settings.COUNTRY.lower(), 'zip': str(value).lower() }
             query = "SELECT count(*) FROM pollster_zip_codes WHERE lower(country) = %(country)s AND lower(zip_code_key) = %(zip)s"
             query = convert_query_paramstyle(connection, query, params)
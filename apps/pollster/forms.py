@@ -18,7 +18,7 @@ class SurveyChartEditForm(forms.ModelForm):
     chartwrapper = forms.CharField(widget=forms.HiddenInput, required=False)
     class Meta:
         model = Chart
-        fields = ('type', 'status', 'shortname', 'realtime', 'chartwrapper', 'template', 'sqlsource', 'sqlfilter')
+        fields = ('type', 'status', 'shortname', 'realtime', 'skip_unchanged_sources', 'chartwrapper', 'template', 'sqlsource', 'sqlfilter')
 
 class SurveyImportForm(forms.Form):
     data = forms.FileField(label="Survey definition", required=True)
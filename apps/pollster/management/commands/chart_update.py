@@ -1,17 +1,75 @@
 from optparse import make_option
 from django.core.management.base import CommandError, BaseCommand
+import time
 
 class Command(BaseCommand):
     help = 'Update all charts and invalidate tile cache.'
-    option_list = BaseCommand.option_list
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', action='store', type="int",
+                    dest='workers', default=4,
+                    help='Number of charts updated concurrently (always 1 on SQLite).'),
+        make_option('-f', '--force', action='store_true',
+                    dest='force', default=False,
+                    help='Rebuild charts even if their sources did not change.'),
+        make_option('-s', '--seed', action='store_true',
+                    dest='seed', default=False,
+                    help='Pre-render the map tiles of public charts afterwards (see tile_seed).'),
+    )
 
     def handle(self, *args, **options):
+        from django.db import connection
+        from multiprocessing.pool import ThreadPool
         from apps.pollster import models
+        from apps.pollster.db.utils import get_db_type
 
         verbosity = int(options.get('verbosity'))
+        force = options.get('force')
 
-        for chart in models.Chart.objects.all():
-            if not chart.update_data():
-                print 'Chart "%s" update FAILED' % (chart,)
-            elif verbosity > 0:
-                print 'Chart "%s" updated' % (chart,)
+        workers = options.get('workers')
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+        if get_db_type(connection) == 'sqlite':
+            # SQLite locks the whole database on write.
+            workers = 1
+
+        def refresh(chart_id):
+            # Every thread has its own database connection: close it when
+            # done instead of leaving it to the garbage collector.
+            start = time.time()
+            try:
+                chart = models.Chart.objects.select_related('type', 'survey').get(pk=chart_id)
+                try:
+                    status = chart.refresh(force)
+                except Exception, e:
+                    status = 'FAILED (%s)' % (e,)
+                return (str(chart), status, time.time() - start)
+            finally:
+                if workers > 1:
+                    connection.close()
+
+        chart_ids = list(models.Chart.objects.values_list('id', flat=True))
+        start = time.time()
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                results = pool.imap_unordered(refresh, chart_ids)
+                self.report(results, verbosity)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self.report([refresh(chart_id) for chart_id in chart_ids], verbosity)
+
+        if verbosity > 0:
+            print 'Updated %d charts in %.2fs' % (len(chart_ids), time.time() - start)
+
+        if options.get('seed'):
+            from django.core.management import call_command
+            call_command('tile_seed', verbosity=verbosity)
+
+    def report(self, results, verbosity):
+        for name, status, elapsed in results:
+            if status.startswith('FAILED'):
+                print 'Chart "%s" update %s' % (name, status)
+            elif verbosity > 0 and (status == 'updated' or verbosity > 1):
+                print 'Chart "%s" %s in %.2fs' % (name, status, elapsed)
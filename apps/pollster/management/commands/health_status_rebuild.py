@@ -0,0 +1,75 @@
+from optparse import make_option
+from django.core.management.base import CommandError, BaseCommand
+import time
+
+class Command(BaseCommand):
+    help = 'Rebuild (or backfill) the materialized pollster_health_status table.'
+    option_list = BaseCommand.option_list + (
+        make_option('-m', '--missing', action='store_true',
+                    dest='missing', default=False,
+                    help='Only classify weekly results that have no status yet.'),
+        make_option('-s', '--source', action='store', type="string",
+                    dest='source',
+                    help='Classify this (archived) weekly results table with the vectorized classifier.'),
+        make_option('-t', '--target', action='store', type="string",
+                    dest='target',
+                    help='Status table to fill; defaults to "<source>_health_status".'),
+        make_option('-d', '--definition', action='store', type="string",
+                    dest='definition', default='default',
+                    help='Case definition used by the vectorized classifier.'),
+        make_option('-b', '--benchmark', action='store', type="int",
+                    dest='benchmark',
+                    help='Only report the classifier throughput over this many random rows.'),
+    )
+
+    def handle(self, *args, **options):
+        from django.db import connection, transaction
+        from apps.pollster import models, classifier
+        from apps.pollster.db.utils import get_relation_type
+
+        verbosity = int(options.get('verbosity'))
+
+        if options.get('benchmark'):
+            rate = classifier.benchmark(options['benchmark'], classifier.CASE_DEFINITIONS[options['definition']])
+            print 'Classified %d rows at %d rows/second' % (options['benchmark'], rate)
+            return
+
+        if options.get('source') or options['definition'] != 'default':
+            source = options.get('source') or 'pollster_results_weekly'
+            target = options.get('target') or source + '_health_status'
+            if options['definition'] not in classifier.CASE_DEFINITIONS:
+                raise CommandError('Unknown case definition "%s"' % (options['definition'],))
+            if source not in connection.introspection.table_names():
+                raise CommandError('Table "%s" does not exist' % (source,))
+            if target == 'pollster_health_status' and source != 'pollster_results_weekly':
+                raise CommandError('Archived results must not be classified into "pollster_health_status"')
+            if get_relation_type(connection, target) is None:
+                connection.cursor().execute(models.HEALTH_STATUS_TABLE_SQL % (connection.ops.quote_name(target),))
+            start = time.time()
+            count = classifier.classify_table(source, target, classifier.CASE_DEFINITIONS[options['definition']])
+            if verbosity > 0:
+                elapsed = max(time.time() - start, 1e-9)
+                print 'Classified %d rows of "%s" into "%s" (%d rows/second)' % (count, source, target, count / elapsed)
+            return
+
+        if 'pollster_results_weekly' not in connection.introspection.table_names():
+            raise CommandError('Table "pollster_results_weekly" does not exist: publish the weekly survey first')
+
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            if get_relation_type(connection, 'pollster_health_status') != 'table':
+                models.install_health_status_table()
+            else:
+                models.update_health_status(missing_only=options.get('missing'))
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        finally:
+            transaction.leave_transaction_management()
+
+        if verbosity > 0:
+            cursor = connection.cursor()
+            cursor.execute("SELECT count(*) FROM pollster_health_status")
+            print 'Health status table holds %d rows' % (cursor.fetchone()[0],)
@@ -0,0 +1,102 @@
+from optparse import make_option
+from django.core.management.base import CommandError, BaseCommand
+import csv, os, sys
+
+class Command(BaseCommand):
+    args = '<survey shortname>'
+    help = 'Export (new) results of a published survey, or of its archived results tables, as CSV or column-wise NumPy arrays.'
+    option_list = BaseCommand.option_list + (
+        make_option('--since-id', action='store', type="int",
+                    dest='since_id',
+                    help='Only export results with a larger id.'),
+        make_option('--since', action='store', type="string",
+                    dest='since',
+                    help='Only export results submitted after this timestamp.'),
+        make_option('-t', '--table', action='store', type="string",
+                    dest='table',
+                    help='Export this archived results table instead of the current one.'),
+        make_option('-s', '--season', action='store', type="string",
+                    dest='season',
+                    help='Export every results table archived in this year, one file each in the --output directory.'),
+        make_option('-f', '--format', action='store', type="choice",
+                    choices=['csv', 'npy'], dest='format', default='csv',
+                    help='csv, or npy for a directory of memory-mappable column arrays plus metadata.json.'),
+        make_option('-o', '--output', action='store', type="string",
+                    dest='output',
+                    help='Output file (or directory with --season or --format=npy); defaults to standard output.'),
+        make_option('-w', '--watermark-file', action='store', type="string",
+                    dest='watermark_file',
+                    help='Read the watermarks of the previous export from this file and store the new ones in it.'),
+    )
+
+    def handle(self, *args, **options):
+        from apps.pollster import models, json, columnar
+        from apps.pollster.utils import parse_timestamp
+
+        if len(args) != 1:
+            raise CommandError('Specify the shortname of a published survey')
+        try:
+            survey = models.Survey.get_by_shortname(args[0])
+        except models.Survey.DoesNotExist:
+            raise CommandError('No published survey "%s"' % (args[0],))
+
+        verbosity = int(options.get('verbosity'))
+
+        if options.get('season'):
+            if not options.get('output') or not os.path.isdir(options['output']):
+                raise CommandError('--season requires an existing --output directory')
+            tables = survey.get_archived_table_names(options['season'])
+            extension = options['format'] == 'csv' and '.csv' or ''
+            outputs = [os.path.join(options['output'], table + extension) for table in tables]
+        else:
+            tables = [options.get('table') or None]
+            if tables[0] and tables[0] not in survey.get_archived_table_names():
+                raise CommandError('"%s" is not an archived results table of "%s"' % (tables[0], args[0]))
+            outputs = [options.get('output')]
+            if options['format'] == 'npy' and not outputs[0]:
+                raise CommandError('--format=npy requires an --output directory')
+
+        watermarks = {}
+        if options.get('watermark_file') and os.path.exists(options['watermark_file']):
+            watermarks = json.loads(open(options['watermark_file']).read())
+
+        try:
+            since = options.get('since') and parse_timestamp(options['since']) or None
+        except ValueError, e:
+            raise CommandError(str(e))
+
+        for table, output in zip(tables, outputs):
+            key = table or survey.as_model()._meta.db_table
+            watermark = watermarks.get(key, {})
+            since_id = options.get('since_id') or watermark.get('id') or None
+            table_since = since
+            if table_since is None and watermark.get('timestamp'):
+                table_since = parse_timestamp(watermark['timestamp'])
+
+            until_id, until = survey.get_results_watermark(table, since_id, table_since)
+            bounds = dict(table=table, since_id=since_id, since=table_since, until_id=until_id or 0)
+            if options['format'] == 'npy':
+                count = columnar.write_columnar(survey, output, **bounds)
+            else:
+                out = output and open(output, 'wb') or sys.stdout
+                try:
+                    writer = csv.writer(out)
+                    count = -1
+                    for row in survey.iter_csv_rows(**bounds):
+                        writer.writerow(row)
+                        count += 1
+                finally:
+                    if output:
+                        out.close()
+
+            watermarks[key] = {
+                'id': until_id or since_id or 0,
+                'timestamp': str(until or table_since or ''),
+            }
+            if verbosity > 0 and output:
+                print 'Exported %d results of "%s" to "%s" (watermark id %s)' % (count, key, output, watermarks[key]['id'])
+
+        if options.get('watermark_file'):
+            f = open(options['watermark_file'], 'w')
+            f.write(json.dumps(watermarks))
+            f.close()
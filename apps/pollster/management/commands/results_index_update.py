@@ -0,0 +1,33 @@
+from optparse import make_option
+from django.core.management.base import CommandError, BaseCommand
+
+class Command(BaseCommand):
+    help = 'Create the missing secondary indexes on current and archived results tables.'
+    option_list = BaseCommand.option_list + (
+        make_option('-t', '--table', action='store', type="string",
+                    dest='table',
+                    help='Only index this table.'),
+    )
+
+    def handle(self, *args, **options):
+        from django.db import connection, transaction
+        from apps.pollster import models, dynamicmodels
+
+        verbosity = int(options.get('verbosity'))
+
+        tables = connection.introspection.table_names()
+        if options.get('table'):
+            if options['table'] not in tables:
+                raise CommandError('Table "%s" does not exist' % (options['table'],))
+            tables = [options['table']]
+        else:
+            tables = [t for t in tables if t.startswith('pollster_results_')]
+
+        for table in tables:
+            created = dynamicmodels.install_indexes(table, models.get_results_table_indexes())
+            transaction.commit_unless_managed()
+            if verbosity > 0:
+                for name in created:
+                    print 'Index "%s" created on "%s"' % (name, table)
+            if verbosity > 1 and not created:
+                print 'Table "%s" already indexed' % (table,)
@@ -0,0 +1,89 @@
+from optparse import make_option
+from django.core.management.base import CommandError, BaseCommand
+import time
+
+# Charts already loaded by a worker process, by id.
+_charts = {}
+
+def _render_metatile(job):
+    """Pool worker: render one metatile unless its tiles already exist."""
+    from apps.pollster import models
+    chart_id, z, x, y = job
+    chart = _charts.get(chart_id)
+    if chart is None:
+        chart = _charts[chart_id] = models.Chart.objects.select_related('survey').get(pk=chart_id)
+    mx, my, size = chart.get_metatile(z, x, y)
+    if chart.get_tile_store().get(z, x, y) is not None:
+        return 0
+    chart.generate_map_metatile(None, None, z, x, y)
+    return size * size
+
+class Command(BaseCommand):
+    help = 'Pre-render the map tiles of published, public google-map charts.'
+    option_list = BaseCommand.option_list + (
+        make_option('-c', '--chart', action='append', type="string",
+                    dest='charts', default=[],
+                    help='Only seed this chart (<survey shortname>/<chart shortname>); can be repeated.'),
+        make_option('-b', '--bbox', action='store', type="string",
+                    dest='bbox',
+                    help='Bounding box as min_lng,min_lat,max_lng,max_lat (default POLLSTER_SEED_BBOX, or the area shown around the chart center).'),
+        make_option('-z', '--zoom', action='store', type="string",
+                    dest='zoom',
+                    help='Zoom range as min,max (default POLLSTER_SEED_ZOOM, or the chart zoom and the next two levels).'),
+        make_option('-w', '--workers', action='store', type="int",
+                    dest='workers', default=4,
+                    help='Number of rendering processes.'),
+    )
+
+    def handle(self, *args, **options):
+        from django.db import connection
+        from multiprocessing import Pool
+        from apps.pollster import models
+
+        verbosity = int(options.get('verbosity'))
+        if models.mapnik_version is None:
+            raise CommandError('Tile seeding requires mapnik')
+
+        bbox = self.parse(options.get('bbox'), 4, '--bbox')
+        zoom = self.parse(options.get('zoom'), 2, '--zoom')
+        if zoom:
+            zoom = [int(z) for z in zoom]
+
+        charts = models.Chart.objects.select_related('survey', 'type').filter(
+            status='PUBLISHED', survey__status='PUBLISHED', sqlfilter='NONE', type__shortname__startswith='google-map')
+        if options['charts']:
+            names = [tuple(name.split('/', 1)) for name in options['charts']]
+            charts = [c for c in charts if (c.survey.shortname, c.shortname) in names]
+
+        jobs = []
+        for chart in charts:
+            chart_bbox, chart_zoom = chart.get_seed_area()
+            for z, x, y in models.get_metatiles(bbox or chart_bbox, zoom or chart_zoom):
+                jobs.append((chart.id, z, x, y))
+        if verbosity > 1:
+            print 'Seeding %d metatiles' % (len(jobs),)
+
+        # Forked workers must not share the database connection of the parent.
+        connection.close()
+        start = time.time()
+        pool = Pool(max(options.get('workers'), 1))
+        try:
+            rendered = sum(pool.imap_unordered(_render_metatile, jobs))
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = max(time.time() - start, 1e-9)
+
+        if verbosity > 0:
+            print 'Rendered %d tiles in %.2fs (%.1f tiles/second)' % (rendered, elapsed, rendered / elapsed)
+
+    def parse(self, value, length, option):
+        if not value:
+            return None
+        try:
+            values = [float(v) for v in value.split(',')]
+        except ValueError:
+            values = []
+        if len(values) != length:
+            raise CommandError('Invalid %s "%s"' % (option, value))
+        return values
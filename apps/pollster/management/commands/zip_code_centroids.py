@@ -0,0 +1,26 @@
+from optparse import make_option
+from django.core.management.base import CommandError, BaseCommand
+
+class Command(BaseCommand):
+    help = 'Precompute the zip code centroids used for zip code validation and map centering.'
+    option_list = BaseCommand.option_list + (
+        make_option('-g', '--geotable', action='append', type="string",
+                    dest='geotables', default=[],
+                    help='Only process this geometry table; can be repeated (default: all GEOMETRY_TABLES).'),
+    )
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+        from django.db import connection
+        from apps.pollster import zipcodes
+
+        verbosity = int(options.get('verbosity'))
+
+        geotables = options['geotables'] or [name for name, description in settings.GEOMETRY_TABLES]
+        tables = connection.introspection.table_names()
+        for geotable in geotables:
+            if geotable not in tables:
+                raise CommandError('Table "%s" does not exist' % (geotable,))
+            count = zipcodes.build_centroids(geotable)
+            if verbosity > 0:
+                print 'Computed %d zip code centroids for "%s"' % (count, geotable)
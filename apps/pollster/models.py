@@ -9,9 +9,15 @@ from cms.models import CMSPlugin
 from xml.etree import ElementTree
 from math import pi,cos,sin,log,exp,atan
 from . import dynamicmodels, json
-from .db.utils import get_db_type, convert_query_paramstyle
-import os, re, shutil, warnings, datetime, csv
+from .cache import LRUCache, ObjectPool
+from .tilestore import get_tile_store, write_file
+from .spatial import get_geo_index, simplify
+from .zipcodes import get_zip_code_index
+from .db.utils import get_db_type, get_relation_type, convert_query_paramstyle, server_side_cursor, bulk_insert, bulk_update, \
+                       get_table_change_counters, get_table_digest
+import os, re, shutil, warnings, datetime, csv, hashlib, uuid
 from django.conf import settings
+from django.core.cache import cache
 
 DEG_TO_RAD = pi/180
 RAD_TO_DEG = 180/pi
@@ -27,6 +33,9 @@ except:
         mapnik_version = None
         warnings.warn("No working version for library 'mapnik' found. Continuing without mapnik")
         
+# Map tiles are rendered in blocks of METATILE_SIZE x METATILE_SIZE tiles:
+# one mapnik pass and one datasource query for all of them.
+METATILE_SIZE = getattr(settings, 'POLLSTER_METATILE_SIZE', 8)
 
 SURVEY_STATUS_CHOICES = (
     ('DRAFT', 'Draft'),
@@ -59,16 +68,25 @@ CHART_SQLFILTER_CHOICES = (
     ('PERSON', 'Current Person'),
 )
 
+# Secondary indexes created on results tables when a survey is published;
+# a leading '-' marks a descending column. They serve the per-person lookups
+# of get_last_participation_data(), the per-user history queries and the
+# incremental (since timestamp) results export.
+RESULTS_TABLE_INDEXES = (
+    ('global_id', '-timestamp'),
+    ('user', 'timestamp'),
+    ('timestamp',),
+)
+
 IDENTIFIER_REGEX = r'^[a-zA-Z][a-zA-Z0-9_]*$'
 IDENTIFIER_OPTION_REGEX = r'^[a-zA-Z0-9_]*$'
 
-SURVEY_EXTRA_SQL = {
-    'postgresql': {
-        'weekly': [
-            """DROP VIEW IF EXISTS pollster_health_status""",
-            """CREATE VIEW pollster_health_status AS
-               SELECT id as pollster_results_weekly_id,
-                      case true
+# Classification of pollster_results_weekly rows into health statuses. The
+# result is materialized in the pollster_health_status table (keyed by
+# pollster_results_weekly_id) by update_health_status(), so readers join an
+# indexed table instead of evaluating the classifier per row per query.
+HEALTH_STATUS_SQL = {
+    'postgresql': """case true
                           when "Q1_0"
                               then 'NO-SYMPTOMS'
 
@@ -126,16 +144,8 @@ SURVEY_EXTRA_SQL = {
                               then 'GASTROINTESTINAL'
 
                           else 'NON-SPECIFIC-SYMPTOMS'
-                      end as status
-                 FROM pollster_results_weekly"""
-        ]
-    },
-    'sqlite': {
-        'weekly': [
-            """DROP VIEW IF EXISTS pollster_health_status""",
-            """CREATE VIEW pollster_health_status AS
-               SELECT id as pollster_results_weekly_id,
-                      case 1
+                      end""",
+    'sqlite': """case 1
                           when Q1_0
                               then 'NO-SYMPTOMS'
 
@@ -193,19 +203,226 @@ SURVEY_EXTRA_SQL = {
                               then 'GASTROINTESTINAL'
 
                           else 'NON-SPECIFIC-SYMPTOMS'
-                      end as status
+                      end"""
+}
 
-                 FROM pollster_results_weekly"""
-        ]
-    }
+HEALTH_STATUS_TABLE_SQL = """CREATE TABLE %s (
+                                 pollster_results_weekly_id integer NOT NULL PRIMARY KEY,
+                                 status varchar(64) NOT NULL
+                             )"""
+
+SURVEY_EXTRA_SQL = {
+    'postgresql': {},
+    'sqlite': {}
 }
 
+# Process-wide registry of compiled surveys, keyed by (survey id, updated).
+# Any structural change goes through Survey.save() (parser, publish,
+# unpublish) which bumps `updated`, so a stale entry is never returned; old
+# entries are dropped explicitly by Survey.invalidate_compiled().
+_compiled_surveys = {}
+
+class CompiledSurvey(object):
+    """Results model, ModelForm and field metadata generated for a survey."""
+
+    def __init__(self, model, form, questions):
+        self.model = model
+        self.form = form
+        # List of (data_name, data_names, is_multiple_choice, is_mandatory).
+        self.questions = questions
+
+def install_health_status_table():
+    """
+    (Re)create the pollster_health_status table, replacing the view used by
+    older installations, and classify the current weekly results.
+    """
+    cursor = connection.cursor()
+    relation = get_relation_type(connection, 'pollster_health_status')
+    if relation == 'view':
+        cursor.execute("DROP VIEW pollster_health_status")
+    elif relation == 'table':
+        cursor.execute("DROP TABLE pollster_health_status")
+    cursor.execute(HEALTH_STATUS_TABLE_SQL % ('pollster_health_status',))
+    update_health_status()
+
+def update_health_status(weekly_ids=None, missing_only=False):
+    """
+    Classify the given pollster_results_weekly rows (all of them if
+    `weekly_ids` is None, or only the ones not classified yet if
+    `missing_only` is set) and store their status in pollster_health_status.
+    """
+    db = get_db_type(connection)
+    cursor = connection.cursor()
+    insert = """INSERT INTO pollster_health_status (pollster_results_weekly_id, status)
+                SELECT id, %s
+                  FROM pollster_results_weekly""" % (HEALTH_STATUS_SQL[db],)
+    if weekly_ids is not None:
+        ids = [int(i) for i in weekly_ids]
+        if ids:
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute("DELETE FROM pollster_health_status WHERE pollster_results_weekly_id IN (%s)" % (placeholders,), ids)
+            cursor.execute(insert + " WHERE id IN (%s)" % (placeholders,), ids)
+    elif missing_only:
+        cursor.execute(insert + " WHERE id NOT IN (SELECT pollster_results_weekly_id FROM pollster_health_status)")
+    else:
+        cursor.execute("DELETE FROM pollster_health_status")
+        cursor.execute(insert)
+    transaction.commit_unless_managed()
+
+# The latest classified weekly submission of each user, kept in the Django
+# cache and refreshed by update_last_survey() whenever the user submits a
+# weekly survey; the timeout only bounds staleness after other changes
+# (e.g. health_status_rebuild or deleted results).
+LAST_SURVEY_CACHE_TIMEOUT = getattr(settings, 'POLLSTER_LAST_SURVEY_CACHE_TIMEOUT', 60 * 60 * 24)
+
+def _get_last_survey_cache_key(user_id):
+    return 'pollster-last-survey-%s' % (user_id,)
+
+def _load_last_survey(user_id):
+    if get_relation_type(connection, 'pollster_results_weekly') is None:
+        # No weekly survey was published yet.
+        return {}
+    cursor = connection.cursor()
+    cursor.execute("""SELECT W.timestamp, W.global_id, S.status
+                        FROM pollster_results_weekly W
+                        JOIN pollster_health_status S ON S.pollster_results_weekly_id = W.id
+                       WHERE W.%s = %%s
+                       ORDER BY W.timestamp DESC
+                       LIMIT 1""" % (connection.ops.quote_name('user'),), [user_id])
+    row = cursor.fetchone()
+    if row is None:
+        return {}
+    return {'timestamp': row[0], 'global_id': row[1], 'status': row[2]}
+
+def get_last_survey(user_id):
+    """
+    Return {'timestamp', 'global_id', 'status'} of the latest weekly
+    submission (with a health status) of a user, or None.
+    """
+    key = _get_last_survey_cache_key(user_id)
+    record = cache.get(key)
+    if record is None:
+        record = _load_last_survey(user_id)
+        # An empty record is cached too: users without submissions are the
+        # most common case.
+        cache.set(key, record, LAST_SURVEY_CACHE_TIMEOUT)
+    return record or None
+
+def update_last_survey(user_id):
+    """Refresh the last survey record of a user after a weekly submission."""
+    cache.set(_get_last_survey_cache_key(user_id), _load_last_survey(user_id), LAST_SURVEY_CACHE_TIMEOUT)
+
+def get_results_table_indexes():
+    return getattr(settings, 'POLLSTER_RESULTS_INDEXES', RESULTS_TABLE_INDEXES)
+
 def _get_or_default(queryset, default=None):
     r = queryset[0:1]
     if r:
         return r[0]
     return default
 
+def _set_cached_related(obj, name, value):
+    # Fill the cache Django uses for the foreign key `name` so that
+    # dereferencing it does not issue a query.
+    setattr(obj, obj._meta.get_field(name).get_cache_name(), value)
+
+def bulk_save(model, objects):
+    """
+    Save `objects` (instances of `model`) with one INSERT executemany() for
+    the new ones and one UPDATE executemany() for the existing ones. No
+    signals are sent and the ids of inserted objects are not set.
+    """
+    fields = [f for f in model._meta.local_fields if not f.primary_key]
+    columns = [f.column for f in fields]
+    def values(obj):
+        return [f.get_db_prep_save(f.pre_save(obj, obj.id is None), connection=connection) for f in fields]
+    bulk_insert(connection, model._meta.db_table, columns,
+                [values(obj) for obj in objects if obj.id is None])
+    bulk_update(connection, model._meta.db_table, columns,
+                [values(obj) + [obj.id] for obj in objects if obj.id is not None], model._meta.pk.column)
+
+def load_survey_tree(survey, translation_survey=None):
+    """
+    Fetch questions, rows, columns, options and rules of `survey` (plus all
+    the translation rows of `translation_survey`, if given) in a fixed number
+    of queries and wire them together in memory, so that rendering the survey
+    does not hit the database again.
+    """
+    questions = list(survey.question_set.all().select_related('data_type', 'open_option_data_type'))
+    questions_by_id = {}
+    for question in questions:
+        _set_cached_related(question, 'survey', survey)
+        question.preloaded_rows = []
+        question.preloaded_columns = []
+        question.preloaded_options = []
+        question.preloaded_rules = []
+        questions_by_id[question.id] = question
+
+    rows = {}
+    for row in QuestionRow.objects.filter(question__survey=survey):
+        question = questions_by_id[row.question_id]
+        _set_cached_related(row, 'question', question)
+        question.preloaded_rows.append(row)
+        rows[row.id] = row
+
+    columns = {}
+    for column in QuestionColumn.objects.filter(question__survey=survey):
+        question = questions_by_id[column.question_id]
+        _set_cached_related(column, 'question', question)
+        question.preloaded_columns.append(column)
+        columns[column.id] = column
+
+    options = {}
+    for option in Option.objects.filter(question__survey=survey).select_related('virtual_type'):
+        question = questions_by_id[option.question_id]
+        _set_cached_related(option, 'question', question)
+        _set_cached_related(option, 'row', rows.get(option.row_id))
+        _set_cached_related(option, 'column', columns.get(option.column_id))
+        question.preloaded_options.append(option)
+        options[option.id] = option
+
+    rules = {}
+    for rule in Rule.objects.filter(subject_question__survey=survey).select_related('rule_type').order_by('id'):
+        question = questions_by_id[rule.subject_question_id]
+        _set_cached_related(rule, 'subject_question', question)
+        if rule.object_question_id is None or rule.object_question_id in questions_by_id:
+            _set_cached_related(rule, 'object_question', questions_by_id.get(rule.object_question_id))
+        rule.preloaded_subject_options = []
+        rule.preloaded_object_options = []
+        question.preloaded_rules.append(rule)
+        rules[rule.id] = rule
+
+    def option_order(option):
+        return (option.question.ordinal, option.ordinal)
+    if rules:
+        for through, attr in ((Rule.subject_options.through, 'preloaded_subject_options'),
+                              (Rule.object_options.through, 'preloaded_object_options')):
+            for rule_id, option_id in through.objects.filter(rule__in=rules.keys()).values_list('rule', 'option'):
+                if option_id in options:
+                    getattr(rules[rule_id], attr).append(options[option_id])
+        for rule in rules.values():
+            rule.preloaded_subject_options.sort(key=option_order)
+            rule.preloaded_object_options.sort(key=option_order)
+
+    if translation_survey is not None:
+        preloaded = {}
+        for model, name, objects in ((TranslationQuestion, 'question', questions_by_id),
+                                     (TranslationQuestionRow, 'row', rows),
+                                     (TranslationQuestionColumn, 'column', columns),
+                                     (TranslationOption, 'option', options)):
+            preloaded[model] = {}
+            for translation in model.objects.filter(translation=translation_survey):
+                object_id = getattr(translation, name+'_id')
+                _set_cached_related(translation, 'translation', translation_survey)
+                if object_id in objects:
+                    _set_cached_related(translation, name, objects[object_id])
+                preloaded[model][object_id] = translation
+        translation_survey.preloaded = preloaded
+
+    survey.preloaded_questions = questions
+    survey.set_translation_survey(translation_survey)
+    return survey
+
 def prefill_previous_data(survey, user_id, global_id):
      """
      fetch data to prefill a user's survey looking first at the current data table and then to another
@@ -239,6 +456,7 @@ class Survey(models.Model):
     
     form = None
     translation_survey = None
+    preloaded_questions = None
 
     _standard_result_fields =[
         ('user', models.IntegerField(null=True, blank=True, verbose_name="User")),
@@ -274,7 +492,7 @@ class Survey(models.Model):
 
     @property
     def questions(self):
-        for question in self.question_set.all():
+        for question in self.get_question_list():
             question.set_form(self.form)
             question.set_translation_survey(self.translation_survey)
             yield question
@@ -283,6 +501,11 @@ class Survey(models.Model):
     def translation(self):
         return self.translation_survey
 
+    def get_question_list(self):
+        if self.preloaded_questions is not None:
+            return self.preloaded_questions
+        return self.question_set.all()
+
     @models.permalink
     def get_absolute_url(self):
         return ('pollster_survey_edit', [str(self.id)])
@@ -326,29 +549,49 @@ class Survey(models.Model):
         raise Exception("Prefill function %s does not exist" % self.prefill_method)
 
     def as_model(self):
+        return self.get_compiled().model
+
+    def as_form(self):
+        return self.get_compiled().form
+
+    def get_compiled(self):
+        key = (self.id, self.updated)
+        compiled = _compiled_surveys.get(key)
+        if compiled is None:
+            compiled = self.compile()
+            if self.id is not None:
+                self.invalidate_compiled()
+                _compiled_surveys[key] = compiled
+        return compiled
+
+    def invalidate_compiled(self):
+        for key in [k for k in _compiled_surveys.keys() if k[0] == self.id]:
+            _compiled_surveys.pop(key, None)
+
+    def compile(self):
         fields = []
         fields.extend(Survey._standard_result_fields)
-        for question in self.questions:
-            fields += question.as_fields()
+        questions = []
+        for question in self.get_question_list():
+            question_fields = question.as_fields()
+            fields += question_fields
+            data_names = [data_name for data_name, data_type in question_fields]
+            questions.append((question.data_name, data_names, question.is_multiple_choice, question.is_mandatory))
         model = dynamicmodels.create(self.get_table_name(), fields=dict(fields), app_label='pollster')
-        return model
 
-    def as_form(self):
-        model = self.as_model()
-        questions = list(self.questions)
         def clean(self):
-            for question in questions:
-                if question.is_multiple_choice and question.is_mandatory:
-                    valid = any([self.cleaned_data.get(d, False) for d in question.data_names])
+            for data_name, data_names, is_multiple_choice, is_mandatory in questions:
+                if is_multiple_choice and is_mandatory:
+                    valid = any([self.cleaned_data.get(d, False) for d in data_names])
                     if not valid:
-                        self._errors[question.data_name] = self.error_class('At least one option should be selected')
+                        self._errors[data_name] = self.error_class('At least one option should be selected')
             return self.cleaned_data
         form = dynamicmodels.to_form(model, {'clean': clean})
 
-        for question in questions:
-            if question.is_mandatory and question.data_name in form.base_fields:
-                form.base_fields[question.data_name].required = True
-        return form
+        for data_name, data_names, is_multiple_choice, is_mandatory in questions:
+            if is_mandatory and data_name in form.base_fields:
+                form.base_fields[data_name].required = True
+        return CompiledSurvey(model, form, questions)
 
     def set_form(self, form):
         self.form = form
@@ -375,17 +618,21 @@ class Survey(models.Model):
         # Unpublish other surveys with the same shortname.
         for o in Survey.objects.filter(shortname=self.shortname, status='PUBLISHED'):
             o.unpublish()
+        self.invalidate_compiled()
         self.status = 'PUBLISHED'
         model = self.as_model()
         table = model._meta.db_table
         if table in connection.introspection.table_names():
             now = datetime.datetime.now()
             backup = table+'_vx_'+format(now, '%Y%m%d%H%M%s')
-            connection.cursor().execute('ALTER TABLE '+table+' RENAME TO '+backup)
+            dynamicmodels.rename_table(table, backup, get_results_table_indexes())
         dynamicmodels.install(model)
+        dynamicmodels.install_indexes(table, get_results_table_indexes())
         db = get_db_type(connection)
         for extra_sql in SURVEY_EXTRA_SQL[db].get(self.shortname, []):
             connection.cursor().execute(extra_sql)
+        if self.shortname == 'weekly':
+            install_health_status_table()
         self.save()
         return None
 
@@ -397,30 +644,114 @@ class Survey(models.Model):
             now = datetime.datetime.now()
             version = self.version or 0
             backup = table+'_v'+str(version)+'_'+format(now, '%Y%m%d%H%M%s')
-            connection.cursor().execute('ALTER TABLE '+table+' RENAME TO '+backup)
+            dynamicmodels.rename_table(table, backup, get_results_table_indexes())
+        self.invalidate_compiled()
         self.status = 'UNPUBLISHED'
         self.save()
 
-    def write_csv(self, writer):
-        model = self.as_model()
-        fields = model._meta.fields
+    def get_archived_table_names(self, season=None):
+        """
+        Results tables archived by publish() and unpublish(), oldest first;
+        `season` (a year) restricts them to the ones archived that year.
+        """
+        table = self.as_model()._meta.db_table
+        pattern = re.compile('^' + re.escape(table) + r'_v(x|\d+)_(\d+)$')
+        tables = []
+        for name in connection.introspection.table_names():
+            match = pattern.match(name)
+            if match and (season is None or match.group(2).startswith(str(season))):
+                tables.append((match.group(2), name))
+        return [name for stamp, name in sorted(tables)]
+
+    def get_results_columns(self, table=None):
+        """
+        Return (column names, headers) of the current results table or of one
+        of its archived versions; archived columns that no longer exist in the
+        survey are labelled with their column name.
+        """
+        fields = self.as_model()._meta.fields
+        if table is None:
+            columns = [field.column for field in fields]
+        else:
+            cursor = connection.cursor()
+            columns = [row[0] for row in connection.introspection.get_table_description(cursor, table)]
+        names = dict([(field.column, field.verbose_name or field.name) for field in fields])
         headers = []
-        for field in fields:
-            name = field.verbose_name or field.name
+        for column in columns:
+            name = names.get(column, column)
             if type(name) is unicode:
                 headers.append(name.encode('utf-8'))
             else:
                 headers.append(str(name))
-        writer.writerow(headers)
-        for result in model.objects.all():
+        return columns, headers
+
+    def _results_where(self, since_id=None, since=None, until_id=None):
+        where, params = [], []
+        if since_id is not None:
+            where.append('id > %s')
+            params.append(since_id)
+        if until_id is not None:
+            where.append('id <= %s')
+            params.append(until_id)
+        if since is not None:
+            where.append(connection.ops.quote_name('timestamp') + ' > %s')
+            params.append(since)
+        if not where:
+            return '', params
+        return ' WHERE ' + ' AND '.join(where), params
+
+    def get_results_watermark(self, table=None, since_id=None, since=None):
+        """
+        Return (max id, max timestamp) of the results newer than the given
+        watermark, or (None, None) if there are none. Exports should be
+        bounded by this id so that rows inserted while exporting are left
+        for the next run.
+        """
+        table = table or self.as_model()._meta.db_table
+        where, params = self._results_where(since_id, since)
+        cursor = connection.cursor()
+        qn = connection.ops.quote_name
+        cursor.execute("SELECT max(id), max(%s) FROM %s%s" % (qn('timestamp'), qn(table), where), params)
+        return cursor.fetchone()
+
+    def iter_results(self, chunk_size=2000, table=None, since_id=None, since=None, until_id=None):
+        """
+        Yield the results of this survey (or of one of its archived tables)
+        as tuples of column values, in the order of get_results_columns(),
+        fetched in chunks from a server side cursor so that no model
+        instances are built and memory use does not depend on the size of
+        the results table.
+        """
+        qn = connection.ops.quote_name
+        columns, headers = self.get_results_columns(table)
+        table = table or self.as_model()._meta.db_table
+        where, params = self._results_where(since_id, since, until_id)
+        sql = "SELECT %s FROM %s%s ORDER BY id" % (', '.join([qn(c) for c in columns]), qn(table), where)
+        cursor = server_side_cursor(connection, 'pollster_results_%d' % (self.id,))
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+    def iter_csv_rows(self, chunk_size=2000, **kwargs):
+        columns, headers = self.get_results_columns(kwargs.get('table'))
+        yield headers
+        for result in self.iter_results(chunk_size, **kwargs):
             row = []
-            for field in fields:
-                val = getattr(result, field.name)
-                if callable(val):
-                    val = val()
+            for val in result:
                 if type(val) is unicode:
                     val = val.encode('utf-8')
                 row.append(val)
+            yield row
+
+    def write_csv(self, writer):
+        for row in self.iter_csv_rows():
             writer.writerow(row)
 
 class RuleType(models.Model):
@@ -487,6 +818,10 @@ class Question(models.Model):
     form = None
     translation_survey = None
     translation_question = None
+    preloaded_rows = None
+    preloaded_columns = None
+    preloaded_options = None
+    preloaded_rules = None
 
     @property
     def translated_title(self):
@@ -518,13 +853,13 @@ class Question(models.Model):
 
     @property
     def rows(self):
-        for row in self.row_set.all():
+        for row in self.get_row_list():
             row.set_translation_survey(self.translation_survey)
             yield row
 
     @property
     def columns(self):
-        for column in self.column_set.all():
+        for column in self.get_column_list():
             column.set_translation_survey(self.translation_survey)
             yield column
 
@@ -544,15 +879,36 @@ class Question(models.Model):
 
     @property
     def options(self):
-        for option in self.option_set.all():
+        for option in self.get_option_list():
             option.set_form(self.form)
             option.set_translation_survey(self.translation_survey)
             yield option
 
+    @property
+    def rules(self):
+        if self.preloaded_rules is not None:
+            return self.preloaded_rules
+        return self.subject_of_rules.all()
+
     @property
     def translation(self):
         return self.translation_question
 
+    def get_row_list(self):
+        if self.preloaded_rows is not None:
+            return self.preloaded_rows
+        return self.row_set.all()
+
+    def get_column_list(self):
+        if self.preloaded_columns is not None:
+            return self.preloaded_columns
+        return self.column_set.all()
+
+    def get_option_list(self):
+        if self.preloaded_options is not None:
+            return self.preloaded_options
+        return self.option_set.all()
+
     @property
     def css_classes(self):
         c = ['question', 'question-'+self.type, self.data_type.css_class]
@@ -616,12 +972,12 @@ class Question(models.Model):
         elif self.type == 'single-choice':
             open_option_data_type = self.open_option_data_type or self.data_type
             fields = [ (self.data_name, self.data_type.as_field_type(verbose_name=self.title)) ]
-            for open_option in [o for o in self.option_set.all() if o.is_open]:
+            for open_option in [o for o in self.get_option_list() if o.is_open]:
                 title_open = "%s: %s Open Answer" % (self.title, open_option.value)
                 fields.append( (open_option.open_option_data_name, open_option_data_type.as_field_type(verbose_name=title_open)) )
         elif self.type == 'multiple-choice':
             fields = []
-            for option in self.option_set.all():
+            for option in self.get_option_list():
                 title = "%s: %s" % (self.title, option.value)
                 fields.append( (option.data_name, models.BooleanField(verbose_name=title)) )
                 if option.is_open:
@@ -645,9 +1001,7 @@ class Question(models.Model):
     def set_translation_survey(self, translation_survey):
         self.translation_survey = translation_survey
         if translation_survey:
-            r = translation_survey.translationquestion_set.all().filter(question=self)
-            default = TranslationQuestion(translation = translation_survey, question=self)
-            self.translation_question = _get_or_default(r, default)
+            self.translation_question = translation_survey.get_translation(TranslationQuestion, 'question', self)
 
     def check(self):
         errors = []
@@ -693,9 +1047,7 @@ class QuestionRow(models.Model):
     def set_translation_survey(self, translation_survey):
         self.translation_survey = translation_survey
         if translation_survey:
-            r = translation_survey.translationquestionrow_set.all().filter(row=self)
-            default = TranslationQuestionRow(translation = translation_survey, row=self)
-            self.translation_row = _get_or_default(r, default)
+            self.translation_row = translation_survey.get_translation(TranslationQuestionRow, 'row', self)
 
 class QuestionColumn(models.Model):
     question = models.ForeignKey(Question, related_name="column_set", db_index=True)
@@ -725,9 +1077,7 @@ class QuestionColumn(models.Model):
     def set_translation_survey(self, translation_survey):
         self.translation_survey = translation_survey
         if translation_survey:
-            r = translation_survey.translationquestioncolumn_set.all().filter(column=self)
-            default = TranslationQuestionColumn(translation = translation_survey, column=self)
-            self.translation_column = _get_or_default(r, default)
+            self.translation_column = translation_survey.get_translation(TranslationQuestionColumn, 'column', self)
 
     def set_row(self, row):
         self.row = row
@@ -847,9 +1197,7 @@ class Option(models.Model):
     def set_translation_survey(self, translation_survey):
         self.translation_survey = translation_survey
         if translation_survey:
-            r = translation_survey.translationoption_set.all().filter(option=self)
-            default = TranslationOption(translation = translation_survey, option=self)
-            self.translation_option = _get_or_default(r, default)
+            self.translation_option = translation_survey.get_translation(TranslationOption, 'option', self)
 
     def set_row_column(self, row, column):
         self.current_row_column = (row, column)
@@ -876,6 +1224,21 @@ class Rule(models.Model):
     object_question = models.ForeignKey(Question, related_name='object_of_rules', blank=True, null=True)
     object_options = models.ManyToManyField(Option, related_name='object_of_rules', limit_choices_to = {'question': object_question})
 
+    preloaded_subject_options = None
+    preloaded_object_options = None
+
+    @property
+    def subject_option_list(self):
+        if self.preloaded_subject_options is not None:
+            return self.preloaded_subject_options
+        return self.subject_options.all()
+
+    @property
+    def object_option_list(self):
+        if self.preloaded_object_options is not None:
+            return self.preloaded_object_options
+        return self.object_options.all()
+
     def js_class(self):
         return self.rule_type.js_class
 
@@ -890,6 +1253,9 @@ class TranslationSurvey(models.Model):
     title = models.CharField(max_length=255, blank=True, default='')
     status = models.CharField(max_length=255, default='DRAFT', choices=SURVEY_TRANSLATION_STATUS_CHOICES)
 
+    # Translation rows by model and translated object id, see load_survey_tree().
+    preloaded = None
+
     class Meta:
         verbose_name = 'Translation'
         ordering = ['survey', 'language']
@@ -902,6 +1268,19 @@ class TranslationSurvey(models.Model):
     def __unicode__(self):
         return "TranslationSurvey(%s) for %s" % (self.language, self.survey)
 
+    def get_translation(self, model, name, obj):
+        """
+        Return the `model` translation row pointing to `obj` through the
+        foreign key `name`, or a new unsaved one if there is none yet.
+        """
+        if self.preloaded is not None:
+            translation = self.preloaded[model].get(obj.id)
+        else:
+            translation = _get_or_default(model.objects.filter(translation=self, **{name: obj}))
+        if translation is None:
+            translation = model(translation=self, **{name: obj})
+        return translation
+
     def as_form(self, data=None):
         class TranslationSurveyForm(ModelForm):
             class Meta:
@@ -988,6 +1367,37 @@ class TranslationOption(models.Model):
                 fields = ['text', 'description']
         return TranslationOptionForm(data, instance=self, prefix="option_%s"%(self.id,))
 
+# Chart data (load_data() results and google-charts JSON) keyed by chart,
+# Chart.updated and the sqlfilter scope. Chart tables only change through
+# update_table()/update_data(), which touch `updated`, so non-realtime charts
+# are cached until then; realtime charts are cached for
+# POLLSTER_REALTIME_CHART_CACHE_TTL seconds (not at all by default).
+_chart_cache = LRUCache(getattr(settings, 'POLLSTER_CHART_CACHE_SIZE', 1000))
+
+CHART_DATA_ERROR = (('Error',),)
+
+# Prepared mapnik maps (style, colors and datasource) keyed like the chart
+# data cache, so rendering a tile only changes the bounding box and draws.
+_mapnik_maps = ObjectPool(getattr(settings, 'POLLSTER_MAPNIK_POOL_SIZE', 16))
+
+# Functions a chart source may call and still be fingerprinted by
+# Chart.get_source_digest(): deterministic builtins and SQL keywords that
+# are followed by a parenthesis. Anything else (stored functions such as
+# pollster_ili_incidence(), now(), random()) makes the chart always dirty.
+SOURCE_DIGEST_SAFE_CALLS = frozenset([
+    'abs', 'and', 'as', 'avg', 'case', 'cast', 'ceil', 'coalesce', 'count',
+    'distinct', 'exists', 'floor', 'from', 'greatest', 'in', 'join', 'least',
+    'length', 'lower', 'max', 'min', 'not', 'nullif', 'on', 'or', 'over',
+    'round', 'select', 'substr', 'substring', 'sum', 'then', 'trim', 'union',
+    'upper', 'using', 'values', 'when', 'where', 'with',
+])
+
+SOURCE_DIGEST_TIME_WORDS = frozenset([
+    'now', 'current_date', 'current_time', 'current_timestamp', 'localtime',
+    'localtimestamp', 'clock_timestamp', 'statement_timestamp', 'timeofday',
+    'transaction_timestamp',
+])
+
 class ChartType(models.Model):
     shortname = models.SlugField(max_length=255, unique=True)
     description = models.CharField(max_length=255)
@@ -1008,6 +1418,13 @@ class Chart(models.Model):
     geotable = models.CharField(max_length=255, default='pollster_zip_codes', choices=settings.GEOMETRY_TABLES)
     template = models.TextField(blank=True, default='')
     realtime = models.BooleanField(default=False)
+    # Let chart_update skip the chart when the tables read by sqlsource did
+    # not change since the last refresh() (see get_source_digest()).
+    skip_unchanged_sources = models.BooleanField(default=False, verbose_name="Skip refresh if sources are unchanged")
+    # Fingerprints of the sources and of the data of the last refresh(), used
+    # to skip charts whose data cannot have changed.
+    source_digest = models.CharField(max_length=32, blank=True, default='', editable=False)
+    data_digest = models.CharField(max_length=32, blank=True, default='', editable=False)
 
     class Meta:
         ordering = ['survey', 'shortname']
@@ -1039,9 +1456,35 @@ class Chart(models.Model):
         else:
             return True
 
+    def get_cache_key(self, kind, user_id, global_id):
+        if self.sqlfilter == 'USER':
+            scope = (user_id,)
+        elif self.sqlfilter == 'PERSON':
+            scope = (user_id, global_id)
+        else:
+            scope = ()
+        return (kind, self.id, self.updated) + scope
+
+    def get_cache_ttl(self):
+        """Seconds to cache chart data for: None means until the chart changes, 0 not at all."""
+        if self.realtime:
+            return getattr(settings, 'POLLSTER_REALTIME_CHART_CACHE_TTL', 0)
+        return None
+
+    def touch(self):
+        """Bump `updated` (without saving the other fields) to invalidate cached chart data."""
+        self.updated = datetime.datetime.now()
+        Chart.objects.filter(pk=self.pk).update(updated=self.updated)
+
     def to_json(self, user_id, global_id):
         data = {}
         if self.type.shortname == "google-charts":
+            key = self.get_cache_key('json', user_id, global_id)
+            ttl = self.get_cache_ttl()
+            if ttl != 0:
+                result = _chart_cache.get(key)
+                if result is not None:
+                    return result
             data[ "chartType"] = "Table"
             if self.chartwrapper:
                 data = json.loads(self.chartwrapper)
@@ -1049,6 +1492,10 @@ class Chart(models.Model):
             cols = [{"id": desc[0], "label": desc[0], "type": "number"} for desc in descriptions]
             rows = [{"c": [{"v": v} for v in c]} for c in cells]
             data["dataTable"] = { "cols": cols, "rows": rows }
+            result = json.dumps(data)
+            if ttl != 0 and descriptions is not CHART_DATA_ERROR:
+                _chart_cache.set(key, result, ttl)
+            return result
 
         elif self.type.shortname[:10] == "google-map":
             if self.chartwrapper:
@@ -1082,23 +1529,59 @@ class Chart(models.Model):
                     result[description[i][0]] = str(data[0][i])
         return json.dumps(result)
 
-    def get_map_tile(self, user_id, global_id, z, x, y):
-        filename = self.get_map_tile_filename(z, x, y)
+    def get_map_tile_suffix(self, user_id, global_id):
         if self.sqlfilter == "USER" and user_id:
-            filename = filename + "_user_" + str(user_id)
+            return "_user_" + str(user_id)
         elif self.sqlfilter == "PERSON" and global_id:
-            filename = filename + "_gid_" + global_id
-        if not os.path.exists(filename):
-            self.generate_map_tile(self.generate_mapnik_map(user_id, global_id), filename, z, x, y)
-        return open(filename).read()
+            return "_gid_" + global_id
+        return ""
 
-    def generate_map_tile(self, m, filename, z, x, y):
+    def get_tile_store(self):
+        return get_tile_store(self)
+
+    def get_map_tile(self, user_id, global_id, z, x, y):
+        store = self.get_tile_store()
+        suffix = self.get_map_tile_suffix(user_id, global_id)
+        data = store.get(z, x, y, suffix)
+        if data is None:
+            self.generate_map_metatile(user_id, global_id, z, x, y)
+            data = store.get(z, x, y, suffix)
+        return data
+
+    def get_metatile(self, z, x, y):
+        """Return (x, y, size) of the metatile containing tile (z, x, y)."""
+        size = min(METATILE_SIZE, 2 ** z)
+        return (x - x % size, y - y % size, size)
+
+    def generate_map_metatile(self, user_id, global_id, z, x, y):
+        """
+        Render the metatile containing tile (z, x, y) and store all of its
+        tiles. Concurrent requests for tiles of the same metatile wait for
+        the first one to finish instead of rendering it again.
+        """
+        store = self.get_tile_store()
+        suffix = self.get_map_tile_suffix(user_id, global_id)
+        mx, my, size = self.get_metatile(z, x, y)
+        with store.lock(z, mx, my, suffix):
+            if store.get(z, x, y, suffix) is None:
+                key = self.get_cache_key('mapnik', user_id, global_id)
+                m = _mapnik_maps.checkout(key, lambda: self.generate_mapnik_map(user_id, global_id))
+                tiles = self.generate_map_tiles(m, z, mx, my, size)
+                # Maps are only reused after a successful render.
+                _mapnik_maps.checkin(key, m)
+                store.put_many(z, tiles, suffix)
+
+    def generate_map_tiles(self, m, z, x, y, size):
+        """
+        Render the size x size block of tiles whose top left tile is (z, x, y)
+        in one pass; returns a list of (x, y, PNG data) tuples.
+        """
         # Code taken from OSM generate_tiles.py
         proj = GoogleProjection()
         mprj = mapnik.Projection(m.srs)
 
-        p0 = (x * 256, (y + 1) * 256)
-        p1 = ((x + 1) * 256, y * 256)
+        p0 = (x * 256, (y + size) * 256)
+        p1 = ((x + size) * 256, y * 256)
         l0 = proj.fromPixelToLL(p0, z);
         l1 = proj.fromPixelToLL(p1, z);
         c0 = mprj.forward(mapnik.Coord(l0[0], l0[1]))
@@ -1109,18 +1592,52 @@ class Chart(models.Model):
         else:
             bbox = mapnik.Envelope(c0.x, c0.y, c1.x, c1.y)
 
-        m.resize(256, 256)
+        m.resize(256 * size, 256 * size)
         m.zoom_to_box(bbox)
 
-        im = mapnik.Image(256, 256)
+        im = mapnik.Image(256 * size, 256 * size)
         mapnik.render(m, im)
         # See https://github.com/mapnik/mapnik/wiki/OutputFormats for output
         # formats and special parameters. The default here is 32 bit PNG with 8
         # bit per component and alpha channel.
         if mapnik_version == 2:
-            im.save(str(filename), "png32")
+            format = "png32"
         else:
-            im.save(str(filename), "png")
+            format = "png"
+        tiles = []
+        for i in range(size):
+            for j in range(size):
+                tiles.append((x + i, y + j, im.view(i * 256, j * 256, 256, 256).tostring(format)))
+        return tiles
+
+    def generate_map_tile(self, m, filename, z, x, y):
+        f = open(filename, 'wb')
+        f.write(self.generate_map_tiles(m, z, x, y, 1)[0][2])
+        f.close()
+
+    def get_seed_area(self):
+        """
+        Return the (bbox, zoom range) over which tiles are pre-rendered:
+        POLLSTER_SEED_BBOX and POLLSTER_SEED_ZOOM if set, otherwise the area
+        of a 1280x1024 viewport around the center stored in the chart
+        wrapper, at its zoom level and the next two.
+        """
+        bounds = {}
+        if self.chartwrapper:
+            try:
+                bounds = json.loads(self.chartwrapper)
+            except ValueError:
+                pass
+        z = int(bounds.get('z', 6))
+        zoom = getattr(settings, 'POLLSTER_SEED_ZOOM', (z, z + 2))
+        bbox = getattr(settings, 'POLLSTER_SEED_BBOX', None)
+        if bbox is None:
+            proj = GoogleProjection()
+            cx, cy = proj.fromLLtoPixel((float(bounds.get('lng', 0)), float(bounds.get('lat', 0))), z)
+            min_lng, min_lat = proj.fromPixelToLL((cx - 640, cy + 512), z)
+            max_lng, max_lat = proj.fromPixelToLL((cx + 640, cy - 512), z)
+            bbox = (min_lng, min_lat, max_lng, max_lat)
+        return bbox, zoom
 
     def generate_mapnik_map(self, user_id, global_id):
         m = mapnik.Map(256, 256)
@@ -1199,60 +1716,246 @@ class Chart(models.Model):
         return filename
 
     def clear_map_tile_cache(self):
+        self.get_tile_store().clear()
         try:
-            shutil.rmtree(self.get_map_tile_base())
+            shutil.rmtree(self.get_geojson_base())
         except:
             pass
 
+    def get_geojson_base(self):
+        return "%s/_pollster_geojson/survey_%s/%s" % (settings.POLLSTER_CACHE_PATH, self.survey_id, self.shortname)
+
+    def get_geojson(self, user_id, global_id, z):
+        """
+        The chart rows as a GeoJSON FeatureCollection of their zip code
+        areas, simplified for zoom level z; cached in a file per chart
+        version, zoom level and results filter scope.
+        """
+        z = min(z, getattr(settings, 'POLLSTER_GEOJSON_MAX_ZOOM', 12))
+        filename = None
+        if not self.realtime:
+            version = format(self.updated, '%Y%m%d%H%M%S%f')
+            filename = "%s/%s.%s%s.json" % (self.get_geojson_base(), version, z, self.get_map_tile_suffix(user_id, global_id))
+            if os.path.exists(filename):
+                return open(filename).read()
+
+        # Douglas-Peucker tolerance of POLLSTER_GEOJSON_TOLERANCE pixels at
+        # this zoom level, in degrees.
+        tolerance = getattr(settings, 'POLLSTER_GEOJSON_TOLERANCE', 1.0) * 360.0 / (256 * 2 ** z)
+        descriptions, cells = self.load_data(user_id, global_id)
+        cols = [desc[0].lower() for desc in descriptions]
+        features = []
+        failed = False
+        if descriptions is not CHART_DATA_ERROR and 'zip_code_key' in cols:
+            try:
+                index = get_geo_index(self.geotable)
+                key_col = cols.index('zip_code_key')
+                country_col = cols.index('zip_code_country') if 'zip_code_country' in cols else None
+                for cell in cells:
+                    country = country_col is not None and cell[country_col] or None
+                    polygons = index.get_polygons(cell[key_col], country)
+                    if not polygons:
+                        continue
+                    coordinates = [[[[round(x, 6), round(y, 6)] for x, y in ring] for ring in polygon]
+                                   for polygon in simplify(polygons, tolerance)]
+                    properties = {}
+                    for i, value in enumerate(cell):
+                        if not isinstance(value, (int, long, float, basestring, type(None))):
+                            value = str(value)
+                        properties[cols[i]] = value
+                    features.append({
+                        "type": "Feature",
+                        "geometry": {"type": "MultiPolygon", "coordinates": coordinates},
+                        "properties": properties,
+                    })
+            except (DatabaseError, ValueError, IndexError):
+                # The geometry table cannot be loaded (e.g. no spatial
+                # support) or holds bad geometries: answer an empty
+                # collection, without caching it, like load_info() does.
+                transaction.rollback_unless_managed()
+                features = []
+                failed = True
+        result = json.dumps({"type": "FeatureCollection", "features": features})
+
+        if filename and descriptions is not CHART_DATA_ERROR and not failed:
+            pathname = os.path.dirname(filename)
+            if not os.path.exists(pathname):
+                try:
+                    os.makedirs(pathname)
+                except OSError:
+                    pass
+            try:
+                write_file(filename, result)
+            except (IOError, OSError):
+                # The cache is only an optimization: serve the result anyway.
+                pass
+        return result
+
     def get_table_name(self):
         return 'pollster_charts_'+str(self.survey.shortname)+'_'+str(self.shortname)
 
     def get_view_name(self):
         return self.get_table_name() + "_view"
 
+    def get_shadow_table_name(self):
+        # Unique per build, so that overlapping chart_update runs do not drop
+        # or rename each other's shadow table.
+        return "%s_shadow_%s" % (self.get_table_name(), uuid.uuid4().hex[:8])
+
+    def get_view_query(self):
+        table = self.get_table_name()
+        if re.search(r'\bzip_code_country\b', self.sqlsource):
+            return """SELECT A.*, B.id AS OGC_FID, B.geometry
+                        FROM %s B, (SELECT * FROM %s) A
+                       WHERE upper(A.zip_code_key) = upper(B.zip_code_key)
+                         AND upper(A.zip_code_country) = upper(B.country)""" % (self.geotable, table,)
+        return """SELECT A.*, B.id AS OGC_FID, B.geometry
+                    FROM %s B, (SELECT * FROM %s) A
+                   WHERE upper(A.zip_code_key) = upper(B.zip_code_key)""" % (self.geotable, table,)
+
     def update_table(self):
         table_query = self.sqlsource
-        geo_table = self.geotable
         if table_query:
             table = self.get_table_name()
             view = self.get_view_name()
-            
-            if re.search(r'\bzip_code_country\b', table_query):
-                view_query = """SELECT A.*, B.id AS OGC_FID, B.geometry
-                                  FROM %s B, (SELECT * FROM %s) A
-                                 WHERE upper(A.zip_code_key) = upper(B.zip_code_key)
-                                   AND upper(A.zip_code_country) = upper(B.country)""" % (geo_table, table,)
-            else:
-                view_query = """SELECT A.*, B.id AS OGC_FID, B.geometry
-                                  FROM %s B, (SELECT * FROM %s) A
-                                 WHERE upper(A.zip_code_key) = upper(B.zip_code_key)""" % (geo_table, table,)
             cursor = connection.cursor()
             cursor.execute("DROP VIEW IF EXISTS %s" % (view,))
             cursor.execute("DROP TABLE IF EXISTS %s" % (table,))
             if not self.realtime:
                 cursor.execute("CREATE TABLE %s AS %s" % (table, table_query))
                 if self.type.shortname[:10] == "google-map":
-                    cursor.execute("CREATE VIEW %s AS %s" % (view, view_query))
+                    cursor.execute("CREATE VIEW %s AS %s" % (view, self.get_view_query()))
+                self.touch()
+                # The table was rebuilt from scratch: make the next refresh()
+                # recompute the fingerprints.
+                self.source_digest = self.data_digest = ''
+                Chart.objects.filter(pk=self.pk).update(source_digest='', data_digest='')
                 transaction.commit_unless_managed()
                 self.clear_map_tile_cache()
             return True
         return False
 
     def update_data(self):
-        table_query = self.sqlsource
-        if table_query and not self.realtime:
-            table = self.get_table_name()
-            cursor = connection.cursor()
-            cursor.execute("DELETE FROM %s" % (table,))
-            cursor.execute("INSERT INTO %s %s" % (table, table_query))
+        """
+        Rebuild the chart table into a shadow table and swap it in, so that
+        readers never see a partially filled table.
+        """
+        if self.sqlsource and not self.realtime:
+            self.swap_shadow_table(self.build_shadow_table())
             transaction.commit_unless_managed()
             self.clear_map_tile_cache()
             return True
         return False
 
+    def build_shadow_table(self):
+        """Fill a new shadow table from the SQL source; returns its name."""
+        shadow = self.get_shadow_table_name()
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE %s AS %s" % (shadow, self.sqlsource))
+        transaction.commit_unless_managed()
+        return shadow
+
+    def drop_shadow_table(self, shadow):
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS %s" % (shadow,))
+        transaction.commit_unless_managed()
+
+    def swap_shadow_table(self, shadow):
+        table = self.get_table_name()
+        view = self.get_view_name()
+        # DDL is transactional on both PostgreSQL and SQLite: readers keep
+        # seeing the old table until the new one is complete.
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.execute("DROP VIEW IF EXISTS %s" % (view,))
+            cursor.execute("DROP TABLE IF EXISTS %s" % (table,))
+            cursor.execute("ALTER TABLE %s RENAME TO %s" % (shadow, table))
+            if self.type.shortname[:10] == "google-map":
+                cursor.execute("CREATE VIEW %s AS %s" % (view, self.get_view_query()))
+            self.touch()
+
+    def get_source_digest(self):
+        """
+        Fingerprint the SQL source and the tables it reads, using the
+        insert/update/delete counters PostgreSQL keeps per table. None means
+        the sources cannot be fingerprinted and the chart must always be
+        refreshed: other databases, sources reading views, calling functions
+        (e.g. pollster_ili_incidence()) or depending on the current time,
+        and sources in which no table was found.
+        """
+        if get_db_type(connection) != 'postgresql':
+            return None
+        sql = self.sqlsource.lower()
+        words = set(re.findall(r'[a-z_][a-z0-9_]*', sql))
+        if words.intersection(SOURCE_DIGEST_TIME_WORDS):
+            return None
+        called = set(re.findall(r'([a-z_][a-z0-9_]*)\s*\(', sql))
+        if called.difference(SOURCE_DIGEST_SAFE_CALLS):
+            return None
+        tables = sorted(words.intersection(connection.introspection.table_names()))
+        if not tables:
+            return None
+        parts = [self.sqlsource.encode('utf-8'), self.geotable]
+        for name in tables:
+            if get_relation_type(connection, name) != 'table':
+                return None
+            row = get_table_change_counters(connection, name)
+            if row is None:
+                return None
+            # The counters lag commits by a moment; a change they miss is
+            # already visible to the query building the data, and the next
+            # run sees the new counters.
+            parts.append('%s:%s:%s:%s:%s' % ((name,) + tuple(row)))
+        return hashlib.md5('\n'.join(parts)).hexdigest()
+
+    def get_data_digest(self, table):
+        return get_table_digest(connection, table)
+
+    def refresh(self, force=False):
+        """
+        Incremental version of update_data() used by chart_update; returns
+        'skipped' (realtime or no SQL), 'unchanged' (sources or data did not
+        change) or 'updated'. Cached data and tiles are only invalidated when
+        the data actually changed.
+        """
+        if not self.sqlsource or self.realtime:
+            return 'skipped'
+        exists = self.get_table_name() in connection.introspection.table_names()
+        source_digest = self.skip_unchanged_sources and self.get_source_digest() or None
+        if not force and exists and source_digest and source_digest == self.source_digest:
+            return 'unchanged'
+        shadow = None
+        try:
+            shadow = self.build_shadow_table()
+            data_digest = self.get_data_digest(shadow)
+            changed = force or not exists or data_digest != self.data_digest
+            if changed:
+                self.swap_shadow_table(shadow)
+            else:
+                self.drop_shadow_table(shadow)
+        except DatabaseError:
+            transaction.rollback_unless_managed()
+            if shadow:
+                self.drop_shadow_table(shadow)
+            raise
+        self.source_digest = source_digest or ''
+        self.data_digest = data_digest
+        Chart.objects.filter(pk=self.pk).update(source_digest=self.source_digest, data_digest=self.data_digest)
+        transaction.commit_unless_managed()
+        if not changed:
+            return 'unchanged'
+        self.clear_map_tile_cache()
+        return 'updated'
+
     def load_data(self, user_id, global_id):
         if not self.sqlsource:
-            return ((('Error',),), (("SQL query is missing",),))
+            return (CHART_DATA_ERROR, (("SQL query is missing",),))
+        key = self.get_cache_key('data', user_id, global_id)
+        ttl = self.get_cache_ttl()
+        if ttl != 0:
+            data = _chart_cache.get(key)
+            if data is not None:
+                return data
         if self.realtime:
             query = "SELECT * FROM (%s) A" % (self.sqlsource,)
         else:
@@ -1268,10 +1971,13 @@ class Chart(models.Model):
             cursor = connection.cursor()
             cursor.execute(query, params)
             transaction.savepoint_commit(sid)
-            return (cursor.description, cursor.fetchall())
+            data = (cursor.description, cursor.fetchall())
         except DatabaseError, e:
             transaction.savepoint_rollback(sid)
-            return ((('Error',),), ((str(e),),))
+            return (CHART_DATA_ERROR, ((str(e),),))
+        if ttl != 0:
+            _chart_cache.set(key, data, ttl)
+        return data
 
     def load_colors(self, user_id, global_id):
         if not self.sqlsource:
@@ -1300,6 +2006,32 @@ class Chart(models.Model):
             return ['#ff0000']
 
     def load_info(self, lat, lng):
+        """
+        Return (description, rows) of the chart data for the area at the
+        point, resolved with the in-memory index of the geometry table; falls
+        back to a spatial query on the chart view.
+        """
+        try:
+            areas = get_geo_index(self.geotable).lookup(lng, lat)
+        except (DatabaseError, ValueError, IndexError):
+            transaction.rollback_unless_managed()
+            return self.load_info_spatial(lat, lng)
+        query = "SELECT * FROM %s WHERE upper(zip_code_key) = upper(%%s)" % (self.get_table_name(),)
+        with_country = re.search(r'\bzip_code_country\b', self.sqlsource)
+        if with_country:
+            query += " AND upper(zip_code_country) = upper(%s)"
+        try:
+            cursor = connection.cursor()
+            for zip_code_key, country in areas:
+                cursor.execute(query, with_country and [zip_code_key, country] or [zip_code_key])
+                rows = cursor.fetchmany(1)
+                if rows:
+                    return (cursor.description, rows)
+        except DatabaseError, e:
+            transaction.rollback_unless_managed()
+        return (None, [])
+
+    def load_info_spatial(self, lat, lng):
         view = self.get_view_name()
         query = "SELECT * FROM %s WHERE ST_Contains(geometry, 'SRID=4326;POINT(%%s %%s)')" % (view,)
         try:
@@ -1310,6 +2042,9 @@ class Chart(models.Model):
             return (None, [])
 
     def load_zip_coords(self, zip_code_key, zip_code_country=None):
+        coords = get_zip_code_index(self.geotable).get_coords(zip_code_key, zip_code_country)
+        if coords is not None:
+            return coords
         geo_table = self.geotable
         if zip_code_country:
             query = """SELECT ST_Y(ST_Centroid(geometry)) AS lat, ST_X(ST_Centroid(geometry)) AS lng
@@ -1380,6 +2115,25 @@ class GoogleProjection:
          h = RAD_TO_DEG * ( 2 * atan(exp(g)) - 0.5 * pi)
          return (f,h)
 
+def get_metatiles(bbox, zoom):
+    """
+    Yield (z, x, y) of the top left tile of every metatile covering `bbox`
+    (min_lng, min_lat, max_lng, max_lat) at the zoom levels in `zoom` (min,
+    max, inclusive).
+    """
+    proj = GoogleProjection()
+    min_lng, min_lat, max_lng, max_lat = bbox
+    for z in range(int(zoom[0]), int(zoom[1]) + 1):
+        size = min(METATILE_SIZE, 2 ** z)
+        last = 2 ** z - 1
+        px0 = proj.fromLLtoPixel((min_lng, max_lat), z)
+        px1 = proj.fromLLtoPixel((max_lng, min_lat), z)
+        x0, y0 = [max(0, min(last, int(p // 256))) for p in px0]
+        x1, y1 = [max(0, min(last, int(p // 256))) for p in px1]
+        for x in range(x0 - x0 % size, x1 + 1, size):
+            for y in range(y0 - y0 % size, y1 + 1, size):
+                yield (z, x, y)
+
 class SurveyChartPlugin(CMSPlugin):
     chart = models.ForeignKey(Chart)
     show_on_success = models.BooleanField(default=False, verbose_name="Show on submit", help_text="Show this chart only on successful submit of its survey.")
@@ -1,8 +1,154 @@
-from django.db import models
+from django.db import models, connection, transaction
 from xml.etree import ElementTree
 import re, warnings
 import models
 
+#########################
+# bulk tree updates
+#########################
+
+def _get(objects, model, key):
+    if key not in objects:
+        raise model.DoesNotExist('%s matching %s does not exist' % (model.__name__, key))
+    return objects[key]
+
+class SurveyTreeLookups(object):
+    """Data, virtual option and rule types, fetched once per parsed survey."""
+    def __init__(self):
+        self.data_types = list(models.QuestionDataType.objects.all())
+        self.virtual_option_types = list(models.VirtualOptionType.objects.all())
+        self.rule_types = list(models.RuleType.objects.all())
+
+    def _find(self, objects, model, attr, value):
+        return _get(dict([(getattr(o, attr), o) for o in objects]), model, value)
+
+    def data_type(self, id=None, js_class=None, title=None):
+        if id is not None:
+            return self._find(self.data_types, models.QuestionDataType, 'id', int(id))
+        if js_class is not None:
+            return self._find(self.data_types, models.QuestionDataType, 'js_class', js_class)
+        return self._find(self.data_types, models.QuestionDataType, 'title', title)
+
+    def default_type(self):
+        return self.data_type(title='Text')
+
+    def default_timestamp_type(self):
+        return self.data_type(title='Timestamp')
+
+    def virtual_option_type(self, id=None, js_class=None):
+        if id is not None:
+            return self._find(self.virtual_option_types, models.VirtualOptionType, 'id', int(id))
+        return self._find(self.virtual_option_types, models.VirtualOptionType, 'js_class', js_class)
+
+    def rule_type(self, id=None, js_class=None):
+        if id is not None:
+            return self._find(self.rule_types, models.RuleType, 'id', int(id))
+        return self._find(self.rule_types, models.RuleType, 'js_class', js_class)
+
+class SurveyTreeChanges(object):
+    """
+    Inserts, updates and deletes collected while parsing a survey, applied in
+    one transaction by apply(). Objects are only saved when new or when one
+    of their fields actually changed; foreign keys to objects that do not
+    exist yet are resolved when saving, in the order objects were added.
+    """
+    # Deleting a question cascades to its rows, columns, options and rules,
+    # so the children go first.
+    DELETE_ORDER = (models.Rule, models.Option, models.QuestionRow, models.QuestionColumn, models.Question)
+
+    def __init__(self, survey):
+        self.survey = survey
+        self.lookups = SurveyTreeLookups()
+        self.existing = dict([(model, {}) for model in self.DELETE_ORDER])
+        if survey.id is not None:
+            models.load_survey_tree(survey)
+            for question in survey.preloaded_questions:
+                self.existing[models.Question][question.id] = question
+                for model, objects in ((models.QuestionRow, question.preloaded_rows),
+                                       (models.QuestionColumn, question.preloaded_columns),
+                                       (models.Option, question.preloaded_options),
+                                       (models.Rule, question.preloaded_rules)):
+                    for obj in objects:
+                        self.existing[model][obj.id] = obj
+        self.saves = []
+        self.pending = set()
+        self.deletes = {}
+        self.rule_options = []
+
+    def set(self, obj, parents=None, **values):
+        """Assign field `values` and `parents` (foreign key name to object) to `obj`."""
+        changed = obj.id is None
+        for name, value in values.items():
+            if getattr(obj, name) != value:
+                setattr(obj, name, value)
+                changed = True
+        parents = parents or {}
+        for name, parent in parents.items():
+            if parent is None:
+                changed = changed or getattr(obj, name+'_id') is not None
+            elif parent.id is None or getattr(obj, name+'_id') != parent.id:
+                changed = True
+        if changed and id(obj) not in self.pending:
+            self.pending.add(id(obj))
+            self.saves.append((obj, parents))
+        return obj
+
+    def get(self, model, id):
+        """Existing object of the survey with the given id."""
+        return _get(self.existing[model], model, int(id))
+
+    def delete(self, model, id):
+        self.deletes.setdefault(model, set()).add(id)
+
+    def set_rule_options(self, rule, subject_options, object_options):
+        """Set the m2m options of `rule`, previously `rule.preloaded_*` for existing rules."""
+        if rule.id is not None:
+            def ids(options):
+                return sorted([o.id for o in options])
+            if None not in ids(subject_options + object_options) and \
+                    ids(subject_options) == ids(rule.preloaded_subject_options or []) and \
+                    ids(object_options) == ids(rule.preloaded_object_options or []):
+                return
+        self.rule_options.append((rule, subject_options, object_options))
+
+    def apply(self):
+        with transaction.commit_on_success():
+            self.survey.save()
+            for model in self.DELETE_ORDER:
+                ids = self.deletes.get(model)
+                if ids:
+                    queryset = model.objects.filter(id__in=ids)
+                    if model is models.Question:
+                        queryset = queryset.exclude(type='builtin')
+                    queryset.delete()
+            for obj, parents in self.saves:
+                for name, parent in parents.items():
+                    setattr(obj, name+'_id', parent.id if parent is not None else None)
+                obj.save()
+            if self.rule_options:
+                self.save_rule_options()
+        self.survey.invalidate_compiled()
+        # The preloaded tree (if any) no longer matches the database.
+        self.survey.preloaded_questions = None
+
+    def save_rule_options(self):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        rule_ids = [rule.id for rule, subject_options, object_options in self.rule_options]
+        for index, field in ((1, models.Rule.subject_options), (2, models.Rule.object_options)):
+            through = field.through
+            rule_column = through._meta.get_field('rule').column
+            option_column = through._meta.get_field('option').column
+            through.objects.filter(rule__in=rule_ids).delete()
+            params = []
+            for item in self.rule_options:
+                rule = item[0]
+                for option_id in set([option.id for option in item[index]]):
+                    params.append((rule.id, option_id))
+            if params:
+                cursor.executemany("INSERT INTO %s (%s, %s) VALUES (%%s, %%s)" % (
+                    qn(through._meta.db_table), qn(rule_column), qn(option_column)), params)
+
 #########################
 # decorated XHTML parsing
 #########################
@@ -15,19 +161,19 @@ def survey_update_from_xhtml(survey, xmlstring):
     survey.title = root.find('h1').text or ''
     survey.shortname = root.find('h1').get('data-shortname') or ''
     survey.version = root.find('h1').get('data-version') or ''
-    survey.save()
 
-    builtins = [q.data_name for q in survey.question_set.all() if q.is_builtin]
+    changes = SurveyTreeChanges(survey)
+    builtins = [q.data_name for q in changes.existing[models.Question].values() if q.is_builtin]
     if 'timestamp' not in builtins:
-        question = models.Question()
-        question.survey = survey
-        question.data_name = 'timestamp'
-        question.ordinal = 0
-        question.type = 'builtin'
-        question.title = 'Compilation Date'
-        question.data_type = models.QuestionDataType.default_timestamp_type()
-        question.save()
-
+        changes.set(models.Question(), parents={'survey': survey},
+            data_name = 'timestamp',
+            ordinal = 0,
+            type = 'builtin',
+            title = 'Compilation Date',
+            data_type_id = changes.lookups.default_timestamp_type().id)
+
+    # Maps element ids to the (possibly not yet saved) objects, or None for
+    # deleted ones.
     idmap = {}
     question_ordinal = 1
     question_xrules = []
@@ -35,49 +181,49 @@ def survey_update_from_xhtml(survey, xmlstring):
         if 'question-wrapper' not in wrapper.get('class'):
             continue
         xquestion = [i for i in wrapper if 'question' in i.get('class')][0]
-        question = _update_question_from_xhtml(survey, idmap, xquestion, question_ordinal)
+        question = _update_question_from_xhtml(changes, idmap, xquestion, question_ordinal)
         question_ordinal += 1
 
         column_ordinal = 1
         xcolumns = [ul for ul in xquestion.findall('ul') if 'columns' in ul.get('class')] or [[]]
         for xcolumn in xcolumns[0]:
-            _update_column_from_xhtml(survey, idmap, question, xcolumn, column_ordinal)
+            _update_column_from_xhtml(changes, idmap, question, xcolumn, column_ordinal)
             column_ordinal += 1
 
         row_ordinal = 1
         xrows = [ul for ul in xquestion.findall('ul') if 'rows' in ul.get('class')] or [[]]
         for xrow in xrows[0]:
-            _update_row_from_xhtml(survey, idmap, question, xrow, row_ordinal)
+            _update_row_from_xhtml(changes, idmap, question, xrow, row_ordinal)
             row_ordinal += 1
 
         option_ordinal = 1
         xoptions = [ul for ul in xquestion.findall('ul') if 'choices' in ul.get('class') or 'derived-values' in ul.get('class')] or [[]]
         for xoption in xoptions[0]:
-            _update_option_from_xhtml(survey, idmap, question, xoption, option_ordinal)
+            _update_option_from_xhtml(changes, idmap, question, xoption, option_ordinal)
             option_ordinal += 1
 
         xrules = [i for i in wrapper if 'rules' in i.get('class')][0]
         question_xrules.append((question, xrules))
 
-    # After generating correct IDs for all questions and options we process
-    # the rules by iterating again the XML tree.
+    # After mapping all questions and options we process the rules by
+    # iterating again the XML tree.
 
     for question, xrules in question_xrules:
         for xrule in xrules:
-            _update_rule_from_xhtml(survey, idmap, question, xrule)
+            _update_rule_from_xhtml(changes, idmap, question, xrule)
 
-    survey.save()
+    changes.apply()
 
-def _get_question_id(idmap, idstr):
+def _get_question(idmap, idstr):
     return idmap[idstr]
 
-def _get_option_id(idmap, idstr):
+def _get_option(idmap, idstr):
     return idmap[idstr]
 
-def _update_question_from_xhtml(survey, idmap, root, ordinal):
+def _update_question_from_xhtml(changes, idmap, root, ordinal):
     # Extract question ID and load corresponding question; if it does not exists
-    # insert and empty question to generate it. In both cases we have a question
-    # to fill with options and rules.
+    # create an empty question. In both cases we have a question to fill with
+    # options and rules.
     question_type = root.get('data-question-type')
     data_type = root.get('data-data-type')
     open_option_data_type = root.get('data-open-option-data-type')
@@ -100,102 +246,80 @@ def _update_question_from_xhtml(survey, idmap, root, ordinal):
     temp_id = root.get('id') or ''
     match = re.match('^question-(\d+)$', temp_id)
 
+    values = dict(
+        data_name = data_name or '',
+        title = title or '',
+        description = description or '',
+        tags = tags or '',
+        regex = regex or '',
+        error_message = error_message or '',
+        starts_hidden = hidden,
+        is_mandatory = mandatory,
+        visual = visual,
+        ordinal = ordinal,
+    )
+    if open_option_data_type:
+        values['open_option_data_type_id'] = changes.lookups.data_type(id=open_option_data_type).id
+
     if question_type == 'builtin':
         # builtin questions are not modifiable
-        question = models.Question.objects.get(id = int(match.group(1)))
+        question = changes.get(models.Question, match.group(1))
     elif deleted:
-        models.Question.objects.filter(id = int(match.group(1))).exclude(type = 'builtin').delete()
+        changes.delete(models.Question, int(match.group(1)))
         question = None
     elif match:
-        question = models.Question.objects.get(id = int(match.group(1)))
+        question = changes.get(models.Question, match.group(1))
         if question.type == 'builtin':
             raise StandardError('cannot modify builtin questions')
-        question.data_name = data_name or ''
-        question.title = title or ''
-        question.description = description or ''
-        question.tags = tags or ''
-        question.regex = regex or ''
-        question.error_message = error_message or ''
-        question.starts_hidden = hidden
-        question.is_mandatory = mandatory
-        question.visual = visual
-        question.ordinal = ordinal
         if data_type:
-            question.data_type = models.QuestionDataType.objects.get(id = data_type)
-        if open_option_data_type:
-            question.open_option_data_type = models.QuestionDataType.objects.get(id = open_option_data_type)
-        question.save()
+            values['data_type_id'] = changes.lookups.data_type(id=data_type).id
+        changes.set(question, **values)
     else:
-        question = models.Question()
-        question.survey = survey
-        question.type = question_type
-        question.data_name = data_name or ''
-        question.title = title or ''
-        question.description = description or ''
-        question.tags = tags or ''
-        question.regex = regex or ''
-        question.error_message = error_message or ''
-        question.starts_hidden = hidden
-        question.is_mandatory = mandatory
-        question.visual = visual
-        question.ordinal = ordinal
         if data_type:
-            question.data_type = models.QuestionDataType.objects.get(id = data_type)
+            values['data_type_id'] = changes.lookups.data_type(id=data_type).id
         else:
-            question.data_type = models.QuestionDataType.default_type()
-        if open_option_data_type:
-            question.open_option_data_type = models.QuestionDataType.objects.get(id = open_option_data_type)
-        question.save()
-    idmap[temp_id] = question and question.id
+            values['data_type_id'] = changes.lookups.default_type().id
+        question = changes.set(models.Question(), parents={'survey': changes.survey}, type=question_type, **values)
+    idmap[temp_id] = question
     return question
 
-def _update_column_from_xhtml(survey, idmap, question, root, ordinal):
+def _update_column_from_xhtml(changes, idmap, question, root, ordinal):
     temp_id = root.get('id') or ''
     match = re.match('^column-(\d+)$', temp_id)
     deleted = 'deleted' in (root.get('class') or '')
     if deleted or question is None:
-        models.QuestionColumn.objects.filter(id = int(match.group(1))).delete()
+        if match:
+            changes.delete(models.QuestionColumn, int(match.group(1)))
         column = None
     else:
         title = [e.text for e in root.findall('span') if 'column-title' in e.get('class', '')][0]
         if match:
-            column = models.QuestionColumn.objects.get(id = int(match.group(1)))
-            column.title = title or ''
-            column.ordinal = ordinal
-            column.save()
+            column = changes.get(models.QuestionColumn, match.group(1))
         else:
             column = models.QuestionColumn()
-            column.question = question
-            column.title = title or ''
-            column.ordinal = ordinal
-            column.save()
-    idmap[temp_id] = column and column.id
+        changes.set(column, parents={'question': question}, title=title or '', ordinal=ordinal)
+    idmap[temp_id] = column
     return column
 
-def _update_row_from_xhtml(survey, idmap, question, root, ordinal):
+def _update_row_from_xhtml(changes, idmap, question, root, ordinal):
     temp_id = root.get('id') or ''
     match = re.match('^row-(\d+)$', temp_id)
     deleted = 'deleted' in (root.get('class') or '')
     if deleted or question is None:
-        models.QuestionRow.objects.filter(id = int(match.group(1))).delete()
+        if match:
+            changes.delete(models.QuestionRow, int(match.group(1)))
         row = None
     else:
         title = [e.text for e in root.findall('span') if 'row-title' in e.get('class', '')][0]
         if match:
-            row = models.QuestionRow.objects.get(id = int(match.group(1)))
-            row.title = title or ''
-            row.ordinal = ordinal
-            row.save()
+            row = changes.get(models.QuestionRow, match.group(1))
         else:
             row = models.QuestionRow()
-            row.question = question
-            row.title = title or ''
-            row.ordinal = ordinal
-            row.save()
-    idmap[temp_id] = row and row.id
+        changes.set(row, parents={'question': question}, title=title or '', ordinal=ordinal)
+    idmap[temp_id] = row
     return row
 
-def _update_option_from_xhtml(survey, idmap, question, root, ordinal):
+def _update_option_from_xhtml(changes, idmap, question, root, ordinal):
     # If we have an <input> tag, then this is a real option, else it is
     # a virtual option and we read the range/regexp data directly from
     # the <li> element. We also look for the option id, to decide if this
@@ -207,63 +331,48 @@ def _update_option_from_xhtml(survey, idmap, question, root, ordinal):
     is_open = 'open' in (root.get('class') or '')
     deleted = 'deleted' in (root.get('class') or '')
     if deleted or question is None:
-        models.Option.objects.filter(id = int(match.group(1))).delete()
+        if match:
+            changes.delete(models.Option, int(match.group(1)))
         option = None
     elif xinput is not None:
         text = root.find('label').text
         value = xinput.get('value')
         description = root.get('title')
+        values = dict(
+            starts_hidden = hidden,
+            is_open = is_open,
+            text = text or '',
+            value = value or '',
+            description = description or '',
+            ordinal = ordinal,
+        )
         if match:
-            option = models.Option.objects.get(id = int(match.group(1)))
-            option.starts_hidden = hidden
-            option.is_open = is_open
-            option.text = text or ''
-            option.value = value or ''
-            option.description = description or ''
-            option.ordinal = ordinal
-            option.save()
+            option = changes.set(changes.get(models.Option, match.group(1)), **values)
         else:
-            option = models.Option()
-            option.question = question
-            option.is_virtual = False
-            option.starts_hidden = hidden
-            option.is_open = is_open
-            option.text = text or ''
-            option.value = value or ''
-            option.description = description or ''
-            option.ordinal = ordinal
-            option.save()
+            option = changes.set(models.Option(), parents={'question': question}, is_virtual=False, **values)
     else:
         type_id = root.get('data-type')
         value = root.get('data-value')
         inf = root.get('data-inf')
         sup = root.get('data-sup')
         regex = root.get('data-regex')
+        values = dict(
+            virtual_inf = inf or '',
+            virtual_sup = sup or '',
+            virtual_regex = regex or '',
+            value = value or '',
+            starts_hidden = hidden,
+            ordinal = ordinal,
+        )
         if match:
-            option = models.Option.objects.get(id = int(match.group(1)))
-            option.virtual_type = models.VirtualOptionType.objects.get(id=int(type_id))
-            option.virtual_inf = inf or ''
-            option.virtual_sup = sup or ''
-            option.virtual_regex = regex or ''
-            option.value = value or ''
-            option.starts_hidden = hidden
-            option.ordinal = ordinal
-            option.save()
+            values['virtual_type_id'] = changes.lookups.virtual_option_type(id=type_id).id
+            option = changes.set(changes.get(models.Option, match.group(1)), **values)
         else:
-            option = models.Option()
-            option.question = question
-            option.is_virtual = True
-            option.virtual_inf = inf or ''
-            option.virtual_sup = sup or ''
-            option.virtual_regex = regex or ''
-            option.value = value or ''
-            option.starts_hidden = hidden
-            option.ordinal = ordinal
-            option.save()
-    idmap[temp_id] = option and option.id
+            option = changes.set(models.Option(), parents={'question': question}, is_virtual=True, **values)
+    idmap[temp_id] = option
     return option
 
-def _update_rule_from_xhtml(survey, idmap, question, root):
+def _update_rule_from_xhtml(changes, idmap, question, root):
     temp_id = root.get('id') or ''
     match = re.match('^rule-(\d+)$', temp_id)
     type_id = root.get('data-type')
@@ -271,47 +380,29 @@ def _update_rule_from_xhtml(survey, idmap, question, root):
     deleted = 'deleted' in classes
     is_sufficient = 'sufficient' in classes
 
-    subject_option_ids = [_get_option_id(idmap, id) for id in root.get('data-subject-options', '').split()]
-    subject_option_ids = [id for id in subject_option_ids if id is not None]
-    object_question_id = root.get('data-object-question') and _get_question_id(idmap, root.get('data-object-question'))
-    object_option_ids = [_get_option_id(idmap, id) for id in root.get('data-object-options', '').split()]
-    object_option_ids = [id for id in object_option_ids if id is not None]
+    subject_options = [_get_option(idmap, id) for id in root.get('data-subject-options', '').split()]
+    subject_options = [o for o in subject_options if o is not None]
+    object_question = root.get('data-object-question') and _get_question(idmap, root.get('data-object-question'))
+    object_options = [_get_option(idmap, id) for id in root.get('data-object-options', '').split()]
+    object_options = [o for o in object_options if o is not None]
 
-    if not deleted and not type_id and not object_question_id:
-        warnings.warn('unable to create rule in question %s (triggers %s, question %s)' % (question.id, subject_option_ids, object_question_id))
+    if not deleted and not type_id and not object_question:
+        warnings.warn('unable to create rule in question %s (triggers %s, question %s)' % (
+            question and question.id, [o.id for o in subject_options], object_question and object_question.id))
         return None
 
-    if deleted or question is None or object_question_id is None:
-        models.Rule.objects.filter(id = int(match.group(1))).delete()
-        rule = None
-    elif match:
-        rule = models.Rule.objects.get(id = int(match.group(1)))
-        rule.is_sufficient = is_sufficient
-        rule.rule_type = models.RuleType.objects.get(id = int(type_id))
-        rule.subject_question = question
-        rule.object_question = models.Question.objects.get(id = object_question_id)
-        rule.save()
-        rule.subject_options.clear()
-        rule.object_options.clear()
-        for id in subject_option_ids:
-            rule.subject_options.add(models.Option.objects.get(id = id))
-        for id in object_option_ids:
-            rule.object_options.add(models.Option.objects.get(id = id))
-        rule.save()
+    if deleted or question is None or object_question is None:
+        if match:
+            changes.delete(models.Rule, int(match.group(1)))
+        return None
+    if match:
+        rule = changes.get(models.Rule, match.group(1))
     else:
         rule = models.Rule()
-        rule.is_sufficient = is_sufficient
-        rule.rule_type = models.RuleType.objects.get(id = int(type_id))
-        rule.subject_question = question
-        rule.object_question = models.Question.objects.get(id = object_question_id)
-        rule.save()
-        rule.object_options.clear()
-        rule.subject_options.clear()
-        for id in object_option_ids:
-            rule.object_options.add(models.Option.objects.get(id = id))
-        for id in subject_option_ids:
-            rule.subject_options.add(models.Option.objects.get(id = id))
-        rule.save()
+    changes.set(rule, parents={'subject_question': question, 'object_question': object_question},
+        is_sufficient = is_sufficient,
+        rule_type_id = changes.lookups.rule_type(id=type_id).id)
+    changes.set_rule_options(rule, subject_options, object_options)
     return rule
 
 
@@ -337,8 +428,9 @@ def survey_update_from_xml(survey, xmlstring):
     survey.title = xsurvey.findtext(p+'title')
     survey.shortname = xsurvey.findtext(p+'shortname')
     survey.version = xsurvey.findtext(p+'version')
-    survey.save()
 
+    changes = SurveyTreeChanges(survey)
+    lookups = changes.lookups
     questions = {}
     columns = {}
     rows = {}
@@ -349,24 +441,23 @@ def survey_update_from_xml(survey, xmlstring):
         question_ordinal += 1
         question = models.Question()
         question.ordinal = question_ordinal
-        question.survey = survey
         question.title = xquestion.findtext(p+'title')
         question.data_name = xquestion.findtext(p+'data_name')
         question.description = xquestion.findtext(p+'description')
         question.type = xquestion.findtext(p+'type')
         data_type = xquestion.findtext(p+'data_type')
         if data_type:
-            question.data_type = models.QuestionDataType.objects.all().get(js_class=data_type)
+            question.data_type = lookups.data_type(js_class=data_type)
         open_option_data_type = xquestion.findtext(p+'open_option_data_type')
         if open_option_data_type:
-            question.open_option_data_type = models.QuestionDataType.objects.all().get(js_class=open_option_data_type)
+            question.open_option_data_type = lookups.data_type(js_class=open_option_data_type)
         question.starts_hidden = xquestion.findtext(p+'starts_hidden').strip() == 'true'
         question.is_mandatory = xquestion.findtext(p+'is_mandatory').strip() == 'true'
         question.visual = xquestion.findtext(p+'visual')
         question.tags = xquestion.findtext(p+'tags')
         question.regex = xquestion.findtext(p+'regex')
         question.error_message = xquestion.findtext(p+'error_message')
-        question.save()
+        changes.set(question, parents={'survey': survey})
         questions[xquestion.get('id')] = question
 
         column_ordinal = 0
@@ -374,9 +465,8 @@ def survey_update_from_xml(survey, xmlstring):
             column_ordinal += 1
             column = models.QuestionColumn()
             column.ordinal = column_ordinal
-            column.question = question
             column.title = xcolumn.findtext(p+'title')
-            column.save()
+            changes.set(column, parents={'question': question})
             columns[xcolumn.get('id')] = column
 
         row_ordinal = 0
@@ -384,9 +474,8 @@ def survey_update_from_xml(survey, xmlstring):
             row_ordinal += 1
             row = models.QuestionRow()
             row.ordinal = row_ordinal
-            row.question = question
             row.title = xrow.findtext(p+'title')
-            row.save()
+            changes.set(row, parents={'question': question})
             rows[xrow.get('id')] = row
 
         option_ordinal = 0
@@ -394,14 +483,11 @@ def survey_update_from_xml(survey, xmlstring):
             option_ordinal += 1
             option = models.Option()
             option.ordinal = option_ordinal
-            option.question = question
-            option.column = get_ref(columns, xoption.find(p+'column'))
-            option.row = get_ref(rows, xoption.find(p+'row'))
             option.group = xoption.findtext(p+'group')
             option.is_virtual = xoption.findtext(p+'is_virtual').strip() == 'true'
             virtual_type = xoption.findtext(p+'virtual_type')
             if virtual_type:
-                option.virtual_type = models.VirtualOptionType.objects.all().get(js_class=virtual_type)
+                option.virtual_type = lookups.virtual_option_type(js_class=virtual_type)
             option.virtual_inf = xoption.findtext(p+'virtual_inf') or ''
             option.virtual_sup = xoption.findtext(p+'virtual_sup') or ''
             option.virtual_regex = xoption.findtext(p+'virtual_regex') or ''
@@ -409,51 +495,50 @@ def survey_update_from_xml(survey, xmlstring):
             option.value = xoption.findtext(p+'value') or ''
             option.is_open = (xoption.findtext(p+'is_open') or '').strip() == 'true'
             option.starts_hidden = (xoption.findtext(p+'starts_hidden') or '').strip() == 'true'
-            option.save()
+            changes.set(option, parents={
+                'question': question,
+                'column': get_ref(columns, xoption.find(p+'column')),
+                'row': get_ref(rows, xoption.find(p+'row')),
+            })
             options[xoption.get('id')] = option
 
     for xrule in xsurvey.find(p+'rules').findall(p+'rule'):
         rule = models.Rule()
         rule.is_sufficient = (xrule.findtext(p+'is_sufficient') or '').strip() == 'true'
-        rule.rule_type = models.RuleType.objects.all().get(js_class=xrule.findtext(p+'type'))
-        rule.subject_question = get_ref(questions, xrule.find(p+'subject_question'))
-        rule.object_question = get_ref(questions, xrule.find(p+'object_question'))
-        rule.save()
+        rule.rule_type = lookups.rule_type(js_class=xrule.findtext(p+'type'))
+        changes.set(rule, parents={
+            'subject_question': get_ref(questions, xrule.find(p+'subject_question')),
+            'object_question': get_ref(questions, xrule.find(p+'object_question')),
+        })
         xsubject_options = xrule.find(p+'subject_options').findall(p+'subject_option')
-        rule.subject_options = [get_ref(options, x) for x in xsubject_options]
         xobject_options = xrule.find(p+'object_options').findall(p+'object_option')
-        rule.object_options = [get_ref(options, x) for x in xobject_options]
+        changes.set_rule_options(rule,
+            [o for o in [get_ref(options, x) for x in xsubject_options] if o is not None],
+            [o for o in [get_ref(options, x) for x in xobject_options] if o is not None])
 
     for xtranslation in xsurvey.find(p+'translations').findall(p+'translation'):
         translation = models.TranslationSurvey()
-        translation.survey = survey
         translation.language = xtranslation.get('lang')
         translation.title = xtranslation.findtext(p+'title')
-        translation.save()
+        changes.set(translation, parents={'survey': survey})
         for xtquestion in xtranslation.find(p+'questions').findall(p+'question'):
             tquestion = models.TranslationQuestion()
-            tquestion.translation = translation
-            tquestion.question = get_ref(questions, xtquestion)
             tquestion.title = xtquestion.findtext(p+'title')
             tquestion.description = xtquestion.findtext(p+'description')
             tquestion.error_message = xtquestion.findtext(p+'error_message')
-            tquestion.save()
+            changes.set(tquestion, parents={'translation': translation, 'question': get_ref(questions, xtquestion)})
         for xtcolumn in xtranslation.find(p+'columns').findall(p+'column'):
             tcolumn = models.TranslationQuestionColumn()
-            tcolumn.translation = translation
-            tcolumn.column = get_ref(columns, xtcolumn)
             tcolumn.title = xtcolumn.findtext(p+'title')
-            tcolumn.save()
+            changes.set(tcolumn, parents={'translation': translation, 'column': get_ref(columns, xtcolumn)})
         for xtrow in xtranslation.find(p+'rows').findall(p+'row'):
             trow = models.TranslationQuestionRow()
-            trow.translation = translation
-            trow.row = get_ref(rows, xtrow)
             trow.title = xtrow.findtext(p+'title')
-            trow.save()
+            changes.set(trow, parents={'translation': translation, 'row': get_ref(rows, xtrow)})
         for xtoption in xtranslation.find(p+'options').findall(p+'option'):
             toption = models.TranslationOption()
-            toption.translation = translation
-            toption.option = get_ref(options, xtoption)
             toption.text = xtoption.findtext(p+'text')
-            toption.save()
+            changes.set(toption, parents={'translation': translation, 'option': get_ref(options, xtoption)})
+
+    changes.apply()
     return survey
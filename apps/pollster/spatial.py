@@ -0,0 +1,259 @@
+"""
+Pure Python geometry helpers: a WKT polygon parser, point in polygon tests,
+Douglas-Peucker simplification and a static STR-packed R-tree.
+
+GeoIndex keeps the polygons of a geometry table (see GEOMETRY_TABLES) in
+memory so that map clicks resolve to a zip code without a spatial query.
+"""
+
+from django.db import connection
+from .db.utils import get_table_change_counters, get_table_digest
+import logging, re, threading, time
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+
+def _parse_ring(text):
+    coords = []
+    for point in text.split(','):
+        values = re.findall(_NUMBER, point)
+        coords.append((float(values[0]), float(values[1])))
+    return coords
+
+def _parse_nested(text):
+    """Turn "((a), (b, (c)))" into nested lists with the innermost texts as strings."""
+    # Only the parentheses are visited, so parsing stays linear in the
+    # number of vertices.
+    stack = [[]]
+    position = 0
+    for match in re.finditer(r'[()]', text):
+        chunk = text[position:match.start()]
+        position = match.end()
+        if chunk.strip(' \t\r\n,'):
+            stack[-1].append(chunk)
+        if match.group() == '(':
+            stack.append([])
+        else:
+            done = stack.pop()
+            stack[-1].append(done)
+    return stack[0][0]
+
+def parse_wkt(wkt):
+    """
+    Parse a (MULTI)POLYGON in WKT or EWKT; returns a list of polygons, each
+    a list of rings (the first one is the exterior) of (x, y) tuples.
+    """
+    wkt = wkt.strip()
+    if wkt.upper().startswith('SRID='):
+        wkt = wkt.split(';', 1)[1].strip()
+    words = wkt.split('(', 1)[0].upper().split()
+    empty = words[-1:] == ['EMPTY']
+    if empty:
+        words = words[:-1]
+    # Z and M values are dropped by _parse_ring().
+    if not words or words[0] not in ('POLYGON', 'MULTIPOLYGON') or words[1:] not in ([], ['Z'], ['M'], ['ZM']):
+        raise ValueError('unsupported geometry type %s' % (' '.join(words),))
+    if empty:
+        return []
+    kind = words[0]
+    nested = _parse_nested(wkt[wkt.index('('):])
+    if kind == 'POLYGON':
+        nested = [nested]
+    return [[_parse_ring(ring[0]) for ring in polygon] for polygon in nested]
+
+def bbox(polygons):
+    xs = [x for polygon in polygons for x, y in polygon[0]]
+    ys = [y for polygon in polygons for x, y in polygon[0]]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def point_in_ring(x, y, ring):
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+def point_in_polygons(x, y, polygons):
+    """Even-odd test over all rings, so holes are excluded."""
+    for polygon in polygons:
+        inside = False
+        for ring in polygon:
+            if point_in_ring(x, y, ring):
+                inside = not inside
+        if inside:
+            return True
+    return False
+
+def simplify_ring(ring, tolerance):
+    """Douglas-Peucker simplification; closed rings keep at least 4 points."""
+    if len(ring) < 5 or tolerance <= 0:
+        return ring
+    keep = [False] * len(ring)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = ring[first]
+        x1, y1 = ring[last]
+        dx, dy = x1 - x0, y1 - y0
+        norm = dx * dx + dy * dy
+        index, distance = None, tolerance * tolerance
+        for i in range(first + 1, last):
+            x, y = ring[i]
+            if norm:
+                t = max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / norm))
+                px, py = x0 + t * dx - x, y0 + t * dy - y
+            else:
+                px, py = x0 - x, y0 - y
+            d = px * px + py * py
+            if d > distance:
+                index, distance = i, d
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    simplified = [p for p, k in zip(ring, keep) if k]
+    if len(simplified) < 4:
+        return ring
+    return simplified
+
+def simplify(polygons, tolerance):
+    """Simplify all rings, dropping holes that collapse."""
+    result = []
+    for polygon in polygons:
+        rings = [simplify_ring(polygon[0], tolerance)]
+        rings.extend([simplify_ring(ring, tolerance) for ring in polygon[1:] if len(ring) >= 4])
+        result.append(rings)
+    return result
+
+class STRTree(object):
+    """
+    Static R-tree bulk loaded with the Sort-Tile-Recursive algorithm over
+    (bbox, value) items, bbox being (min x, min y, max x, max y).
+    """
+    def __init__(self, items, capacity=10):
+        self.capacity = capacity
+        nodes = [(box, value, None) for box, value in items]
+        while len(nodes) > capacity:
+            nodes = self._pack(nodes)
+        self.root = nodes
+
+    def _pack(self, nodes):
+        count = (len(nodes) + self.capacity - 1) // self.capacity
+        slices = int(count ** 0.5 + 0.999999)
+        per_slice = slices * self.capacity
+        nodes = sorted(nodes, key=lambda n: n[0][0] + n[0][2])
+        parents = []
+        for s in range(0, len(nodes), per_slice):
+            column = sorted(nodes[s:s + per_slice], key=lambda n: n[0][1] + n[0][3])
+            for i in range(0, len(column), self.capacity):
+                children = column[i:i + self.capacity]
+                box = (min([c[0][0] for c in children]), min([c[0][1] for c in children]),
+                       max([c[0][2] for c in children]), max([c[0][3] for c in children]))
+                parents.append((box, None, children))
+        return parents
+
+    def query(self, x, y):
+        """Values of the items whose bbox contains (x, y)."""
+        result = []
+        stack = [self.root]
+        while stack:
+            for box, value, children in stack.pop():
+                if box[0] <= x <= box[2] and box[1] <= y <= box[3]:
+                    if children is None:
+                        result.append(value)
+                    else:
+                        stack.append(children)
+        return result
+
+class GeoIndex(object):
+    """
+    Polygons of a geometry table (zip_code_key, country and geometry
+    columns) indexed in memory; reloaded when the table changes, checked at
+    most every `check_interval` seconds (also after a failed load).
+    """
+    def __init__(self, table, check_interval=60):
+        self.table = table
+        self.check_interval = check_interval
+        self.fingerprint = None
+        self.checked = 0
+        self.tree = None
+        self.areas = None
+        self.lock = threading.Lock()
+
+    def get_fingerprint(self):
+        # The row counters of PostgreSQL also change on in-place updates of
+        # geometries; without them the rows themselves are digested.
+        return get_table_change_counters(connection, self.table) or \
+               get_table_digest(connection, self.table, order_by='id')
+
+    def load(self):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        columns = [row[0] for row in connection.introspection.get_table_description(cursor, self.table)]
+        country = 'country' in columns and qn('country') or 'NULL'
+        cursor.execute("SELECT zip_code_key, %s, ST_AsText(geometry) FROM %s WHERE geometry IS NOT NULL" % (country, qn(self.table)))
+        items = []
+        areas = {}
+        for zip_code_key, country, wkt in cursor.fetchall():
+            try:
+                polygons = parse_wkt(wkt)
+            except (ValueError, IndexError), e:
+                logger.warning('skipping geometry of %s %s in %s: %s', zip_code_key, country, self.table, e)
+                continue
+            if polygons:
+                items.append((bbox(polygons), (zip_code_key, country, polygons)))
+                key = unicode(zip_code_key).upper()
+                areas[(key, country and unicode(country).upper() or u'')] = polygons
+                areas.setdefault((key, None), polygons)
+        return STRTree(items), areas
+
+    def refresh(self):
+        if time.time() - self.checked >= self.check_interval:
+            self.lock.acquire()
+            try:
+                if time.time() - self.checked >= self.check_interval:
+                    # A failed load is not retried before the next check
+                    # either; the previous polygons (if any) stay in use.
+                    self.checked = time.time()
+                    fingerprint = self.get_fingerprint()
+                    if self.tree is None or fingerprint != self.fingerprint:
+                        self.tree, self.areas = self.load()
+                        self.fingerprint = fingerprint
+            finally:
+                self.lock.release()
+        if self.tree is None:
+            raise ValueError('the geometries of %s could not be loaded' % (self.table,))
+
+    def lookup(self, lng, lat):
+        """Return the (zip_code_key, country) of the polygons containing the point."""
+        self.refresh()
+        return [(key, country) for key, country, polygons in self.tree.query(lng, lat)
+                if point_in_polygons(lng, lat, polygons)]
+
+    def get_polygons(self, zip_code_key, country=None):
+        """Polygons of a zip code (in any country if `country` is None), or None."""
+        self.refresh()
+        if zip_code_key is None:
+            return None
+        if country is not None:
+            country = unicode(country).upper()
+        return self.areas.get((unicode(zip_code_key).upper(), country))
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_geo_index(table):
+    from django.conf import settings
+    _indexes_lock.acquire()
+    try:
+        if table not in _indexes:
+            _indexes[table] = GeoIndex(table, getattr(settings, 'POLLSTER_GEOINDEX_CHECK_INTERVAL', 60))
+        return _indexes[table]
+    finally:
+        _indexes_lock.release()
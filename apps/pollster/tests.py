@@ -0,0 +1,200 @@
+from django.db import connection
+from django.test import TestCase
+from django.utils import unittest
+import datetime, math, os, random, shutil, tempfile, time
+from apps.pollster import models, classifier, columnar, spatial
+from apps.pollster.classifier import numpy
+
+@unittest.skipIf(numpy is None, "the vectorized classifier requires numpy")
+class HealthStatusClassifierTest(TestCase):
+    rows = 2000
+
+    def setUp(self):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        columns = ', '.join(['%s integer NULL' % (qn(name),) for name in classifier.HEALTH_STATUS_COLUMNS])
+        cursor.execute("CREATE TABLE pollster_results_weekly (id integer NOT NULL PRIMARY KEY, %s)" % (columns,))
+        self.data = classifier.random_columns(self.rows, seed=42)
+        names = classifier.HEALTH_STATUS_COLUMNS
+        values = []
+        for i in range(self.rows):
+            row = [i + 1]
+            for name in names:
+                value = self.data[name][i]
+                row.append(None if numpy.isnan(value) else int(value))
+            values.append(row)
+        cursor.executemany("INSERT INTO pollster_results_weekly (id, %s) VALUES (%s)" % (
+            ', '.join([qn(name) for name in names]), ', '.join(['%s'] * (len(names) + 1))), values)
+        models.install_health_status_table()
+
+    def tearDown(self):
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE pollster_health_status")
+        cursor.execute("DROP TABLE pollster_results_weekly")
+
+    def test_matches_sql(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT status FROM pollster_health_status ORDER BY pollster_results_weekly_id")
+        expected = [row[0] for row in cursor.fetchall()]
+        self.assertEqual(len(expected), self.rows)
+        self.assertEqual(list(classifier.classify(self.data, self.rows)), expected)
+
+    def test_classify_table(self):
+        cursor = connection.cursor()
+        cursor.execute(models.HEALTH_STATUS_TABLE_SQL % ('weekly_status',))
+        self.assertEqual(classifier.classify_table('pollster_results_weekly', 'weekly_status'), self.rows)
+        cursor.execute("""SELECT count(*) FROM pollster_health_status S, weekly_status W
+                           WHERE S.pollster_results_weekly_id = W.pollster_results_weekly_id
+                             AND S.status = W.status""")
+        self.assertEqual(cursor.fetchone()[0], self.rows)
+        cursor.execute("DROP TABLE weekly_status")
+
+class SpatialTest(unittest.TestCase):
+    def test_parse_wkt(self):
+        polygons = spatial.parse_wkt('SRID=4326;POLYGON((0 0, 10 0, 10 10, 0 10, 0 0), (2 2, 4 2, 4 4, 2 2))')
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(polygons[0][0], [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)])
+        self.assertEqual(polygons[0][1], [(2.0, 2.0), (4.0, 2.0), (4.0, 4.0), (2.0, 2.0)])
+
+        polygons = spatial.parse_wkt('MULTIPOLYGON(((0 0,1 0,1 1,0 0)),((5 5,6 5,6 6,5 5),(5.5 5.1,5.9 5.1,5.9 5.5,5.5 5.1)))')
+        self.assertEqual([len(polygon) for polygon in polygons], [1, 2])
+        self.assertEqual(polygons[1][1][0], (5.5, 5.1))
+        self.assertEqual(spatial.bbox(polygons), (0.0, 0.0, 6.0, 6.0))
+        self.assertRaises(ValueError, spatial.parse_wkt, 'POINT(1 2)')
+
+        self.assertEqual(spatial.parse_wkt('MULTIPOLYGON EMPTY'), [])
+        self.assertEqual(spatial.parse_wkt('POLYGON Z ((0 0 1, 1 0 1, 1 1 1, 0 0 1))'),
+                         [[[(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)]]])
+
+    def test_parse_large_ring(self):
+        count = 20000
+        points = ['%f %f' % (math.cos(2 * math.pi * i / count), math.sin(2 * math.pi * i / count)) for i in range(count)]
+        wkt = 'POLYGON((%s, %s))' % (', '.join(points), points[0])
+        start = time.time()
+        polygons = spatial.parse_wkt(wkt)
+        self.assertTrue(time.time() - start < 2.0)
+        self.assertEqual(len(polygons[0][0]), count + 1)
+
+    def test_point_in_polygons(self):
+        polygons = spatial.parse_wkt('POLYGON((0 0, 10 0, 10 10, 0 10, 0 0), (2 2, 4 2, 4 4, 2 4, 2 2))')
+        self.assertTrue(spatial.point_in_polygons(1, 1, polygons))
+        self.assertFalse(spatial.point_in_polygons(3, 3, polygons))
+        self.assertFalse(spatial.point_in_polygons(11, 5, polygons))
+
+    def test_simplify(self):
+        count = 1000
+        ring = [(math.cos(2 * math.pi * i / count), math.sin(2 * math.pi * i / count)) for i in range(count)]
+        ring.append(ring[0])
+        simplified = spatial.simplify([[ring]], 0.01)[0][0]
+        self.assertTrue(4 <= len(simplified) < len(ring))
+        self.assertEqual(simplified[0], simplified[-1])
+        self.assertEqual(spatial.simplify_ring(ring, 0), ring)
+
+    def test_str_tree(self):
+        rng = random.Random(42)
+        items = []
+        for i in range(500):
+            x, y = rng.uniform(0, 100), rng.uniform(0, 100)
+            items.append(((x, y, x + rng.uniform(0, 5), y + rng.uniform(0, 5)), i))
+        tree = spatial.STRTree(items)
+        for j in range(200):
+            x, y = rng.uniform(0, 100), rng.uniform(0, 100)
+            expected = [i for box, i in items if box[0] <= x <= box[2] and box[1] <= y <= box[3]]
+            self.assertEqual(sorted(tree.query(x, y)), expected)
+
+    def test_geo_index_failed_load(self):
+        class FailingGeoIndex(spatial.GeoIndex):
+            loads = 0
+            def get_fingerprint(self):
+                return 1
+            def load(self):
+                self.loads += 1
+                raise ValueError('bad geometry table')
+
+        index = FailingGeoIndex('geometries', check_interval=60)
+        self.assertRaises(ValueError, index.lookup, 0, 0)
+        # The load is not retried before the next check.
+        self.assertRaises(ValueError, index.get_polygons, '1234')
+        self.assertEqual(index.loads, 1)
+
+class ColumnarField(object):
+    def __init__(self, column, internal_type):
+        self.column = column
+        self.internal_type = internal_type
+
+    def get_internal_type(self):
+        return self.internal_type
+
+class ColumnarSurvey(object):
+    """The parts of a Survey used by write_columnar()."""
+    id = 1
+    shortname = 'test'
+    title = 'Test'
+    version = '1'
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+
+    def as_model(self):
+        class Meta:
+            fields = self.fields
+            db_table = 'pollster_results_test'
+        return type('Model', (object,), {'_meta': Meta})
+
+    def get_results_columns(self, table=None):
+        columns = [field.column for field in self.fields]
+        return columns, columns
+
+    def iter_results(self, **kwargs):
+        return iter(self.rows)
+
+    def get_question_list(self):
+        return []
+
+@unittest.skipIf(columnar.numpy is None, "the columnar export requires numpy")
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.chunk_rows = columnar.CHUNK_ROWS
+        # Several chunks, the last one partial.
+        columnar.CHUNK_ROWS = 8
+
+    def tearDown(self):
+        columnar.CHUNK_ROWS = self.chunk_rows
+        shutil.rmtree(self.path)
+
+    def test_write_and_read(self):
+        fields = [ColumnarField('id', 'AutoField'), ColumnarField('Q1', 'IntegerField'),
+                  ColumnarField('Q2', 'CharField'), ColumnarField('Q3', 'BooleanField'),
+                  ColumnarField('timestamp', 'DateTimeField')]
+        start = datetime.datetime(2011, 11, 1)
+        rows = []
+        for i in range(21):
+            rows.append((i + 1, i % 3 and i or None, [u'b', u'a', None, u'c'][i % 4], i % 2 == 0,
+                         start + datetime.timedelta(hours=i)))
+        self.assertEqual(columnar.write_columnar(ColumnarSurvey(fields, rows), self.path), 21)
+
+        results = columnar.load_columnar(self.path, mmap=False)
+        self.assertEqual(results.rows, 21)
+        self.assertEqual(results.columns, ['id', 'Q1', 'Q2', 'Q3', 'timestamp'])
+        self.assertEqual(list(results.values('id')), range(1, 22))
+
+        # Nullable int column.
+        self.assertTrue(results.info['Q1']['nullable'])
+        self.assertFalse(results.info['id']['nullable'])
+        self.assertEqual(list(results.mask('Q1')), [row[1] is None for row in rows])
+        self.assertEqual(results.column('Q1').tolist(), [row[1] for row in rows])
+
+        # Dictionary encoded, nullable string column.
+        self.assertEqual(results.dictionary('Q2'), [u'a', u'b', u'c'])
+        self.assertEqual(list(results.values('Q2')), [[1, 0, -1, 2][i % 4] for i in range(21)])
+        self.assertEqual(results.column('Q2').tolist(), [row[2] for row in rows])
+
+        self.assertEqual(list(results.values('Q3')), [row[3] for row in rows])
+        self.assertEqual(list(results.values('timestamp')),
+                         [columnar._microseconds(row[4]) for row in rows])
+        # No temporary files are left behind.
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         sorted(['metadata.json', 'id.npy', 'Q1.npy', 'Q1.mask.npy', 'Q2.npy',
+                                 'Q2.mask.npy', 'Q3.npy', 'timestamp.npy']))
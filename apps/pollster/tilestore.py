@@ -0,0 +1,279 @@
+"""
+Storage of rendered map tiles.
+
+FileTileStore keeps one PNG file per tile (and per user or person for charts
+with a results filter) under POLLSTER_CACHE_PATH/_pollster_tile_cache.
+MBTilesStore keeps all tiles of a chart version in one SQLite file using the
+MBTiles layout (images are stored once per distinct content, so the many
+identical empty tiles take no space); invalidating a chart removes a single
+file. The store is selected with POLLSTER_TILE_STORE ('file' or 'mbtiles').
+
+Both stores serialize the rendering of a metatile with a byte range lock on
+a single lock file (and a thread lock within a process), so concurrent
+requests wait for each other instead of rendering the same tiles twice.
+"""
+
+from django.conf import settings
+import errno, glob, hashlib, os, shutil, sqlite3, tempfile, threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def _makedirs(path):
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Another thread created the directory in the meantime: just go on.
+            pass
+
+def write_file(filename, data):
+    """
+    Replace the file with data. Each writer writes its own temporary file and
+    renames it into place, so readers never see a partly written file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    try:
+        os.fchmod(fd, 0644)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+    except:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+# fcntl locks belong to the process and closing any descriptor of a file
+# releases all the locks of the process on it: each process keeps one open
+# lock file per name, and its threads take a thread lock per byte range
+# before locking the range itself.
+_locks_lock = threading.Lock()
+_lock_files = {}
+_thread_locks = {}
+
+def _get_lock_file(filename):
+    _locks_lock.acquire()
+    try:
+        f = _lock_files.get(filename)
+        try:
+            current = f is not None and os.fstat(f.fileno()).st_ino == os.stat(filename).st_ino
+        except OSError:
+            # The lock file was removed along with the tiles.
+            current = False
+        if not current:
+            # The previous file is closed once no lock refers to it anymore.
+            f = _lock_files[filename] = open(filename, 'a')
+        return f
+    finally:
+        _locks_lock.release()
+
+class MetatileLock(object):
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.offset = hash(key) & 0x7fffffff
+        self.file = None
+
+    def __enter__(self):
+        key = (self.filename, self.offset)
+        _locks_lock.acquire()
+        try:
+            entry = _thread_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        finally:
+            _locks_lock.release()
+        entry[0].acquire()
+        try:
+            self.file = _get_lock_file(self.filename)
+            if fcntl:
+                fcntl.lockf(self.file, fcntl.LOCK_EX, 1, self.offset)
+        except:
+            self._release()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        try:
+            if fcntl:
+                fcntl.lockf(self.file, fcntl.LOCK_UN, 1, self.offset)
+        finally:
+            self._release()
+
+    def _release(self):
+        key = (self.filename, self.offset)
+        self.file = None
+        _locks_lock.acquire()
+        try:
+            entry = _thread_locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if not entry[1]:
+                del _thread_locks[key]
+        finally:
+            _locks_lock.release()
+
+class TileStore(object):
+    def __init__(self, chart):
+        self.chart = chart
+
+    def get_lock_filename(self):
+        raise NotImplementedError()
+
+    def lock(self, z, x, y, suffix):
+        """Lock held while rendering the metatile whose top left tile is (z, x, y)."""
+        return MetatileLock(self.get_lock_filename(), (z, x, y, suffix))
+
+    def get(self, z, x, y, suffix=''):
+        """Return the PNG data of a tile, or None if it was not rendered yet."""
+        raise NotImplementedError()
+
+    def put_many(self, z, tiles, suffix=''):
+        """Store (x, y, data) tiles of zoom level z."""
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+class FileTileStore(TileStore):
+    def get_base(self):
+        return self.chart.get_map_tile_base()
+
+    def get_filename(self, z, x, y, suffix=''):
+        return self.chart.get_map_tile_filename(z, x, y) + suffix
+
+    def get_lock_filename(self):
+        _makedirs(self.get_base())
+        return os.path.join(self.get_base(), '.lock')
+
+    def get(self, z, x, y, suffix=''):
+        filename = self.get_filename(z, x, y, suffix)
+        if not os.path.exists(filename):
+            return None
+        return open(filename, 'rb').read()
+
+    def put_many(self, z, tiles, suffix=''):
+        for x, y, data in tiles:
+            filename = self.get_filename(z, x, y, suffix)
+            # Readers only check whether the tile exists before reading it.
+            write_file(filename, data)
+
+    def clear(self):
+        try:
+            shutil.rmtree(self.get_base())
+        except:
+            pass
+
+MBTILES_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB)",
+    # scope is '' for public tiles and the user/person suffix otherwise.
+    """CREATE TABLE IF NOT EXISTS map (scope TEXT NOT NULL DEFAULT '', zoom_level INTEGER, tile_column INTEGER,
+                                       tile_row INTEGER, tile_id TEXT,
+                                       PRIMARY KEY (scope, zoom_level, tile_column, tile_row))""",
+    """CREATE VIEW IF NOT EXISTS tiles AS
+           SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row,
+                  images.tile_data AS tile_data
+             FROM map JOIN images ON images.tile_id = map.tile_id
+            WHERE map.scope = ''""",
+)
+
+class MBTilesStore(TileStore):
+    def get_base(self):
+        return "%s/_pollster_tiles/survey_%s" % (settings.POLLSTER_CACHE_PATH, self.chart.survey_id)
+
+    def get_filename(self):
+        # One file per chart version: a new version starts with an empty file.
+        version = self.chart.updated and format(self.chart.updated, '%Y%m%d%H%M%S%f') or '0'
+        return "%s/%s.%s.mbtiles" % (self.get_base(), self.chart.shortname, version)
+
+    def get_lock_filename(self):
+        _makedirs(self.get_base())
+        return "%s/%s.lock" % (self.get_base(), self.chart.shortname)
+
+    def create(self, filename):
+        """
+        Create an empty tile file: it is built under a temporary name and
+        linked into place, so other processes never open it without schema.
+        """
+        _makedirs(self.get_base())
+        fd, tmp = tempfile.mkstemp(dir=self.get_base(), suffix='.tmp')
+        os.fchmod(fd, 0644)
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(tmp)
+            try:
+                for sql in MBTILES_SCHEMA:
+                    conn.execute(sql)
+                conn.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", [
+                    ('name', str(self.chart)), ('type', 'overlay'), ('version', '1'),
+                    ('description', self.chart.shortname), ('format', 'png'),
+                ])
+                conn.commit()
+            finally:
+                conn.close()
+            try:
+                os.link(tmp, filename)
+            except OSError, e:
+                # Another process created it first: use that one.
+                if e.errno != errno.EEXIST:
+                    raise
+        finally:
+            os.unlink(tmp)
+
+    def connect(self):
+        filename = self.get_filename()
+        if not os.path.exists(filename):
+            self.create(filename)
+        conn = sqlite3.connect(filename, timeout=30)
+        conn.text_factory = str
+        return conn
+
+    def get(self, z, x, y, suffix=''):
+        if not os.path.exists(self.get_filename()):
+            return None
+        conn = self.connect()
+        try:
+            # MBTiles rows count from the bottom (TMS).
+            row = conn.execute("""SELECT images.tile_data FROM map JOIN images ON images.tile_id = map.tile_id
+                                   WHERE map.scope = ? AND map.zoom_level = ? AND map.tile_column = ? AND map.tile_row = ?""",
+                               (suffix, z, x, 2 ** z - 1 - y)).fetchone()
+            return row and str(row[0]) or None
+        finally:
+            conn.close()
+
+    def put_many(self, z, tiles, suffix=''):
+        images = {}
+        mapping = []
+        for x, y, data in tiles:
+            tile_id = hashlib.md5(data).hexdigest()
+            images[tile_id] = data
+            mapping.append((suffix, z, x, 2 ** z - 1 - y, tile_id))
+        conn = self.connect()
+        try:
+            conn.executemany("INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)",
+                             [(tile_id, sqlite3.Binary(data)) for tile_id, data in images.items()])
+            conn.executemany("INSERT OR REPLACE INTO map (scope, zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?, ?)", mapping)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def clear(self):
+        for filename in glob.glob("%s/%s.*.mbtiles" % (self.get_base(), self.chart.shortname)):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+TILE_STORES = {
+    'file': FileTileStore,
+    'mbtiles': MBTilesStore,
+}
+
+def get_tile_store(chart):
+    return TILE_STORES[getattr(settings, 'POLLSTER_TILE_STORE', 'file')](chart)
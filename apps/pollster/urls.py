@@ -19,6 +19,7 @@ urlpatterns = patterns('',
     url(r'^pollster/(?P<id>\d+)/charts/(?P<shortname>.+)/$', views.survey_chart_edit, name='pollster_survey_chart_edit'),
     url(r'^pollster/(?P<id>\d+)/charts/(?P<shortname>.+)\.json$', views.survey_chart_data, name='pollster_survey_chart_data'),
     url(r'^pollster/(?P<id>\d+)/charts/(?P<shortname>.+)/tile/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)$', views.survey_chart_map_tile, name='pollster_survey_chart_map_tile'),
+    url(r'^pollster/(?P<id>\d+)/charts/(?P<shortname>.+)/geojson/(?P<z>\d+)$', views.survey_chart_geojson, name='pollster_survey_chart_geojson'),
     url(r'^pollster/(?P<id>\d+)/charts/(?P<shortname>.+)/click/(?P<lat>[\d.-]+)/(?P<lng>[\d.-]+)$', views.survey_chart_map_click, name='pollster_survey_chart_map_click'),
     url(r'^surveys/(?P<id>\d+)/$', views.survey_test, name='pollster_survey_test'),
     url(r'^surveys/(?P<id>\d+)/(?P<language>.+)/$', views.survey_test, name='pollster_survey_test'),
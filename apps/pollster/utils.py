@@ -1,5 +1,6 @@
 from . import models
 from django.conf import settings
+import datetime
 
 def get_user_profile(user_id, global_id):
     try:
@@ -11,3 +12,14 @@ def get_user_profile(user_id, global_id):
         return None
     except StandardError, e:
         return None
+
+TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+def parse_timestamp(value):
+    """Parse an export watermark timestamp; raises ValueError if invalid."""
+    for format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError('invalid timestamp "%s"' % (value,))
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 from django.utils import simplejson
+from django.db import transaction
 from django.core.urlresolvers import get_resolver, reverse
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, HttpResponseNotModified, Http404
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, render_to_response, redirect, get_object_or_404
 from django.utils.safestring import mark_safe
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+from django.utils.cache import patch_cache_control
 from django.utils.translation import to_locale, get_language, ugettext as _
 from django.template import RequestContext
 from django.contrib import messages
@@ -15,9 +18,9 @@ from django.conf import settings
 
 from cms import settings as cms_settings
 from apps.survey.models import SurveyUser
-from .utils import get_user_profile
+from .utils import get_user_profile, parse_timestamp
 from . import models, forms, fields, parser, json
-import re, datetime, locale, csv, urlparse, urllib
+import re, datetime, locale, csv, urlparse, urllib, zlib, hashlib, time
 
 def request_render_to_response(req, *args, **kwargs):
     kwargs['context_instance'] = RequestContext(req)
@@ -29,6 +32,37 @@ def get_object_or_none(model, **kwargs):
     except model.DoesNotExist:
         return None
 
+def _chart_response(request, chart, user_id, global_id, render, mimetype, public=False, key=()):
+    """
+    Return the content produced by render() with validators derived from
+    Chart.updated (which changes whenever the chart or its data is rebuilt)
+    and the results filter scope; answers conditional requests with 304
+    without calling render(). Only `public` responses may be stored by
+    shared caches, for POLLSTER_CHART_MAX_AGE seconds.
+    """
+    if chart.realtime:
+        return HttpResponse(render(), mimetype=mimetype)
+    etag = quote_etag(hashlib.md5(repr(chart.get_cache_key('http', user_id, global_id) + key)).hexdigest())
+    modified = int(time.mktime(chart.updated.timetuple()))
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        not_modified = etag in etags or '*' in etags
+    else:
+        not_modified = if_modified_since is not None and modified <= if_modified_since
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(render(), mimetype=mimetype)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    if public and chart.is_published and chart.survey.status == 'PUBLISHED' and chart.sqlfilter == 'NONE':
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'POLLSTER_CHART_MAX_AGE', 600))
+    else:
+        patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    return response
+
 def retry(f, *args, **kwargs):
     tries = 2
     while tries:
@@ -113,9 +147,10 @@ def survey_unpublish(request, id):
 @staff_member_required
 def survey_test(request, id, language=None):
     survey = get_object_or_404(models.Survey, pk=id)
+    translation = None
     if language:
         translation = get_object_or_404(models.TranslationSurvey, survey=survey, language=language)
-        survey.set_translation_survey(translation)
+    models.load_survey_tree(survey, translation)
     if language is None:
         language = get_language()
     locale_code = locale.locale_alias.get(language)
@@ -181,7 +216,7 @@ def survey_run(request, shortname, next=None, clean_template=False):
         if locale_code == "en-US":
             locale_code = "en-GB"
     translation = get_object_or_none(models.TranslationSurvey, survey=survey, language=language, status="PUBLISHED")
-    survey.set_translation_survey(translation)
+    models.load_survey_tree(survey, translation)
     survey_user = _get_active_survey_user(request)
     form = None
     user_id = request.user.id
@@ -195,7 +230,10 @@ def survey_run(request, shortname, next=None, clean_template=False):
         data['timestamp'] = datetime.datetime.now()
         form = survey.as_form()(data)
         if form.is_valid():
-            form.save()
+            result = form.save()
+            if survey.shortname == 'weekly':
+                models.update_health_status([result.id])
+                models.update_last_survey(user_id)
             next_url = next or _get_next_url(request, reverse("survey_run", kwargs={'shortname': shortname}))
             if global_id:
                 # add or override the 'gid' query parameter
@@ -247,6 +285,29 @@ def survey_map(request, survey_shortname, chart_shortname):
         'chart': chart,
     })
 
+def _get_translations(survey):
+    """
+    Translation rows (saved or not) of all questions, rows, columns and
+    options of `survey`, which must be loaded with load_survey_tree().
+    """
+    translations = []
+    for question in survey.questions:
+        translations.append(question.translation)
+        for row in question.rows:
+            translations.append(row.translation)
+        for column in question.columns:
+            translations.append(column.translation)
+        for option in question.options:
+            translations.append(option.translation)
+    return translations
+
+def _save_translations(translations):
+    by_model = {}
+    for translation in translations:
+        by_model.setdefault(type(translation), []).append(translation)
+    for model, objects in by_model.items():
+        models.bulk_save(model, objects)
+
 @staff_member_required
 def survey_translation_list_or_add(request, id):
     survey = get_object_or_404(models.Survey, pk=id)
@@ -260,16 +321,10 @@ def survey_translation_list_or_add(request, id):
                 translation = translations[0]
             else:
                 translation = models.TranslationSurvey(survey=survey, language=language)
-                survey.set_translation_survey(translation)
-                survey.translation_survey.save()
-                for question in survey.questions:
-                    question.translation_question.save()
-                    for option in question.options:
-                        option.translation_option.save()
-                    for row in question.rows:
-                        row.translation_row.save()
-                    for column in question.columns:
-                        column.translation_column.save()
+                with transaction.commit_on_success():
+                    translation.save()
+                    models.load_survey_tree(survey, translation)
+                    _save_translations(_get_translations(survey))
             return redirect(translation)
     return request_render_to_response(request, 'pollster/survey_translation_list.html', {
         "survey": survey,
@@ -281,21 +336,16 @@ def survey_translation_list_or_add(request, id):
 def survey_translation_edit(request, id, language):
     survey = get_object_or_404(models.Survey, pk=id)
     translation = get_object_or_404(models.TranslationSurvey, survey=survey, language=language)
-    survey.set_translation_survey(translation)
+    models.load_survey_tree(survey, translation)
     if request.method == 'POST':
-        forms = []
-        forms.append( survey.translation.as_form(request.POST) )
-        for question in survey.questions:
-            forms.append( question.translation.as_form(request.POST) )
-            for row in question.rows:
-                forms.append( row.translation.as_form(request.POST) )
-            for column in question.columns:
-                forms.append( column.translation.as_form(request.POST) )
-            for option in question.options:
-                forms.append( option.translation.as_form(request.POST) )
-        if all(f.is_valid() for f in forms):
-            for form in forms:
+        form = survey.translation.as_form(request.POST)
+        forms = [t.as_form(request.POST) for t in _get_translations(survey)]
+        # Validation only touches the instances in memory; only new and
+        # modified rows are written.
+        if form.is_valid() and all(f.is_valid() for f in forms):
+            with transaction.commit_on_success():
                 form.save()
+                _save_translations([f.save(commit=False) for f in forms if f.instance.id is None or f.has_changed()])
             messages.success(request, 'Translation saved successfully.')
             return redirect(translation)
     return request_render_to_response(request, 'pollster/survey_translation_edit.html', {
@@ -378,7 +428,11 @@ def survey_chart_data(request, id, shortname):
     survey_user = _get_active_survey_user(request)
     user_id = request.user.id
     global_id = survey_user and survey_user.global_id
-    return HttpResponse(chart.to_json(user_id, global_id), mimetype='application/json')
+    if chart.type.shortname[:10] == "google-map":
+        # The map center depends on the profile of the user.
+        return HttpResponse(chart.to_json(user_id, global_id), mimetype='application/json')
+    return _chart_response(request, chart, user_id, global_id,
+                           lambda: chart.to_json(user_id, global_id), 'application/json')
 
 @staff_member_required
 def survey_chart_map_tile(request, id, shortname, z, x, y):
@@ -389,22 +443,97 @@ def survey_chart_map_tile(request, id, shortname, z, x, y):
     survey_user = _get_active_survey_user(request)
     user_id = request.user.id
     global_id = survey_user and survey_user.global_id
-    return HttpResponse(retry(chart.get_map_tile, user_id, global_id, int(z), int(x), int(y)), mimetype='image/png')
+    return _chart_response(request, chart, user_id, global_id,
+                           lambda: retry(chart.get_map_tile, user_id, global_id, int(z), int(x), int(y)), 'image/png')
+
+@staff_member_required
+def survey_chart_geojson(request, id, shortname, z):
+    if int(z) > 22:
+        raise Http404
+    survey = get_object_or_404(models.Survey, pk=id)
+    chart = get_object_or_404(models.Chart, survey=survey, shortname=shortname)
+    survey_user = _get_active_survey_user(request)
+    user_id = request.user.id
+    global_id = survey_user and survey_user.global_id
+    return _chart_response(request, chart, user_id, global_id,
+                           lambda: chart.get_geojson(user_id, global_id, int(z)), 'application/json', key=(z,))
 
 @staff_member_required
 def survey_chart_map_click(request, id, shortname, lat, lng):
     survey = get_object_or_404(models.Survey, pk=id)
     chart = get_object_or_404(models.Chart, survey=survey, shortname=shortname)
-    return HttpResponse(chart.get_map_click(float(lat), float(lng)), mimetype='application/json')
+    return _chart_response(request, chart, None, None,
+                           lambda: chart.get_map_click(float(lat), float(lng)), 'application/json')
+
+class _CSVBuffer(object):
+    """File-like target for csv.writer that hands out what was written."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def pop(self):
+        data = ''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _stream_csv(rows, compress=False, chunk_rows=500):
+    buf = _CSVBuffer()
+    writer = csv.writer(buf)
+    # wbits 16+MAX_WBITS makes zlib write a gzip header and trailer
+    compressor = compress and zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            data = buf.pop()
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = buf.pop()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
 
 @staff_member_required
 def survey_results_csv(request, id):
+    """
+    Export the results of a survey as CSV. Incremental exports pass the
+    watermark returned by the previous one (the X-Pollster-Watermark-Id
+    and X-Pollster-Watermark-Timestamp headers) as `since_id` and/or `since`;
+    `table` selects one of the archived results tables instead.
+    """
     survey = get_object_or_404(models.Survey, pk=id)
     now = datetime.datetime.now()
-    response = HttpResponse(mimetype='text/csv')
-    response['Content-Disposition'] = 'attachment; filename=survey-results-%d-%s.csv' % (survey.id, format(now, '%Y%m%d%H%M'))
-    writer = csv.writer(response)
-    survey.write_csv(writer)
+    compress = request.GET.get('gzip') in ('1', 'true')
+    table = request.GET.get('table') or None
+    if table and table not in survey.get_archived_table_names():
+        raise Http404
+    try:
+        since_id = request.GET.get('since_id') and int(request.GET['since_id']) or None
+        since = request.GET.get('since') and parse_timestamp(request.GET['since']) or None
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e), mimetype='text/plain')
+    until_id, until = survey.get_results_watermark(table, since_id, since)
+    filename = 'survey-results-%d-%s.csv' % (survey.id, format(now, '%Y%m%d%H%M'))
+    # The response is an iterator so that rows are fetched from the database
+    # and written out in chunks instead of building the whole file in memory.
+    # Rows are bounded by the watermark so that results submitted during
+    # the export are left for the next one.
+    rows = survey.iter_csv_rows(table=table, since_id=since_id, since=since, until_id=until_id or 0)
+    content = _stream_csv(rows, compress)
+    if compress:
+        response = HttpResponse(content, mimetype='application/x-gzip')
+        filename += '.gz'
+    else:
+        response = HttpResponse(content, mimetype='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=%s' % (filename,)
+    response['X-Pollster-Watermark-Id'] = str(until_id or since_id or 0)
+    response['X-Pollster-Watermark-Timestamp'] = str(until or since or '')
     return response
 
 @staff_member_required
@@ -444,7 +573,11 @@ def chart_data(request, survey_shortname, chart_shortname):
 
     user_id = request.user.id
     global_id = survey_user and survey_user.global_id
-    return HttpResponse(chart.to_json(user_id, global_id), mimetype='application/json')
+    if chart.type.shortname[:10] == "google-map" and user_id:
+        # The map center depends on the profile of the user.
+        return HttpResponse(chart.to_json(user_id, global_id), mimetype='application/json')
+    return _chart_response(request, chart, user_id, global_id,
+                           lambda: chart.to_json(user_id, global_id), 'application/json', public=True)
 
 def map_tile(request, survey_shortname, chart_shortname, z, x, y):
     if int(z) > 22:
@@ -459,7 +592,24 @@ def map_tile(request, survey_shortname, chart_shortname, z, x, y):
     survey_user = _get_active_survey_user(request)
     user_id = request.user.id
     global_id = survey_user and survey_user.global_id
-    return HttpResponse(retry(chart.get_map_tile, user_id, global_id, int(z), int(x), int(y)), mimetype='image/png')
+    return _chart_response(request, chart, user_id, global_id,
+                           lambda: retry(chart.get_map_tile, user_id, global_id, int(z), int(x), int(y)), 'image/png', public=True)
+
+def map_geojson(request, survey_shortname, chart_shortname, z):
+    if int(z) > 22:
+        raise Http404
+    chart = None
+    if request.user.is_active and request.user.is_staff:
+        survey = get_object_or_404(models.Survey, shortname=survey_shortname)
+        chart = get_object_or_404(models.Chart, survey=survey, shortname=chart_shortname)
+    else:
+        survey = get_object_or_404(models.Survey, shortname=survey_shortname, status='PUBLISHED')
+        chart = get_object_or_404(models.Chart, survey=survey, shortname=chart_shortname, status='PUBLISHED')
+    survey_user = _get_active_survey_user(request)
+    user_id = request.user.id
+    global_id = survey_user and survey_user.global_id
+    return _chart_response(request, chart, user_id, global_id,
+                           lambda: chart.get_geojson(user_id, global_id, int(z)), 'application/json', public=True, key=(z,))
 
 def map_click(request, survey_shortname, chart_shortname, lat, lng):
     chart = None
@@ -469,7 +619,8 @@ def map_click(request, survey_shortname, chart_shortname, lat, lng):
     else:
         survey = get_object_or_404(models.Survey, shortname=survey_shortname, status='PUBLISHED')
         chart = get_object_or_404(models.Chart, survey=survey, shortname=chart_shortname, status='PUBLISHED')
-    return HttpResponse(chart.get_map_click(float(lat), float(lng)), mimetype='application/json')
+    return _chart_response(request, chart, None, None,
+                           lambda: chart.get_map_click(float(lat), float(lng)), 'application/json', public=True)
 
 # based on http://djangosnippets.org/snippets/2059/
 
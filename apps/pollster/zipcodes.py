@@ -0,0 +1,156 @@
+"""
+Precomputed zip code centroids.
+
+The zip_code_centroids command fills CENTROID_TABLE from the geometry tables
+(GEOMETRY_TABLES) once; ZipCodeIndex then keeps the normalized keys of a
+geometry table in sorted arrays in memory so that zip code validation and map
+centering are a binary search instead of a query per request. Without the
+table (the command was never run) lookups return None and callers fall back
+to querying the geometry table.
+"""
+
+from django.db import connection, transaction
+from django.conf import settings
+from .db.utils import get_relation_type
+from array import array
+import bisect, threading, time
+
+CENTROID_TABLE = 'pollster_zip_code_centroids'
+
+CENTROID_TABLE_SQL = """CREATE TABLE %s (
+    geotable varchar(255) NOT NULL,
+    country varchar(255) NOT NULL,
+    zip_code_key varchar(255) NOT NULL,
+    lat double precision NULL,
+    lng double precision NULL,
+    version bigint NOT NULL DEFAULT 0
+)"""
+
+def normalize(value):
+    # Same matching as the upper(zip_code_key) = upper(%s) queries.
+    return value is not None and unicode(value).upper() or u''
+
+def install_centroid_table():
+    if get_relation_type(connection, CENTROID_TABLE) is None:
+        cursor = connection.cursor()
+        cursor.execute(CENTROID_TABLE_SQL % (CENTROID_TABLE,))
+        cursor.execute("CREATE INDEX %s_key ON %s (geotable, zip_code_key, country)" % (CENTROID_TABLE, CENTROID_TABLE))
+        transaction.commit_unless_managed()
+    else:
+        cursor = connection.cursor()
+        columns = [row[0] for row in connection.introspection.get_table_description(cursor, CENTROID_TABLE)]
+        if 'version' not in columns:
+            cursor.execute("ALTER TABLE %s ADD COLUMN version bigint NOT NULL DEFAULT 0" % (CENTROID_TABLE,))
+            transaction.commit_unless_managed()
+
+def build_centroids(geotable):
+    """Recompute the centroids of `geotable`; returns the number of zip codes."""
+    install_centroid_table()
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    columns = [row[0] for row in connection.introspection.get_table_description(cursor, geotable)]
+    country = 'country' in columns and "upper(%s)" % (qn('country'),) or "''"
+    cursor.execute("DELETE FROM %s WHERE geotable = %%s" % (CENTROID_TABLE,), [geotable])
+    # Every build gets a new version, so that ZipCodeIndex reloads even if
+    # the number of zip codes did not change.
+    version = int(time.time() * 1000)
+    cursor.execute("""INSERT INTO %s (geotable, country, zip_code_key, lat, lng, version)
+                      SELECT %%s, coalesce(%s, ''), upper(zip_code_key),
+                             ST_Y(ST_Centroid(geometry)), ST_X(ST_Centroid(geometry)), %%s
+                        FROM %s
+                       WHERE zip_code_key IS NOT NULL""" % (CENTROID_TABLE, country, qn(geotable)), [geotable, version])
+    cursor.execute("SELECT count(*) FROM %s WHERE geotable = %%s" % (CENTROID_TABLE,), [geotable])
+    count = cursor.fetchone()[0]
+    transaction.commit_unless_managed()
+    return count
+
+class ZipCodeIndex(object):
+    """
+    Sorted "KEY<tab>COUNTRY" strings with parallel coordinate arrays for one
+    geometry table; reloaded when build_centroids() ran again (its rows in
+    CENTROID_TABLE get a new version), checked at most every
+    `check_interval` seconds.
+    """
+    def __init__(self, geotable, check_interval=60):
+        self.geotable = geotable
+        self.check_interval = check_interval
+        self.fingerprint = None
+        self.checked = 0
+        # (sorted keys, latitudes, longitudes), replaced as a whole on reload.
+        self.data = None
+        self.lock = threading.Lock()
+
+    def get_fingerprint(self):
+        if get_relation_type(connection, CENTROID_TABLE) != 'table':
+            return None
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*), max(version) FROM %s WHERE geotable = %%s" % (CENTROID_TABLE,), [self.geotable])
+        count, version = cursor.fetchone()
+        return count and (count, version) or None
+
+    def load(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT zip_code_key, country, lat, lng FROM %s WHERE geotable = %%s" % (CENTROID_TABLE,), [self.geotable])
+        rows = sorted([(u'%s\t%s' % (key, country), lat, lng) for key, country, lat, lng in cursor.fetchall()])
+        nan = float('nan')
+        self.data = ([row[0] for row in rows],
+                     array('d', [row[1] if row[1] is not None else nan for row in rows]),
+                     array('d', [row[2] if row[2] is not None else nan for row in rows]))
+
+    def refresh(self):
+        """Return False when there are no precomputed centroids."""
+        if time.time() - self.checked >= self.check_interval:
+            self.lock.acquire()
+            try:
+                if time.time() - self.checked >= self.check_interval:
+                    fingerprint = self.get_fingerprint()
+                    if not fingerprint:
+                        self.data = None
+                    elif fingerprint != self.fingerprint or self.data is None:
+                        self.load()
+                    self.fingerprint = fingerprint
+                    self.checked = time.time()
+            finally:
+                self.lock.release()
+        return self.data is not None
+
+    def find(self, keys, zip_code_key, country=None):
+        """Position of the zip code (in any country if `country` is None) in `keys`, or -1."""
+        key = normalize(zip_code_key) + u'\t'
+        if country is not None:
+            key += normalize(country)
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and (keys[i] == key or (country is None and keys[i].startswith(key))):
+            return i
+        return -1
+
+    def contains(self, zip_code_key, country=None):
+        """True/False, or None if there are no precomputed centroids."""
+        data = self.refresh() and self.data
+        if not data:
+            return None
+        return self.find(data[0], zip_code_key, country) >= 0
+
+    def get_coords(self, zip_code_key, country=None):
+        """{"lat": ..., "lng": ...} ({} if unknown), or None if there are no precomputed centroids."""
+        data = self.refresh() and self.data
+        if not data:
+            return None
+        keys, lat, lng = data
+        i = self.find(keys, zip_code_key, country)
+        if i < 0 or lat[i] != lat[i]:
+            # Unknown zip code, or no centroid (NaN) for its geometry.
+            return {}
+        return {"lat": lat[i], "lng": lng[i]}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_zip_code_index(geotable='pollster_zip_codes'):
+    _indexes_lock.acquire()
+    try:
+        if geotable not in _indexes:
+            _indexes[geotable] = ZipCodeIndex(geotable, getattr(settings, 'POLLSTER_ZIP_CODE_CHECK_INTERVAL', 60))
+        return _indexes[geotable]
+    finally:
+        _indexes_lock.release()
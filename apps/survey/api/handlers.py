@@ -49,7 +49,7 @@ class GetUserProfile(EpiwebHandler):
             if su.user is None:
                 raise GetError(2, "no django-users for activation code '%s'" % acode)
             u = su.user
-            acodes = [code_hash(s.global_id)
+            acodes = [s.activation_code or code_hash(s.global_id)
                                 for s in SurveyUser.objects.filter(user=u)]
             pd = su.last_participation_date
             if pd:
@@ -1,11 +1,10 @@
-from apps.survey.models import SurveyUser, Survey
+from apps.survey.models import SurveyUser, Survey, code_hash
 from apps.survey.utils import load_specification
 from apps.survey.survey import parse_specification
 from apps.survey.spec import Question, Branch, Else
 from apps.survey.times import epochal_to_timedate
 from inspect import isclass
 from apps.survey import utils
-from re import sub
 
 def xmlify_spec(spec):
     """Take a survey specificatin and return it as XML."""
@@ -153,15 +152,6 @@ def report_survey(jdata):
             'report_items': report_items,
            }
 
-def code_hash(gid, code_length=12):
-    """Take a global_id (a UUID string containing '-' symbols).
-    Hash it to a string of digits of length code_length.
-    """
-    # modulo 10**code_length and pad left with zeros
-    code_format = ('%%0%dd' % code_length)
-    gid_int = int(sub('-', '', gid), 16)
-    return code_format % (gid_int % 10**code_length)
-
 class GetError(Exception):
     def __init__(self, status, message):
         self.status = status
@@ -176,10 +166,13 @@ def code_unhash(activation_code):
     Flags nonexistent codes and code collisions.
     """
 
-    # TODO the loop over all SurveyUser objects below likely does not scale to 20.000 users
-    # especially since calls to code_unhash are quite common
-    matches = [su.global_id for su in SurveyUser.objects.all()
-                         if code_hash(su.global_id) == activation_code]
+    matches = list(SurveyUser.objects.filter(activation_code=activation_code)
+                                      .values_list('global_id', flat=True)[:2])
+    if not matches:
+        # Users saved before activation codes were stored and not yet
+        # backfilled by the survey_activation_codes command.
+        matches = [su.global_id for su in SurveyUser.objects.filter(activation_code='')
+                             if code_hash(su.global_id) == activation_code]
     l = len(matches)
     if l == 0:
         raise GetError(2, 'user with activation code %s not found' % activation_code)
@@ -188,4 +181,3 @@ def code_unhash(activation_code):
                              activation_code)
     else:
         return matches[0]
-
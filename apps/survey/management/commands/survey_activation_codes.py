@@ -0,0 +1,40 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = 'Store the activation codes of SurveyUsers saved without one and report duplicate codes. ' \
+           'New SurveyUsers are only checked for collisions against users that have a stored code.'
+    option_list = BaseCommand.option_list + (
+        make_option('-a', '--all', action='store_true',
+                    dest='all', default=False,
+                    help='Recompute the activation codes of all SurveyUsers.'),
+    )
+
+    def handle(self, *args, **options):
+        from django.db import connection, transaction
+        from django.db.models import Count
+        from apps.survey import models
+
+        verbosity = int(options.get('verbosity', 1))
+
+        survey_users = models.SurveyUser.objects.all()
+        if not options.get('all'):
+            survey_users = survey_users.filter(activation_code='')
+        params = [(models.code_hash(global_id), id) for id, global_id in survey_users.values_list('id', 'global_id')]
+
+        # A plain UPDATE: saving every SurveyUser would also check each code
+        # for collisions, which is done once for all of them below.
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.executemany("UPDATE %s SET %s = %%s WHERE %s = %%s" % (
+            qn(models.SurveyUser._meta.db_table), qn('activation_code'), qn('id')), params)
+        transaction.commit_unless_managed()
+        if verbosity > 0:
+            print 'Stored %d activation codes' % (len(params),)
+
+        duplicates = models.SurveyUser.objects.exclude(activation_code='').values('activation_code') \
+                                       .annotate(count=Count('id')).filter(count__gt=1)
+        for duplicate in duplicates:
+            global_ids = models.SurveyUser.objects.filter(activation_code=duplicate['activation_code']) \
+                                                  .values_list('global_id', flat=True)
+            print 'Activation code %s is shared by %s' % (duplicate['activation_code'], ', '.join(global_ids))
@@ -1,3 +1,4 @@
+from optparse import make_option
 from django.core.management.base import NoArgsCommand
 
 try:
@@ -7,6 +8,14 @@ except ImportError:
 
 class Command(NoArgsCommand):
     help = 'Send all survey responses and user profiles waiting in queue.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('-w', '--workers', action='store', type='int',
+                    dest='workers', default=None,
+                    help='Number of concurrent submissions (default EPIDB_FLUSH_WORKERS).'),
+        make_option('-c', '--chunk-size', action='store', type='int',
+                    dest='chunk_size', default=None,
+                    help='Number of queued items loaded at a time (default EPIDB_FLUSH_CHUNK_SIZE).'),
+    )
 
     def handle_noargs(self, **options):
         self.send_profiles(**options)
@@ -14,17 +23,16 @@ class Command(NoArgsCommand):
 
     def send_profiles(self, **options):
         from apps.survey import utils
-        total_sent, total_error = utils.flush_profile_queue()
-
-        verbosity = int(options.get('verbosity', 1))
-        if total_error > 0 or verbosity > 0:
-            print "Profiles: %d sent, %d error." % (total_sent, total_error)
+        result = utils.flush_profile_queue(options.get('workers'), options.get('chunk_size'))
+        self.report('Profiles', result, **options)
 
     def send_responses(self, **options):
         from apps.survey import utils
-        total_sent, total_error = utils.flush_response_queue()
+        result = utils.flush_response_queue(options.get('workers'), options.get('chunk_size'))
+        self.report('Responses', result, **options)
 
+    def report(self, name, result, **options):
         verbosity = int(options.get('verbosity', 1))
-        if total_error > 0 or verbosity > 0:
-            print "Responses: %d sent, %d error." % (total_sent, total_error)
-
+        if result.error > 0 or verbosity > 0:
+            print "%s: %d sent, %d error (%d dead), %.1f items/second." % (
+                name, result.sent, result.error, result.dead, result.rate)
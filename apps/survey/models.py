@@ -1,10 +1,13 @@
 from datetime import datetime, date
-import uuid
+from re import sub
+import uuid, warnings
 
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.conf import settings
 from django.db import connection, transaction
 
 from times import epoch
@@ -12,6 +15,15 @@ from times import epoch
 def create_global_id():
     return str(uuid.uuid4())
 
+def code_hash(gid, code_length=12):
+    """Take a global_id (a UUID string containing '-' symbols).
+    Hash it to a string of digits of length code_length.
+    """
+    # modulo 10**code_length and pad left with zeros
+    code_format = ('%%0%dd' % code_length)
+    gid_int = int(sub('-', '', gid), 16)
+    return code_format % (gid_int % 10**code_length)
+
 class SurveyUser(models.Model):
     user = models.ForeignKey(User, null=True) # null=True: only so because this happens 'in the wild', i.e.
                                               # in already existing data. Other than that there is no good
@@ -25,12 +37,40 @@ class SurveyUser(models.Model):
     name = models.CharField(max_length=100)
     deleted = models.BooleanField(default=False)
 
+    # code_hash(global_id), the activation code of the EIP mobile API; set on
+    # save (existing users are backfilled by migration 0013; see also the
+    # survey_activation_codes command).
+    activation_code = models.CharField(max_length=12, db_index=True, blank=True, default='', editable=False)
+
     class Meta:
         verbose_name_plural = 'User'
 
+    def __init__(self, *args, **kwargs):
+        super(SurveyUser, self).__init__(*args, **kwargs)
+        # The global id generated by the field default, if it was not given.
+        self._default_global_id = None
+        if self.pk is None and not args and 'global_id' not in kwargs:
+            self._default_global_id = self.global_id
+
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self.activation_code:
+            self.activation_code = code_hash(self.global_id)
+            while self.get_activation_code_collisions().exists():
+                if self.pk is not None or self.global_id != self._default_global_id:
+                    # Existing or imported participants keep their global id.
+                    warnings.warn('activation code %s of SurveyUser %s is not unique' % (self.activation_code, self.global_id))
+                    break
+                # New participants simply get another global id.
+                self.global_id = self._default_global_id = create_global_id()
+                self.activation_code = code_hash(self.global_id)
+        super(SurveyUser, self).save(*args, **kwargs)
+
+    def get_activation_code_collisions(self):
+        return SurveyUser.objects.filter(activation_code=self.activation_code).exclude(global_id=self.global_id)
+
     def get_edit_url(self):
         from . import views
         return '%s?gid=%s' % (reverse(views.people_edit), self.global_id)
@@ -98,10 +138,18 @@ class ResponseSendQueue(models.Model):
     survey_id = models.CharField(max_length=50)
     answers = models.TextField()
 
-    def set_sent(self, epidb_id):
-        self.participation.epidb_id = epidb_id
-        self.participation.save()
-        self.delete()
+    # Failed submissions, see utils.flush_response_queue().
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(null=True, blank=True, db_index=True)
+    dead = models.BooleanField(default=False, db_index=True)
+
+    @classmethod
+    def set_sent(cls, sent):
+        """Store the EpiDB ids of the sent (item, epidb_id) pairs and dequeue the items."""
+        from apps.pollster.db.utils import bulk_update
+        bulk_update(connection, Participation._meta.db_table, ['epidb_id'],
+                    [(epidb_id, item.participation_id) for item, epidb_id in sent])
+        cls.objects.filter(id__in=[item.id for item, epidb_id in sent]).delete()
 
 class ProfileSendQueue(models.Model):
     owner = models.ForeignKey(SurveyUser)
@@ -110,8 +158,15 @@ class ProfileSendQueue(models.Model):
     survey_id = models.CharField(max_length=50)
     answers = models.TextField()
 
-    def set_sent(self, epidb_id):
-        self.delete()
+    # Failed submissions, see utils.flush_profile_queue().
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(null=True, blank=True, db_index=True)
+    dead = models.BooleanField(default=False, db_index=True)
+
+    @classmethod
+    def set_sent(cls, sent):
+        """Dequeue the sent (item, epidb_id) pairs."""
+        cls.objects.filter(id__in=[item.id for item, epidb_id in sent]).delete()
 
 class LocalResponse(models.Model):
     date = models.DateTimeField()
@@ -159,6 +214,29 @@ def add_empty_last_response(sender, instance, created, **kwargs):
 post_save.connect(add_empty_profile, sender=SurveyUser)
 post_save.connect(add_empty_last_response, sender=SurveyUser)
 
+# Global ids of the not deleted SurveyUsers of each user, kept in the Django
+# cache until one of the user's SurveyUsers is saved or deleted.
+SURVEY_USERS_CACHE_TIMEOUT = getattr(settings, 'SURVEY_USERS_CACHE_TIMEOUT', 60 * 60 * 24)
+
+def _get_survey_users_cache_key(user_id):
+    return 'survey-users-%s' % (user_id,)
+
+def get_active_global_ids(user_id):
+    """Return the global ids of the not deleted SurveyUsers of a user."""
+    key = _get_survey_users_cache_key(user_id)
+    global_ids = cache.get(key)
+    if global_ids is None:
+        global_ids = list(SurveyUser.objects.filter(user=user_id, deleted=False).values_list('global_id', flat=True))
+        cache.set(key, global_ids, SURVEY_USERS_CACHE_TIMEOUT)
+    return global_ids
+
+def invalidate_active_global_ids(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        cache.delete(_get_survey_users_cache_key(instance.user_id))
+
+post_save.connect(invalidate_active_global_ids, sender=SurveyUser)
+post_delete.connect(invalidate_active_global_ids, sender=SurveyUser)
+
 
 class LocalProfile(models.Model):
     surveyuser = models.ForeignKey(SurveyUser, unique=True)
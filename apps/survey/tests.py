@@ -0,0 +1,186 @@
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase
+from apps.survey import models, utils
+import cgi, pickle, threading, uuid, warnings
+import simplejson as json
+
+class EpiDBHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the EpiDB API: answers every POST (response/ or profile/)
+    with {"stat": "ok", "id": <new epidb id>}, or with a failure when the
+    server is set to fail.
+    """
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        form = cgi.parse_qs(self.rfile.read(length))
+        server = self.server
+        if server.fail:
+            body = {'stat': 'fail', 'code': 1, 'msg': 'unavailable'}
+        else:
+            body = {'stat': 'ok', 'id': str(uuid.uuid4())}
+        server.lock.acquire()
+        try:
+            server.requests.append((self.path, form))
+            if not server.fail:
+                server.ids.append(body['id'])
+        finally:
+            server.lock.release()
+        data = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class FlushQueueTest(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), EpiDBHandler)
+        self.server.fail = False
+        self.server.requests = []
+        self.server.ids = []
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.settings = dict([(name, getattr(settings, name, None)) for name in ('EPIDB_API_KEY', 'EPIDB_SERVER')])
+        settings.EPIDB_API_KEY = 'test'
+        settings.EPIDB_SERVER = 'http://127.0.0.1:%d/' % (self.server.server_port,)
+
+        user = User.objects.create(username='test')
+        self.survey_user = models.SurveyUser.objects.create(user=user, name='test')
+        self.other_survey_user = models.SurveyUser.objects.create(user=user, name='other')
+        self.survey = models.Survey.objects.create(survey_id='test-weekly', title='test', specification='')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for name, value in self.settings.items():
+            setattr(settings, name, value)
+
+    def add_responses(self, count, survey_user=None):
+        survey_user = survey_user or self.survey_user
+        participations = []
+        for i in range(count):
+            participation = models.Participation.objects.create(user=survey_user, survey=self.survey)
+            models.ResponseSendQueue.objects.create(participation=participation, user_id=survey_user.global_id,
+                                                    survey_id=self.survey.survey_id, answers=pickle.dumps({'Q1': i}))
+            participations.append(participation)
+        return participations
+
+    def test_flush_response_queue(self):
+        participations = self.add_responses(7)
+        result = utils.flush_response_queue(workers=3, chunk_size=2)
+
+        self.assertEqual((result.sent, result.error, result.dead), (7, 0, 0))
+        self.assertTrue(result.rate > 0)
+        self.assertEqual(len(self.server.requests), 7)
+        self.assertEqual(models.ResponseSendQueue.objects.count(), 0)
+        epidb_ids = [models.Participation.objects.get(id=p.id).epidb_id for p in participations]
+        self.assertEqual(sorted(epidb_ids), sorted(self.server.ids))
+
+    def test_flush_profile_queue(self):
+        for i in range(3):
+            models.ProfileSendQueue.objects.create(owner=self.survey_user, date=datetime.utcnow(),
+                                                   user_id=self.survey_user.global_id, survey_id='test-intake',
+                                                   answers=pickle.dumps({'IntakeQ1': i}))
+        sent, error = utils.flush_profile_queue(workers=2)
+        self.assertEqual((sent, error), (3, 0))
+        self.assertEqual(models.ProfileSendQueue.objects.count(), 0)
+
+    def test_backoff_and_dead_letter(self):
+        self.add_responses(1)
+        self.add_responses(1, self.other_survey_user)
+        self.server.fail = True
+        before = datetime.now()
+        result = utils.flush_response_queue(workers=2)
+        self.assertEqual((result.sent, result.error, result.dead), (0, 2, 0))
+        for item in models.ResponseSendQueue.objects.all():
+            self.assertEqual(item.attempts, 1)
+            self.assertFalse(item.dead)
+            self.assertTrue(item.next_attempt >= before + timedelta(seconds=utils.get_retry_delay(1)))
+
+        # Items waiting for their next attempt are left alone.
+        requests = len(self.server.requests)
+        result = utils.flush_response_queue()
+        self.assertEqual((result.sent, result.error), (0, 0))
+        self.assertEqual(len(self.server.requests), requests)
+
+        # The last allowed attempt fails: the items are dead-lettered.
+        models.ResponseSendQueue.objects.update(attempts=utils.EPIDB_MAX_ATTEMPTS - 1, next_attempt=before)
+        result = utils.flush_response_queue()
+        self.assertEqual((result.error, result.dead), (2, 2))
+        self.assertEqual(models.ResponseSendQueue.objects.filter(dead=True).count(), 2)
+
+        # Dead items are kept for inspection but never submitted again.
+        self.server.fail = False
+        result = utils.flush_response_queue()
+        self.assertEqual((result.sent, result.error), (0, 0))
+        self.assertEqual(models.ResponseSendQueue.objects.count(), 2)
+
+    def test_items_of_a_user_are_sent_in_order(self):
+        now = datetime.utcnow()
+        for i in range(3):
+            models.ProfileSendQueue.objects.create(owner=self.survey_user, date=now + timedelta(seconds=i),
+                                                   user_id=self.survey_user.global_id, survey_id='test-intake',
+                                                   answers=pickle.dumps({'IntakeQ1': i}))
+        self.server.fail = True
+        result = utils.flush_profile_queue(workers=3)
+        # The first profile fails, the newer ones are not submitted before it.
+        self.assertEqual((result.sent, result.error), (0, 1))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(list(models.ProfileSendQueue.objects.order_by('date').values_list('attempts', flat=True)),
+                         [1, 0, 0])
+
+        # They keep waiting while it waits for its next attempt.
+        self.server.fail = False
+        result = utils.flush_profile_queue(workers=3)
+        self.assertEqual((result.sent, result.error), (0, 0))
+
+        models.ProfileSendQueue.objects.update(next_attempt=None)
+        result = utils.flush_profile_queue(workers=3)
+        self.assertEqual((result.sent, result.error), (3, 0))
+        self.assertEqual(models.ProfileSendQueue.objects.count(), 0)
+
+    def test_corrupt_item(self):
+        participation = models.Participation.objects.create(user=self.survey_user, survey=self.survey)
+        models.ResponseSendQueue.objects.create(participation=participation, user_id=self.survey_user.global_id,
+                                                survey_id=self.survey.survey_id, answers='not a pickle')
+        result = utils.flush_response_queue()
+        self.assertEqual((result.sent, result.error), (0, 1))
+        self.assertEqual(len(self.server.requests), 0)
+        self.assertEqual(models.ResponseSendQueue.objects.get().attempts, 1)
+
+    def test_retry_delay(self):
+        self.assertEqual(utils.get_retry_delay(1), utils.EPIDB_RETRY_DELAY)
+        self.assertEqual(utils.get_retry_delay(3), utils.EPIDB_RETRY_DELAY * 4)
+        self.assertEqual(utils.get_retry_delay(100), utils.EPIDB_MAX_RETRY_DELAY)
+
+class ActivationCodeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.first = models.SurveyUser.objects.create(user=self.user, name='first')
+        # Another global id with the same activation code.
+        value = (uuid.UUID(self.first.global_id).int + 10**12) % 2**128
+        self.colliding_id = str(uuid.UUID(int=value))
+
+    def test_generated_global_id_is_replaced(self):
+        survey_user = models.SurveyUser(user=self.user, name='second')
+        survey_user.global_id = survey_user._default_global_id = self.colliding_id
+        survey_user.save()
+        self.assertNotEqual(survey_user.global_id, self.colliding_id)
+        self.assertNotEqual(survey_user.activation_code, self.first.activation_code)
+
+    def test_explicit_global_id_is_kept(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            survey_user = models.SurveyUser.objects.create(user=self.user, name='second', global_id=self.colliding_id)
+        self.assertEqual(survey_user.global_id, self.colliding_id)
+        self.assertEqual(survey_user.activation_code, self.first.activation_code)
+        self.assertEqual(len(caught), 1)
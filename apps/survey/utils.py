@@ -1,5 +1,6 @@
 import urllib2
 import errno
+import time
 from django import forms
 from django.forms.util import ErrorList
 from django.contrib.auth.models import User
@@ -11,7 +12,7 @@ from apps.survey import signals
 from django.conf import settings
 from epidb_client import EpiDBClient, ResponseError, InvalidResponseError
 
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 
 from .survey import Specification, parse_specification
 
@@ -227,65 +228,148 @@ def save_response_locally(user_id, survey_id, answers, date):
     else:
       pass
 
-def flush_response_queue():
+# Queue flushing: the items of different users are submitted concurrently
+# by EPIDB_FLUSH_WORKERS threads, about EPIDB_FLUSH_CHUNK_SIZE at a time; the
+# items of one user are submitted in order by a single thread. The database
+# is only touched by the calling thread. An item that fails is retried after
+# EPIDB_RETRY_DELAY seconds, doubled on every further failure (up to
+# EPIDB_MAX_RETRY_DELAY), and marked dead after EPIDB_MAX_ATTEMPTS failures;
+# the later items of its user wait for it.
+EPIDB_FLUSH_WORKERS = getattr(settings, 'EPIDB_FLUSH_WORKERS', 4)
+EPIDB_FLUSH_CHUNK_SIZE = getattr(settings, 'EPIDB_FLUSH_CHUNK_SIZE', 100)
+EPIDB_MAX_ATTEMPTS = getattr(settings, 'EPIDB_MAX_ATTEMPTS', 10)
+EPIDB_RETRY_DELAY = getattr(settings, 'EPIDB_RETRY_DELAY', 60)
+EPIDB_MAX_RETRY_DELAY = getattr(settings, 'EPIDB_MAX_RETRY_DELAY', 60 * 60 * 24)
+
+class FlushResult(object):
+    def __init__(self):
+        self.sent = 0
+        self.error = 0
+        self.dead = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return (self.sent + self.error) / max(self.elapsed, 1e-9)
+
+    def __iter__(self):
+        # Unpacks as (sent, error) like the former return value.
+        return iter((self.sent, self.error))
+
+def get_epidb_client():
     client = EpiDBClient(settings.EPIDB_API_KEY)
     if hasattr(settings, 'EPIDB_SERVER') and settings.EPIDB_SERVER is not None:
         client.server = settings.EPIDB_SERVER
+    return client
 
-    total = 0
-    total_sent = 0
-    total_error = 0
+def get_retry_delay(attempts):
+    """Seconds to wait before the next attempt after `attempts` failures."""
+    return min(EPIDB_RETRY_DELAY * 2 ** (attempts - 1), EPIDB_MAX_RETRY_DELAY)
 
-    surveys = models.ResponseSendQueue.objects.order_by('date')
-    for survey in surveys:
-        date = survey.date
-        survey_id = survey.survey_id
-        user_id = survey.user_id
-        answers = pickle.loads(str(survey.answers))
-
-        try:
-            res = client.response_submit(user_id, survey_id,
-                                         answers, date)
-            survey.set_sent(res['id'])
-            total_sent += 1
-        except InvalidResponseError, e:
-            total_error += 1
-        except ResponseError, e:
-            total_error += 1
-
-        total += 1
-
-    return total_sent, total_error
-
-def flush_profile_queue():
-    client = EpiDBClient(settings.EPIDB_API_KEY)
-    if hasattr(settings, 'EPIDB_SERVER') and settings.EPIDB_SERVER is not None:
-        client.server = settings.EPIDB_SERVER
-
-    total = 0
-    total_sent = 0
-    total_error = 0
-
-    surveys = models.ProfileSendQueue.objects.order_by('date')
-    for survey in surveys:
-        date = survey.date
-        profile_survey_id = survey.survey_id
-        user_id = survey.user_id
-        answers = pickle.loads(str(survey.answers))
-
-        try:
-            res = client.profile_update(user_id, profile_survey_id,
-                                        answers, date)
-            survey.set_sent(res['id'])
-            total_sent += 1
-        except InvalidResponseError, e:
-            total_error += 1
-        except ResponseError, e:
-            total_error += 1
-
-        total += 1
-
-    return total_sent, total_error
+def _submit_item(submit, item):
+    try:
+        answers = pickle.loads(str(item.answers))
+    except (pickle.UnpicklingError, EOFError, ValueError, ImportError, AttributeError, IndexError, KeyError, TypeError), e:
+        # A corrupt item fails like any other, until it is dead.
+        return None, e
+    try:
+        res = submit(item.user_id, item.survey_id, answers, item.date)
+        return res['id'], None
+    except (InvalidResponseError, ResponseError, IOError, KeyError, TypeError), e:
+        # IOError covers connection failures and HTTP errors.
+        return None, e
+
+def _submit_items(submit, items):
+    """
+    Submit the items of one user in order, up to the first failure: a later
+    item (e.g. a newer profile) must not reach EpiDB before an earlier one.
+    """
+    outcomes = []
+    for item in items:
+        epidb_id, error = _submit_item(submit, item)
+        outcomes.append((item, epidb_id, error))
+        if error is not None:
+            break
+    return outcomes
+
+def _flush_queue(model, submit, workers=None, chunk_size=None, now=None):
+    from multiprocessing.pool import ThreadPool
+    from django.db import connection, transaction
+    from django.db.models import Q
+    from apps.pollster.db.utils import bulk_update
+
+    workers = workers or EPIDB_FLUSH_WORKERS
+    chunk_size = chunk_size or EPIDB_FLUSH_CHUNK_SIZE
+    now = now or datetime.now()
+    result = FlushResult()
+    start = time.time()
+
+    # Users with an item waiting for its next attempt are skipped: their
+    # later items are submitted after it.
+    waiting = set(model.objects.filter(dead=False, next_attempt__gt=now).values_list('user_id', flat=True))
+    users = []
+    user_ids = {}
+    for id, user_id in model.objects.filter(dead=False) \
+                                    .filter(Q(next_attempt__isnull=True) | Q(next_attempt__lte=now)) \
+                                    .order_by('date', 'id').values_list('id', 'user_id'):
+        if user_id in waiting:
+            continue
+        if user_id not in user_ids:
+            user_ids[user_id] = []
+            users.append(user_id)
+        user_ids[user_id].append(id)
+
+    # Chunks hold all the items of their users.
+    chunks = []
+    for user_id in users:
+        if not chunks or len(chunks[-1]) + len(user_ids[user_id]) > chunk_size:
+            chunks.append([])
+        chunks[-1].extend(user_ids[user_id])
+
+    pool = ThreadPool(max(workers, 1))
+    try:
+        for chunk in chunks:
+            groups = []
+            user_items = {}
+            for item in model.objects.filter(id__in=chunk).order_by('date', 'id'):
+                if item.user_id not in user_items:
+                    user_items[item.user_id] = []
+                    groups.append(user_items[item.user_id])
+                user_items[item.user_id].append(item)
+            outcomes = pool.map(lambda items: _submit_items(submit, items), groups)
+
+            sent = []
+            failed = []
+            for item, epidb_id, error in [outcome for group in outcomes for outcome in group]:
+                if error is None:
+                    sent.append((item, epidb_id))
+                    continue
+                attempts = item.attempts + 1
+                dead = attempts >= EPIDB_MAX_ATTEMPTS
+                failed.append((attempts, now + timedelta(seconds=get_retry_delay(attempts)), dead, item.id))
+                if dead:
+                    result.dead += 1
+            result.sent += len(sent)
+            result.error += len(failed)
+
+            with transaction.commit_on_success():
+                if sent:
+                    model.set_sent(sent)
+                bulk_update(connection, model._meta.db_table, ['attempts', 'next_attempt', 'dead'], failed)
+    finally:
+        pool.close()
+        pool.join()
+
+    result.elapsed = time.time() - start
+    return result
+
+def flush_response_queue(workers=None, chunk_size=None):
+    client = get_epidb_client()
+    return _flush_queue(models.ResponseSendQueue, client.response_submit, workers, chunk_size)
+
+def flush_profile_queue(workers=None, chunk_size=None):
+    client = get_epidb_client()
+    return _flush_queue(models.ProfileSendQueue, client.profile_update, workers, chunk_size)
 
 ### Local data storage management
 
@@ -76,50 +76,83 @@ def _get_person_health_status(request, survey, global_id):
         status = result[0] if result else None
     return (status, _decode_person_health_status(status))
 
-def _get_person_is_female(global_id, table="pollster_results_intake"):
+def _get_persons_are_female(global_ids, table="pollster_results_intake"):
+    """Map each global_id to True (female), False (male) or None (unknown)."""
+    result = dict([(global_id, None) for global_id in global_ids])
+    if not global_ids:
+        return result
     try:
         cursor = connection.cursor()
-        queries = {
-            'sqlite':"""SELECT Q1 FROM """ + table + """ WHERE global_id = %s""",
-            'mysql':"""SELECT `Q1` FROM """ + table + """ WHERE `global_id` = %s""",
-            'postgresql':"""SELECT "Q1" FROM """ + table + """ WHERE "global_id" = %s""",
-        }
-        cursor.execute(queries[utils.get_db_type(connection)], [global_id,])
-        return cursor.fetchone()[0] == 1 # 0 for male, 1 for female
-    except:
-        return None
+        qn = connection.ops.quote_name
+        cursor.execute("SELECT %s, %s FROM %s WHERE %s IN (%s)" % (
+            qn('global_id'), qn('Q1'), table, qn('global_id'), ', '.join(['%s'] * len(global_ids))), list(global_ids))
+        for global_id, q1 in cursor.fetchall():
+            if result.get(global_id) is None:
+                result[global_id] = q1 == 1 # 0 for male, 1 for female
+    except DatabaseError:
+        pass
+    return result
 
-def _get_health_history(request, survey, table="pollster_results_weekly"):
-    results = []
+def _get_health_rows(user_id, table="pollster_results_weekly"):
+    """
+    (timestamp, global_id, status) of all the weekly submissions of a user,
+    latest first; status is None for submissions without a health status.
+    """
     cursor = connection.cursor()
-    params = { 'user_id': request.user.id }
+    params = { 'user_id': user_id }
     queries = {
         'sqlite':"""
             SELECT W.timestamp, W.global_id, S.status
-              FROM pollster_health_status S, """ + table + """ W
-             WHERE S.pollster_results_weekly_id = W.id
-               AND W.user = :user_id
+              FROM """ + table + """ W
+              LEFT JOIN pollster_health_status S ON S.pollster_results_weekly_id = W.id
+             WHERE W.user = :user_id
              ORDER BY W.timestamp DESC""",
         'mysql':"""
             SELECT W.timestamp, W.global_id, S.status
-              FROM pollster_health_status S, """ + table + """ W
-             WHERE S.pollster_results_weekly_id = W.id
-               AND W.user = :user_id
+              FROM """ + table + """ W
+              LEFT JOIN pollster_health_status S ON S.pollster_results_weekly_id = W.id
+             WHERE W.user = :user_id
              ORDER BY W.timestamp DESC""",
         'postgresql':"""
             SELECT W.timestamp, W.global_id, S.status
-              FROM pollster_health_status S, """ + table + """ W
-             WHERE S.pollster_results_weekly_id = W.id
-               AND W.user = %(user_id)s
+              FROM """ + table + """ W
+              LEFT JOIN pollster_health_status S ON S.pollster_results_weekly_id = W.id
+             WHERE W.user = %(user_id)s
              ORDER BY W.timestamp DESC""",
     }
     cursor.execute(queries[utils.get_db_type(connection)], params)
+    return cursor.fetchall()
+
+def _get_dashboard(request, weekly_table="pollster_results_weekly", intake_table="pollster_results_intake", history_limit=None):
+    """
+    Return the (not deleted) SurveyUsers of the current user, each with its
+    latest health status, health history (latest first, at most
+    `history_limit` entries) and gender, and the health history of all of
+    them; uses the same three queries whatever the number of persons.
+    """
+    persons = list(models.SurveyUser.objects.filter(user=request.user, deleted=False))
+    persons_dict = dict([(p.global_id, p) for p in persons])
 
-    results = cursor.fetchall()
-    for ret in results:
-        timestamp, global_id, status = ret
-        survey_user = models.SurveyUser.objects.get(global_id=global_id)
-        yield {'global_id': global_id, 'timestamp': timestamp, 'status': status, 'diag':_decode_person_health_status(status), 'survey_user': survey_user}
+    history = []
+    latest_status = {}
+    person_history = {}
+    for timestamp, global_id, status in _get_health_rows(request.user.id, weekly_table):
+        # The latest submission decides the status, even without a diagnosis.
+        latest_status.setdefault(global_id, status)
+        if status is None:
+            continue
+        item = {'global_id': global_id, 'timestamp': timestamp, 'status': status, 'diag':_decode_person_health_status(status),
+                'person': persons_dict.get(global_id)}
+        history.append(item)
+        person_history.setdefault(global_id, []).append(item)
+
+    is_female = _get_persons_are_female([p.global_id for p in persons], table=intake_table)
+    for person in persons:
+        status = latest_status.get(person.global_id)
+        person.health_status, person.diag = status, _decode_person_health_status(status)
+        person.health_history = person_history.get(person.global_id, [])[:history_limit]
+        person.is_female = is_female.get(person.global_id)
+    return persons, history
 
 
 @login_required
@@ -148,25 +181,19 @@ def group_management(request):
                         _(u'Please complete the background questionnaire for the participant "%(user_name)s" before marking him/her as healthy.') % {'user_name': survey_user.name})
                     continue
 
-                Weekly.objects.create(
+                weekly = Weekly.objects.create(
                     user=request.user.id,
                     global_id=survey_user.global_id,
                     Q1_0=True, # Q1_0 => "No symptoms. The other fields are assumed to have the correct default information in them.
                     timestamp=datetime.now(),
                 )
+                pollster.models.update_health_status([weekly.id])
+                pollster.models.update_last_survey(request.user.id)
             elif request.POST.get('action') == 'delete':
                 survey_user.deleted = True
                 survey_user.save()
 
-    history = list(_get_health_history(request, survey))
-    persons = models.SurveyUser.objects.filter(user=request.user, deleted=False)
-    persons_dict = dict([(p.global_id, p) for p in persons])
-    for item in history:
-        item['person'] = persons_dict.get(item['global_id'])
-    for person in persons:
-        person.health_status, person.diag = _get_person_health_status(request, survey, person.global_id)
-        person.health_history = [i for i in history if i['global_id'] == person.global_id][:10]
-        person.is_female = _get_person_is_female(person.global_id)
+    persons, history = _get_dashboard(request, history_limit=10)
 
     return render_to_response('survey/group_management.html', {'persons': persons, 'history': history, 'gid': request.GET.get("gid")},
                               context_instance=RequestContext(request))
@@ -200,14 +227,7 @@ def group_archive(request, year=None):
         [(year, "%s - %s" % (year, year + 1)) for (year, _) in settings.POLLSTER_HISTORICAL_WEEKLIES]
     )
 
-    history = list(_get_health_history(request, survey, table=weekly_table))
-    persons = models.SurveyUser.objects.filter(user=request.user, deleted=False)
-    persons_dict = dict([(p.global_id, p) for p in persons])
-    for item in history:
-        item['person'] = persons_dict.get(item['global_id'])
-    for person in persons:
-        person.health_history = [i for i in history if i['global_id'] == person.global_id]
-        person.is_female = _get_person_is_female(person.global_id, table=intake_table)
+    persons, history = _get_dashboard(request, weekly_table=weekly_table, intake_table=intake_table)
 
     return render_to_response('survey/group_archive.html', {'persons': persons, 'history': history, 'gid': request.GET.get("gid"), 'seasons': seasons, 'season': season},
                               context_instance=RequestContext(request))
@@ -17,6 +17,7 @@ urlpatterns = patterns('',
     (r'^admin/surveys-editor/', include('apps.pollster.urls')),
     (r'^admin/', include(admin.site.urls)),
     url(r'^surveys/(?P<survey_shortname>.+)/charts/(?P<chart_shortname>.+)/tile/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)$', 'apps.pollster.views.map_tile', name='pollster_map_tile'),
+    url(r'^surveys/(?P<survey_shortname>.+)/charts/(?P<chart_shortname>.+)/geojson/(?P<z>\d+)$', 'apps.pollster.views.map_geojson', name='pollster_map_geojson'),
     url(r'^surveys/(?P<survey_shortname>.+)/charts/(?P<chart_shortname>.+)/click/(?P<lat>[\d.-]+)/(?P<lng>[\d.-]+)$', 'apps.pollster.views.map_click', name='pollster_map_click'),
     url(r'^surveys/(?P<survey_shortname>.+)/charts/(?P<chart_shortname>.+)\.json$', 'apps.pollster.views.chart_data', name='pollster_chart_data'),
     url(r'^surveys/(?P<shortname>.+)/$', 'apps.pollster.views.survey_run', name="survey_run"),